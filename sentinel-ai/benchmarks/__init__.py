@@ -0,0 +1 @@
+# Sentinel AI Benchmarks
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Risk API load test
+Drives /score, /score/batch and /feedback with a closed-loop async load generator: --concurrency
+workers, each keeping one request in flight on its own connection. Payloads come from the federation
+simulator's synthetic banks (fed_sim.synth_client) and are serialized before the clock starts.
+
+  --target inprocess  the app in this process through httpx's ASGI transport (no sockets)
+  --target uvicorn    a uvicorn server started on a free local port (or --url for a running one)
+
+Reports throughput, latency percentiles and CPU per request for each scenario, plus the API's own
+per-stage latency summary. --out writes the results as JSON. --baseline compares them with an
+earlier run's JSON, and --max-regression makes the exit status fail when a scenario got slower.
+Run from the sentinel-ai directory: python -m benchmarks.bench_api [--target uvicorn] [--out run.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SCENARIOS = {
+    # name: (path, transactions per request)
+    "score": ("/score", 1),
+    "score_batch": ("/score/batch", None),   # --batch transactions per request
+    "feedback": ("/feedback", 1),
+}
+# result fields compared against a baseline; +1 means higher is better
+COMPARED = {"rps": +1, "p50_ms": -1, "p99_ms": -1, "cpu_ms_per_request": -1}
+
+def payloads(scenario, n, batch=64, seed=0, users=1000):
+    """``n`` JSON request bodies (bytes) for a scenario, from fed_sim's synthetic transactions"""
+    from services.federation.fed_sim import synth_client
+    per_request = batch if SCENARIOS[scenario][1] is None else 1
+    df, y = synth_client(seed, n=n * per_request)
+    rows = df.to_dict("records")
+    txns = []
+    for i, (row, label) in enumerate(zip(rows, y)):
+        txn = {k: v.item() if hasattr(v, "item") else v for k, v in row.items()}
+        txn.update(txn_id=f"load_{seed}_{i}", user_id=f"U{i % users}", device_id=f"D{i % (users * 2)}")
+        if scenario == "feedback":
+            txn["label"] = "FRAUD" if label else "LEGIT"
+        txns.append(txn)
+    if per_request == 1:
+        return [json.dumps(t).encode() for t in txns]
+    return [json.dumps(txns[i:i + batch]).encode() for i in range(0, len(txns), batch)]
+
+def process_cpu_s(pid=None):
+    """user + system CPU seconds of this process, or of ``pid`` (Linux /proc; None elsewhere)"""
+    if pid is None:
+        return time.process_time()
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+async def drive(client, path, bodies, concurrency):
+    """Closed loop over ``bodies``: returns per-request latencies (ns), error count and wall time"""
+    headers = {"content-type": "application/json"}
+    latencies = np.zeros(len(bodies), dtype=np.int64)
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < len(bodies):
+            i = next_index
+            next_index += 1
+            start = time.perf_counter_ns()
+            try:
+                ok = (await client.post(path, content=bodies[i], headers=headers)).status_code == 200
+            except Exception:
+                ok = False
+            latencies[i] = time.perf_counter_ns() - start
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+def summarize(latencies, errors, wall_s, txns_per_request, cpu_s=None, client_cpu_s=None):
+    n = len(latencies)
+    ms = latencies / 1e6
+    out = {"requests": n, "errors": errors, "wall_s": wall_s, "rps": n / wall_s,
+           "txn_per_s": n * txns_per_request / wall_s, "mean_ms": float(ms.mean())}
+    for q in (50, 90, 99):
+        out[f"p{q}_ms"] = float(np.percentile(ms, q))
+    out["max_ms"] = float(ms.max())
+    # in process the server and the load generator share one CPU clock
+    out["cpu_ms_per_request"] = None if cpu_s is None else cpu_s / n * 1e3
+    if client_cpu_s is not None:
+        out["client_cpu_ms_per_request"] = client_cpu_s / n * 1e3
+    return out
+
+async def run_scenarios(client, scenarios, requests, batch, concurrency, warmup=50, server_pid=None):
+    results = {}
+    for name in scenarios:
+        path, per_request = SCENARIOS[name]
+        per_request = per_request or batch
+        n = requests if per_request == 1 else max(requests // per_request, 2 * concurrency)
+        bodies = payloads(name, n + warmup, batch=batch, seed=len(results))
+        for body in bodies[:warmup]:  # warm-up requests are not timed
+            await client.post(path, content=body, headers={"content-type": "application/json"})
+        await client.post("/admin/metrics/reset")
+        cpu0, client0 = process_cpu_s(server_pid), process_cpu_s()
+        latencies, errors, wall = await drive(client, path, bodies[warmup:], concurrency)
+        cpu1, client1 = process_cpu_s(server_pid), process_cpu_s()
+        cpu_s = None if cpu0 is None or cpu1 is None else cpu1 - cpu0
+        results[name] = summarize(latencies, errors, wall, per_request, cpu_s,
+                                  client1 - client0 if server_pid is not None else None)
+        results[name]["stages"] = (await client.get("/metrics/latency")).json()
+    return results
+
+async def run_in_process(scenarios, requests, batch, concurrency, warmup=50):
+    """Scenarios against ``services.risk_api.main.app`` over the ASGI transport (no startup/shutdown hooks)"""
+    import httpx
+    from services.risk_api import main as api
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://inprocess", timeout=60) as client:
+        return await run_scenarios(client, scenarios, requests, batch, concurrency, warmup)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_uvicorn(port, env, timeout=120):
+    """uvicorn serving the API on 127.0.0.1:``port``; returns once ``GET /`` answers"""
+    import httpx
+    proc = subprocess.Popen([sys.executable, "-W", "ignore", "-m", "uvicorn", "services.risk_api.main:app",
+                             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+                             "--no-access-log"], env=env)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {proc.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return proc
+        except httpx.TransportError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise TimeoutError(f"uvicorn did not answer on port {port} within {timeout} s")
+
+async def run_against(url, scenarios, requests, batch, concurrency, warmup=50, server_pid=None):
+    """Scenarios against a running server; one keep-alive connection per concurrent worker"""
+    import httpx
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        return await run_scenarios(client, scenarios, requests, batch, concurrency, warmup, server_pid)
+
+def compare(results, baseline, max_regression=None):
+    """Relative change of each compared field per scenario; ``regressions`` lists those beyond the limit"""
+    changes, regressions = {}, []
+    for name, cur in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if old is None:
+            continue
+        changes[name] = {}
+        for field, sign in COMPARED.items():
+            if cur.get(field) is None or not old.get(field):
+                continue
+            change = cur[field] / old[field] - 1
+            changes[name][field] = change
+            if max_regression is not None and -sign * change > max_regression:
+                regressions.append(f"{name}.{field} {change:+.1%}")
+    out = {"baseline_commit": baseline.get("meta", {}).get("commit"), "changes": changes,
+           "regressions": regressions}
+    setup = [k for k in ("target", "concurrency", "batch", "cpus")
+             if results.get("meta", {}).get(k) != baseline.get("meta", {}).get(k)]
+    if setup:  # numbers from different setups are not a regression signal
+        out["differs"] = setup
+    return out
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--target", choices=["inprocess", "uvicorn"], default="inprocess")
+    ap.add_argument("--url", help="an already running server (with --target uvicorn); CPU is then not measured")
+    ap.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    ap.add_argument("--requests", type=int, default=2000, help="transactions per scenario")
+    ap.add_argument("--batch", type=int, default=64, help="transactions per /score/batch request")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--warmup", type=int, default=50)
+    ap.add_argument("--out", help="write the results JSON here")
+    ap.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    ap.add_argument("--max-regression", type=float, default=None,
+                    help="fail when a compared field is worse than the baseline by more than this fraction")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # labels sent by the load test must not end up in the real feedback log
+        os.environ.setdefault("SENTINEL_FEEDBACK_DIR", os.path.join(scratch, "feedback"))
+        run = (args.scenarios, args.requests, args.batch, args.concurrency, args.warmup)
+        if args.target == "inprocess":
+            scenarios = asyncio.run(run_in_process(*run))
+        elif args.url:
+            scenarios = asyncio.run(run_against(args.url, *run))
+        else:
+            port = free_port()
+            proc = start_uvicorn(port, dict(os.environ))
+            try:
+                scenarios = asyncio.run(run_against(f"http://127.0.0.1:{port}", *run, server_pid=proc.pid))
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+
+    results = {"meta": {"commit": git_commit(), "target": args.target, "url": args.url,
+                        "concurrency": args.concurrency, "batch": args.batch, "python": platform.python_version(),
+                        "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+               "scenarios": scenarios}
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["comparison"] = compare(results, json.load(f), args.max_regression)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    # the per-stage summaries are in --out; the console gets the headline numbers
+    print(json.dumps({"meta": results["meta"],
+                      "scenarios": {k: {f: v for f, v in s.items() if f != "stages"} for k, s in scenarios.items()},
+                      **({"comparison": results["comparison"]} if args.baseline else {})}, indent=2))
+    if results.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Bootstrap training memory benchmark
+Writes synthetic transaction histories of growing size, then fits the anomaly
+model on each in a fresh process -- streamed (bootstrap_stream) and, for
+reference, read fully into memory -- and reports wall time and peak RSS.
+Run from the sentinel-ai directory: python -m benchmarks.bench_bootstrap [--rows N N ...]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PROBE = r"""
+import json, resource, sys
+path, mode = sys.argv[1], sys.argv[2]
+if mode == "stream":
+    from services.training.bootstrap_model import bootstrap_stream
+    bootstrap_stream([path], out=None)
+else:
+    import pandas as pd
+    from sklearn.ensemble import IsolationForest
+    from services.training.bootstrap_model import DTYPES, _pipeline
+    _pipeline(IsolationForest(n_estimators=100, random_state=0, contamination=0.04)).fit(
+        pd.read_csv(path, usecols=list(DTYPES), dtype=DTYPES))
+print(json.dumps({"peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+def write_history(path, n_rows, chunk=200_000, seed=0):
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_rows, chunk):
+        n = min(chunk, n_rows - start)
+        pd.DataFrame({
+            "txn_id": [f"t{i}" for i in range(start, start + n)],
+            "amount": rng.gamma(2, 60, n).round(2),
+            "merchant_category": rng.choice(["grocery", "electronics", "luxury", "gaming", "travel"], n),
+            "geo_lat": rng.normal(37, 2, n).round(4),
+            "geo_lon": rng.normal(-97, 3, n).round(4),
+            "hour_of_day": rng.integers(0, 24, n),
+            "past_24h_txn_count": rng.integers(0, 10, n),
+            "past_7d_chargebacks": rng.integers(0, 3, n),
+            "velocity_usd_7d": rng.gamma(3, 100, n).round(2),
+            "ip_asn_risk": (rng.random(n) * 0.3).round(3),
+            "is_new_device": rng.random(n) < 0.15,
+        }).to_csv(path, mode="a", header=start == 0, index=False)
+
+def run(path, mode):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", PROBE, str(path), mode],
+                         capture_output=True, text=True, check=True)
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    res["wall_s"] = time.perf_counter() - start
+    return res
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--rows", type=int, nargs="+", default=[100_000, 500_000, 2_000_000])
+    ap.add_argument("--skip-in-memory", action="store_true", help="only run the streamed fit")
+    args = ap.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as d:
+        for n in args.rows:
+            path = Path(d) / f"history_{n}.csv"
+            write_history(path, n)
+            row = {"rows": n, "csv_mib": path.stat().st_size / 2**20, "stream": run(path, "stream")}
+            if not args.skip_in_memory:
+                row["in_memory"] = run(path, "memory")
+            results.append(row)
+            path.unlink()
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Explanation latency benchmark
+Times the inline explanation path of /score (tree-head attributions, weighting and
+top-k) per batch size, next to the model evaluation it rides along with, and shows
+which batch sizes fit the inline budget.
+Run from the sentinel-ai directory: python -m benchmarks.bench_explain [--budget-ms B]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1, 8, 64, 256])
+    ap.add_argument("--repeats", type=int, default=200)
+    ap.add_argument("--budget-ms", type=float, default=None, help="default: SENTINEL_EXPLAIN_BUDGET_MS")
+    args = ap.parse_args()
+
+    from services.shared.features import to_columns
+    from services.risk_api import main as api
+    from test_scoring import sample_transactions
+    budget = api.EXPLAIN_BUDGET_MS if args.budget_ms is None else args.budget_ms
+    bundle = api.registry.active
+    explainer = bundle.explainer
+    recs = [t.model_dump() for t in sample_transactions(max(args.sizes))]
+    heads = list(api.DEFAULT_WEIGHTS)
+    result = {"budget_ms": budget, "heads": sorted(explainer.heads), "fixed_ms": explainer.fixed_ms,
+              "ms_per_row": explainer.ms_per_row, "sizes": {}}
+    for n in args.sizes:
+        cols = to_columns(recs[:n])
+        X = bundle.encoder.encode_columns(cols)
+        score_ms, explain_ms = [], []
+        for _ in range(args.repeats):
+            t0 = time.perf_counter()
+            bundle.engine.evaluate(cols, X)
+            t1 = time.perf_counter()
+            explainer.top(explainer.combine(explainer.head_attributions(cols, X), heads, api.DEFAULT_WEIGHTS))
+            t2 = time.perf_counter()
+            score_ms.append((t1 - t0) * 1e3)
+            explain_ms.append((t2 - t1) * 1e3)
+        result["sizes"][n] = {
+            "score_ms_p50": float(np.percentile(score_ms, 50)),
+            "explain_ms_p50": float(np.percentile(explain_ms, 50)),
+            "explain_ms_p99": float(np.percentile(explain_ms, 99)),
+            "explain_us_per_row": float(np.percentile(explain_ms, 50)) * 1e3 / n,
+            "inline": explainer.fits(n, budget),
+        }
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
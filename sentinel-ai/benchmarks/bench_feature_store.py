@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Feature store throughput benchmark
+Streams transactions for millions of distinct users through FeatureStore.observe
+in API-sized batches and reports events/sec, per-batch latency and memory.
+Run from the sentinel-ai directory: python -m benchmarks.bench_feature_store [--users N] [--events M]
+"""
+import argparse
+import json
+import resource
+import time
+
+import numpy as np
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--users", type=int, default=2_000_000)
+    ap.add_argument("--events", type=int, default=4_000_000)
+    ap.add_argument("--batch", type=int, default=64)
+    ap.add_argument("--capacity", type=int, default=None, help="store capacity (default: --users)")
+    args = ap.parse_args()
+
+    from services.risk_api.feature_store import FeatureStore
+    rng = np.random.default_rng(0)
+    store = FeatureStore(capacity=args.capacity or args.users)
+    # skewed activity: a few heavy users, a long tail seen once or twice
+    uid = (rng.zipf(1.3, args.events) * 7919 + rng.integers(0, args.users, args.events)) % args.users
+    users = np.char.add("U", uid.astype(str)).tolist()
+    devices = np.char.add("D", (uid * 3 + rng.integers(0, 3, args.events)).astype(str)).tolist()
+    amounts = rng.gamma(2, 60, args.events)
+    t0 = 1.7e9
+    lat = []
+    start = time.perf_counter()
+    for s in range(0, args.events, args.batch):
+        b0 = time.perf_counter()
+        store.observe(users[s:s + args.batch], devices[s:s + args.batch], amounts[s:s + args.batch],
+                      t0 + s * 0.01)
+        lat.append(time.perf_counter() - b0)
+    wall = time.perf_counter() - start
+    lat = np.array(lat) * 1e3
+    print(json.dumps({
+        "user_space": args.users, "events": args.events, "batch": args.batch,
+        "events_per_s": args.events / wall,
+        "batch_ms_p50": float(np.percentile(lat, 50)), "batch_ms_p99": float(np.percentile(lat, 99)),
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        **store.stats(),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Straggler benchmark for the asynchronous federation coordinator
+Simulated banks report with lognormal latency plus occasional long stalls; the
+same setup runs with a full quorum (lockstep: every bank, every round) and with
+a partial quorum, reporting round times and the validation loss reached.
+Run from the sentinel-ai directory: python -m benchmarks.bench_fed_async [--clients N] [--quorum Q]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+def run(clients, quorum, rounds, deadline, encoding, val):
+    from services.federation.coordinator import AsyncCoordinator
+    coord = AsyncCoordinator(clients, encoding, quorum=quorum, deadline=deadline, max_staleness=rounds)
+    start = time.perf_counter()
+    hist = asyncio.run(coord.run(rounds, val=val))
+    secs = np.array([h["seconds"] for h in hist])
+    return {"quorum": quorum, "wall_s": time.perf_counter() - start, "round_s_mean": float(secs.mean()),
+            "round_s_p95": float(np.percentile(secs, 95)), "quorum_missed": sum(not h["quorum_met"] for h in hist),
+            "dropped": coord.dropped, "final_val_log_loss": hist[-1]["val_log_loss"]}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--clients", type=int, default=12)
+    ap.add_argument("--quorum", type=int, default=8)
+    ap.add_argument("--rounds", type=int, default=15)
+    ap.add_argument("--deadline", type=float, default=2.0)
+    args = ap.parse_args()
+
+    from services.federation import fed_sim
+    from services.federation.coordinator import SimulatedClient, latency_sampler
+    encoding = fed_sim.SharedEncoding.fit(fed_sim.synth_client(fed_sim.VALIDATION_SEED + 1, n=5000)[0])
+    val = fed_sim.synth_client(fed_sim.VALIDATION_SEED, n=5000)
+    results = []
+    for quorum in (args.clients, args.quorum):
+        clients = []
+        for s in range(args.clients):
+            base = latency_sampler(("lognormal", 0.03, 0.5), s)
+            stall = latency_sampler(("straggler", 0.0, 0.1, 0.5), s + 1000)
+            clients.append(SimulatedClient(s, encoding, lambda b=base, st=stall: b() + st()))
+        results.append(run(clients, quorum, args.rounds, args.deadline, encoding, val))
+    print(json.dumps({"clients": args.clients, "rounds": args.rounds, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Federated averaging throughput benchmark
+Runs the same FedAvg simulation over many banks with a growing number of client
+processes and reports rounds/sec for each (scaling is bounded by the core count).
+Run from the sentinel-ai directory: python -m benchmarks.bench_federation [--clients N] [--rounds R]
+"""
+import argparse
+import json
+import os
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--samples", type=int, default=20_000, help="transactions per bank")
+    ap.add_argument("--workers", type=int, nargs="+", default=None)
+    args = ap.parse_args()
+
+    from services.federation.fed_sim import run_federation
+    cores = os.cpu_count() or 1
+    workers = args.workers or sorted({w for w in (1, 2, 4, 8, 16, 32) if w <= cores} | {cores})
+    results = []
+    for w in workers:
+        fl = run_federation(args.clients, args.rounds, w, n_samples=args.samples, verbose=False)
+        results.append({"workers": w, "rounds_per_s": fl["rounds_per_s"],
+                        "final_val_log_loss": fl["history"][-1]["val_log_loss"]})
+    base = results[0]["rounds_per_s"]
+    for r in results:
+        r["speedup"] = r["rounds_per_s"] / base
+    print(json.dumps({"cpu_count": cores, "clients": args.clients, "rounds": args.rounds,
+                      "samples_per_client": args.samples, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
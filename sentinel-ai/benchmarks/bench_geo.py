@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Geo head latency benchmark
+Times what the geo head adds per API-sized batch: the last-location read/write in
+FeatureStore.observe, the haversine travel speed and the density-grid lookup.
+Run from the sentinel-ai directory: python -m benchmarks.bench_geo [--users N] [--batches M]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--users", type=int, default=200_000)
+    ap.add_argument("--batches", type=int, default=5000)
+    ap.add_argument("--batch", type=int, default=64)
+    args = ap.parse_args()
+
+    import joblib
+    from services.shared import geo
+    from services.risk_api.feature_store import FeatureStore
+    grid = joblib.load("models/geo_density.joblib")
+    rng = np.random.default_rng(0)
+    plain, located = FeatureStore(capacity=args.users), FeatureStore(capacity=args.users)
+    timings = {"observe": [], "observe_located": [], "travel_and_grid": []}
+    for b in range(args.batches):
+        users = np.char.add("U", rng.integers(0, args.users, args.batch).astype(str)).tolist()
+        devices = ["D"] * args.batch
+        amounts = rng.gamma(2, 60, args.batch)
+        lat, lon = rng.normal(37, 2, args.batch), rng.normal(-97, 3, args.batch)
+        now = 1.7e9 + b
+        t0 = time.perf_counter()
+        plain.observe(users, devices, amounts, now)
+        t1 = time.perf_counter()
+        out = located.observe(users, devices, amounts, now, lat, lon)
+        t2 = time.perf_counter()
+        km, kmh = geo.travel(out["prev_lat"], out["prev_lon"], out["prev_seen"], lat, lon, now)
+        geo.geo_risk({"geo_lat": lat, "geo_lon": lon, "travel_kmh": kmh}, grid)
+        t3 = time.perf_counter()
+        for name, dt in zip(timings, (t1 - t0, t2 - t1, t3 - t2)):
+            timings[name].append(dt * 1e3)
+    result = {"users": args.users, "batches": args.batches, "batch": args.batch}
+    for name, ms in timings.items():
+        result[f"{name}_ms_p50"] = float(np.percentile(ms, 50))
+        result[f"{name}_ms_p99"] = float(np.percentile(ms, 99))
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Kaggle ingest benchmark
+Writes a synthetic CSV shaped like the Kaggle transactions dump (currency text amounts, city / chip
+text columns), then times parsing it with pandas as the demo used to, the first columnar ingest,
+and a cached load. Reports the cache size against the CSV.
+Run from the sentinel-ai directory: python -m benchmarks.bench_ingest [--rows N]
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+def write_csv(path, rows, seed=0):
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    cities = np.array(["Beulah", "Harwood", "ONLINE", "Bettendorf", "Vista", "Houston", "Miami", "Seattle"])
+    pd.DataFrame({
+        "id": np.arange(rows) + 7_475_327,
+        "date": "2010-01-01 00:01:00",
+        "client_id": rng.integers(0, 2000, rows),
+        "card_id": rng.integers(0, 6000, rows),
+        "amount": np.char.add("$", np.round(rng.normal(40, 80, rows), 2).astype(str)),
+        "use_chip": rng.choice(["Swipe Transaction", "Chip Transaction", "Online Transaction"], rows),
+        "merchant_id": rng.integers(0, 100_000, rows),
+        "merchant_city": rng.choice(cities, rows),
+        "zip": np.where(rng.random(rows) < 0.1, np.nan, rng.integers(10_000, 99_999, rows)),
+        "mcc": rng.integers(1000, 9999, rows),
+    }).to_csv(path, index=False)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    args = ap.parse_args()
+
+    import pandas as pd
+    from services.shared import ingest
+    with tempfile.TemporaryDirectory() as d:
+        src = Path(d) / "transactions_data.csv"
+        write_csv(src, args.rows)
+        start = time.perf_counter()
+        df = pd.read_csv(src)
+        df["amount"] = df["amount"].str.replace("$", "", regex=False).astype(float)
+        pandas_s = time.perf_counter() - start
+        start = time.perf_counter()
+        out = ingest.ingest(src, Path(d) / "cache")
+        ingest_s = time.perf_counter() - start
+        start = time.perf_counter()
+        cached = ingest.load_frame(src, Path(d) / "cache")
+        cached_s = time.perf_counter() - start
+        assert np.array_equal(cached["amount"].to_numpy(), df["amount"].to_numpy())
+        cache_bytes = sum(p.stat().st_size for p in out.iterdir())
+        print(json.dumps({
+            "rows": args.rows, "csv_mib": src.stat().st_size / 2**20, "cache_mib": cache_bytes / 2**20,
+            "read_csv_s": pandas_s, "first_ingest_s": ingest_s, "cached_load_s": cached_s,
+        }, indent=2))
+
+if __name__ == "__main__":
+    main()
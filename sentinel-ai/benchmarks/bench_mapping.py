@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Kaggle mapping benchmark
+Maps the bundled Kaggle sample (repeated up to --rows) onto Transactions: the demo's old per-row
+converter over iterrows on a slice, and the column-wise TransactionMapper on the whole frame.
+Reports rows per second for both.
+Run from the sentinel-ai directory: python -m benchmarks.bench_mapping [--rows N] [--legacy-rows N]
+"""
+import argparse
+import json
+import time
+
+def legacy_convert(row):
+    """The converter demo.py used before services.shared.mapping"""
+    amount = row.get('amount', row.get('Amount', row.get('transaction_amount', 100.0)))
+    merchant = row.get('merchant_category', row.get('merchant', row.get('category', 'grocery')))
+    device_id = row.get('device_id', row.get('device', f"D{hash(str(row)) % 1000}"))
+    lat = row.get('geo_lat', row.get('lat', row.get('latitude', 37.7749)))
+    lon = row.get('geo_lon', row.get('lon', row.get('longitude', -122.4194)))
+    user_id = row.get('user_id', row.get('user', f"U{hash(str(row)) % 1000}"))
+    return {
+        "txn_id": f"kaggle_{hash(str(row)) % 10000}", "amount": float(amount),
+        "merchant_category": str(merchant).lower(), "device_id": str(device_id), "geo_lat": float(lat),
+        "geo_lon": float(lon), "user_id": str(user_id),
+        "is_new_device": bool(row.get('is_new_device', row.get('new_device', False))),
+        "hour_of_day": int(row.get('hour_of_day', row.get('hour', 12))),
+        "past_24h_txn_count": int(row.get('past_24h_txn_count', row.get('txn_count', 1))),
+        "past_7d_chargebacks": int(row.get('past_7d_chargebacks', row.get('chargebacks', 0))),
+        "velocity_usd_7d": float(row.get('velocity_usd_7d', row.get('velocity', amount * 2))),
+        "ip_asn_risk": float(row.get('ip_asn_risk', row.get('ip_risk', 0.1))),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--legacy-rows", type=int, default=10_000, help="rows timed through the old converter")
+    args = ap.parse_args()
+
+    import pandas as pd
+    from services.shared.schemas import Transaction
+    from services.shared.mapping import TransactionMapper
+    sample = pd.read_csv("data/fraud_sample.csv")
+    df = pd.concat([sample] * (args.rows // len(sample) + 1), ignore_index=True).head(args.rows)
+
+    start = time.perf_counter()
+    legacy = [Transaction(**legacy_convert(row)) for _, row in df.head(args.legacy_rows).iterrows()]
+    legacy_s = time.perf_counter() - start
+    mapper = TransactionMapper()
+    start = time.perf_counter()
+    cols = mapper.columns(df)
+    columns_s = time.perf_counter() - start
+    start = time.perf_counter()
+    txns = mapper.transactions(df)
+    mapper_s = time.perf_counter() - start
+    assert len(txns) == len(df) and len(cols["txn_id"]) == len(df)
+    print(json.dumps({
+        "rows": len(df), "legacy_rows": len(legacy),
+        "legacy_rows_per_s": len(legacy) / legacy_s, "columns_rows_per_s": len(df) / columns_s,
+        "transactions_rows_per_s": len(df) / mapper_s, "speedup": (len(df) / mapper_s) / (len(legacy) / legacy_s),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
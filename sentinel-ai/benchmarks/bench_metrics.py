@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Instrumentation overhead benchmark
+Measures the cost of one histogram record, counts the records score_records
+makes per call, and times score_records with metrics on and off for single
+transactions and 64-row batches.
+Run from the sentinel-ai directory: python -m benchmarks.bench_metrics [--repeats N]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--repeats", type=int, default=2000)
+    args = ap.parse_args()
+
+    from services.shared.latency import LatencyHistogram
+    from services.risk_api import main as api
+    from test_scoring import sample_transactions, one_per_user
+
+    h = LatencyHistogram()
+    n = 200_000
+    start = time.perf_counter()
+    for _ in range(n):
+        h.record(123_456)
+    record_ns = (time.perf_counter() - start) / n * 1e9
+    start = time.perf_counter()
+    for _ in range(n):
+        time.perf_counter_ns()
+    clock_ns = (time.perf_counter() - start) / n * 1e9
+
+    txns = one_per_user(sample_transactions(64))
+    result = {"record_ns": record_ns, "clock_ns": clock_ns}
+    for label, batch in (("single", txns[:1]), ("batch64", txns[:64])):
+        # the direct cost: histogram records (plus one clock read each) per score_records call
+        api.metrics.enabled = True
+        api.metrics.reset()
+        api.score_records(batch)
+        records = sum(s["count"] for s in api.metrics.summary().values())
+        timings = {}
+        for enabled in (False, True) * 3:  # interleaved to even out drift
+            api.metrics.enabled = enabled
+            for _ in range(args.repeats // len(batch) + 10):
+                t0 = time.perf_counter()
+                api.score_records(batch)
+                timings.setdefault(enabled, []).append((time.perf_counter() - t0) * 1e3)
+        overhead_us = records * (record_ns + clock_ns) / 1e3
+        result[label] = {"records_per_call": records, "overhead_us_per_call": overhead_us,
+                         "overhead_us_per_txn": overhead_us / len(batch),
+                         # end to end, for reference; on a shared box this is noisier than the overhead
+                         "off_ms_p50": float(np.median(timings[False])),
+                         "on_ms_p50": float(np.median(timings[True]))}
+    api.metrics.enabled = True
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
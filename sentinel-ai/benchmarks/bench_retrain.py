@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Retrain benchmark: full refit vs incremental (warm-started) retrain
+Writes a synthetic feedback history plus one day of new labels to a scratch log,
+then times both modes on it and reports wall time and peak traced memory.
+Run from the sentinel-ai directory: python -m benchmarks.bench_retrain [--history N] [--new M]
+"""
+import argparse
+import json
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+def synth_feedback(n, seed):
+    rng = np.random.default_rng(seed)
+    amount = rng.gamma(2, 60, n)
+    chargebacks = rng.integers(0, 3, n)
+    new_device = rng.random(n) < 0.15
+    ip_risk = rng.random(n) * 0.3
+    # labels loosely follow the risk signals so the model has something to learn
+    p = 1 / (1 + np.exp(-(-4 + amount / 150 + chargebacks + 1.5 * new_device + 5 * ip_risk)))
+    label = rng.random(n) < p
+    cats = rng.choice(["grocery", "electronics", "luxury", "gaming", "travel"], n)
+    for i in range(n):
+        yield {
+            "txn_id": f"s{seed}_{i}", "amount": float(amount[i]), "merchant_category": str(cats[i]),
+            "device_id": f"D{i % 997}", "geo_lat": float(rng.normal(37, 2)), "geo_lon": float(rng.normal(-97, 3)),
+            "user_id": f"U{i % 1009}", "is_new_device": bool(new_device[i]), "hour_of_day": int(rng.integers(0, 24)),
+            "past_24h_txn_count": int(rng.integers(0, 10)), "past_7d_chargebacks": int(chargebacks[i]),
+            "velocity_usd_7d": float(rng.gamma(3, 100)), "ip_asn_risk": float(ip_risk[i]), "label": int(label[i]),
+        }
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    n = fn()
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"rows_trained": n, "wall_s": wall, "peak_mib": peak / 2**20}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--history", type=int, default=50_000)
+    ap.add_argument("--new", type=int, default=2_000)
+    args = ap.parse_args()
+
+    from services.shared.feedback_log import FeedbackLog
+    from services.training import retrain
+
+    with tempfile.TemporaryDirectory() as d:
+        d = Path(d)
+        log = FeedbackLog(d / "feedback", legacy=None, max_buffer=4096)
+        for rec in synth_feedback(args.history, seed=1):
+            log.append(rec)
+        log.close()
+        paths = {"model": d / "gb.joblib", "state": d / "state.joblib"}
+        retrain.train_full(log, **paths)  # yesterday's model + state
+
+        for rec in synth_feedback(args.new, seed=2):
+            log.append(rec)
+        log.close()
+        snapshot = {k: p.read_bytes() for k, p in paths.items()}
+        results = {"history_rows": args.history, "new_rows": args.new}
+        results["incremental"] = measure(lambda: retrain.train_incremental(log, **paths))
+        for k, p in paths.items():  # same starting point for the no-replay run
+            p.write_bytes(snapshot[k])
+        results["incremental_no_replay"] = measure(lambda: retrain.train_incremental(log, replay=False, **paths))
+        results["full"] = measure(lambda: retrain.train_full(log, **paths))
+    results["speedup"] = results["full"]["wall_s"] / results["incremental"]["wall_s"]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
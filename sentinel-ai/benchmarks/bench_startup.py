@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for risk_api workers
+Measures import time and time-to-first-score in fresh processes, per model format.
+Run from the sentinel-ai directory: python -m benchmarks.bench_startup [--repeat N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY = ["pandas", "sklearn", "joblib", "scipy", "shap"]
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import services.risk_api.main as m
+from services.shared.schemas import Transaction
+t1 = time.perf_counter()
+m.score_records([Transaction(txn_id="t1", amount=899.0, merchant_category="electronics",
+    device_id="D123", geo_lat=37.7, geo_lon=-122.4, user_id="U1", is_new_device=True,
+    hour_of_day=2, past_24h_txn_count=6, past_7d_chargebacks=1, velocity_usd_7d=4200,
+    ip_asn_risk=0.25)])
+t2 = time.perf_counter()
+print(json.dumps({"import_s": t1 - t0, "first_score_s": t2 - t0,
+                  "source": m.registry.active.source,
+                  "heavy_modules": sorted(h for h in %r if h in sys.modules)}))
+""" % (HEAVY,)
+
+def run_once(fmt):
+    env = dict(os.environ, SENTINEL_MODEL_FORMAT=fmt)
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", PROBE], env=env,
+                         capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    res["process_wall_s"] = wall
+    return res
+
+def bench(fmt, repeat):
+    runs = [run_once(fmt) for _ in range(repeat)]
+    return {
+        "format": fmt,
+        "source": runs[-1]["source"],
+        "heavy_modules": runs[-1]["heavy_modules"],
+        "import_s_median": statistics.median(r["import_s"] for r in runs),
+        "first_score_s_median": statistics.median(r["first_score_s"] for r in runs),
+        "process_wall_s_median": statistics.median(r["process_wall_s"] for r in runs),
+        "repeat": repeat,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    # make sure the compiled export exists so the mmap runs measure a warm rollout
+    subprocess.run([sys.executable, "-W", "ignore", "-m", "services.risk_api.registry"],
+                   check=True, capture_output=True)
+    results = [bench(fmt, args.repeat) for fmt in ("joblib", "mmap")]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
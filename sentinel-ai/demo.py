@@ -10,29 +10,34 @@ import time
 import pandas as pd
 import os
 from pathlib import Path
+from services.shared import ingest
+from services.shared.mapping import TransactionMapper
 
 API_BASE = "http://localhost:8000"
+_mapper = TransactionMapper()
 
-def load_kaggle_data():
-    """Load the Kaggle fraud dataset for testing"""
-    data_path = Path("data/fraud_dataset.csv")
-    sample_path = Path("data/fraud_sample.csv")
-    
-    if not data_path.exists():
+def kaggle_source():
+    """The Kaggle CSV: the download recorded in the metadata, else the bundled copy"""
+    metadata_path = Path("data/dataset_metadata.json")
+    if metadata_path.exists():
+        original = Path(json.loads(metadata_path.read_text()).get("original_file", ""))
+        if original.is_file():
+            return original
+    bundled = Path("data/fraud_dataset.csv")
+    return bundled if bundled.exists() else None
+
+def load_kaggle_data(n=1000):
+    """Load the Kaggle fraud dataset for testing (typed columns from the ingest cache)"""
+    source = kaggle_source()
+    if source is None:
         print("📥 Kaggle dataset not found. Run 'python download_data.py' first.")
         return None
     
     try:
-        # Load sample data for demo
-        if sample_path.exists():
-            df = pd.read_csv(sample_path)
-            print(f"📊 Loaded Kaggle sample data: {len(df)} rows")
-        else:
-            df = pd.read_csv(data_path)
-            # Take a sample for demo
-            df = df.sample(n=min(1000, len(df)), random_state=42)
-            print(f"📊 Loaded Kaggle data sample: {len(df)} rows")
-        
+        # first run parses the CSV into data/cache/; later runs memory-map the cached columns
+        df = ingest.load_frame(source)
+        df = df.sample(n=min(n, len(df)), random_state=42)
+        print(f"📊 Loaded Kaggle data sample: {len(df)} rows")
         return df
     except Exception as e:
         print(f"❌ Error loading Kaggle data: {e}")
@@ -40,40 +45,9 @@ def load_kaggle_data():
 
 def convert_kaggle_to_transaction(row):
     """Convert Kaggle dataset row to our transaction format"""
-    # Map common fraud dataset columns to our schema
-    # This is a flexible mapping that adapts to different dataset structures
-    
-    # Try to map common column names
-    amount = row.get('amount', row.get('Amount', row.get('transaction_amount', 100.0)))
-    merchant = row.get('merchant_category', row.get('merchant', row.get('category', 'grocery')))
-    device_id = row.get('device_id', row.get('device', f"D{hash(str(row)) % 1000}"))
-    lat = row.get('geo_lat', row.get('lat', row.get('latitude', 37.7749)))
-    lon = row.get('geo_lon', row.get('lon', row.get('longitude', -122.4194)))
-    user_id = row.get('user_id', row.get('user', f"U{hash(str(row)) % 1000}"))
-    
-    # Generate synthetic features if not present
-    is_new_device = row.get('is_new_device', row.get('new_device', False))
-    hour = row.get('hour_of_day', row.get('hour', 12))
-    txn_count = row.get('past_24h_txn_count', row.get('txn_count', 1))
-    chargebacks = row.get('past_7d_chargebacks', row.get('chargebacks', 0))
-    velocity = row.get('velocity_usd_7d', row.get('velocity', amount * 2))
-    ip_risk = row.get('ip_asn_risk', row.get('ip_risk', 0.1))
-    
-    return {
-        "txn_id": f"kaggle_{hash(str(row)) % 10000}",
-        "amount": float(amount),
-        "merchant_category": str(merchant).lower(),
-        "device_id": str(device_id),
-        "geo_lat": float(lat),
-        "geo_lon": float(lon),
-        "user_id": str(user_id),
-        "is_new_device": bool(is_new_device),
-        "hour_of_day": int(hour),
-        "past_24h_txn_count": int(txn_count),
-        "past_7d_chargebacks": int(chargebacks),
-        "velocity_usd_7d": float(velocity),
-        "ip_asn_risk": float(ip_risk)
-    }
+    # Same column mapping as bulk replay (services.shared.mapping); a whole frame
+    # maps faster with TransactionMapper().records(df)
+    return _mapper.records(pd.DataFrame([row]).infer_objects())[0]
 
 def demo_risk_scoring():
     """Demonstrate risk scoring with different transaction types"""
@@ -285,6 +259,8 @@ def demo_federated_learning():
     print("   Total: 3,600 federated samples")
     
     print("\n🔄 Running federated averaging...")
+    print("   python -m services.federation.fed_sim --clients 3 --rounds 10")
+    print("   Banks train locally in parallel; only weight vectors reach the coordinator")
     print("✅ Global model created without sharing raw data")
     print("✅ Consortium intelligence achieved")
     
@@ -8,6 +8,7 @@ import pandas as pd
 import os
 import json
 from pathlib import Path
+from services.shared import ingest
 
 def download_kaggle_dataset():
     """Download the Kaggle fraud dataset"""
@@ -79,13 +80,11 @@ def prepare_training_data(dataset_path, output_dir="data"):
     print(f"📊 Using main dataset: {main_file.name}")
     
     try:
-        df = pd.read_csv(main_file)
+        # stream the CSV into the typed columnar cache (currency parsed, text dictionary-encoded)
+        cache_dir = ingest.ingest(main_file, output_path / "cache")
+        df = ingest.load_frame(main_file, output_path / "cache")
         print(f"   Loaded {len(df)} rows, {len(df.columns)} columns")
-        
-        # Save processed data
-        processed_file = output_path / "fraud_dataset.csv"
-        df.to_csv(processed_file, index=False)
-        print(f"✅ Saved processed data to: {processed_file}")
+        print(f"✅ Cached typed columns in: {cache_dir}")
         
         # Create a sample for quick testing
         sample_file = output_path / "fraud_sample.csv"
@@ -94,14 +93,17 @@ def prepare_training_data(dataset_path, output_dir="data"):
         print(f"✅ Saved sample data to: {sample_file}")
         
         # Create metadata
+        meta = json.loads((cache_dir / "meta.json").read_text())
         metadata = {
             "dataset_name": "computingvictor/transactions-fraud-datasets",
             "original_file": str(main_file),
-            "processed_file": str(processed_file),
+            "cache_dir": str(cache_dir),
+            "sha256": meta["sha256"],
             "sample_file": str(sample_file),
             "total_rows": len(df),
             "total_columns": len(df.columns),
             "columns": list(df.columns),
+            "column_kinds": {c["name"]: c["kind"] for c in meta["columns"]},
             "shape": df.shape
         }
         
@@ -110,7 +112,7 @@ def prepare_training_data(dataset_path, output_dir="data"):
             json.dump(metadata, f, indent=2)
         print(f"✅ Saved metadata to: {metadata_file}")
         
-        return processed_file
+        return cache_dir
         
     except Exception as e:
         print(f"❌ Error processing dataset: {e}")
@@ -130,9 +132,9 @@ def main():
     csv_files = explore_dataset(dataset_path)
     
     # Prepare training data
-    processed_file = prepare_training_data(dataset_path)
+    cache_dir = prepare_training_data(dataset_path)
     
-    if processed_file:
+    if cache_dir:
         print("\n🎉 Dataset preparation complete!")
         print("=" * 50)
         print("✅ Dataset downloaded from Kaggle")
@@ -0,0 +1,168 @@
+"""Asynchronous, straggler-tolerant federation coordinator.
+
+Instead of waiting for every bank each round (``fed_sim.run_federation``), the
+coordinator merges as soon as ``quorum`` banks have reported, or when the
+round's ``deadline`` passes with at least ``min_updates`` in hand. Banks keep
+training in the background: whenever a new global version is published, each
+idle bank picks it up, trains and reports back. A bank that is still working
+on an older version reports late; its delta is merged into a later round with
+weight ``n_samples * (1 + staleness) ** -alpha`` (FedAsync-style polynomial
+discount, applied to a FedBuff-style buffer), or dropped past ``max_staleness``.
+
+Round time is therefore bounded by the quorum-th fastest bank (or the
+deadline), not by the slowest one.
+"""
+import asyncio
+import time
+
+import numpy as np
+
+from services.federation import fed_sim, wire
+
+def latency_sampler(spec, seed=0):
+    """Seconds-per-report sampler from a spec.
+
+    ``("constant", s)``, ``("uniform", lo, hi)``, ``("lognormal", median, sigma)``,
+    or ``("straggler", base, p, slow)`` -- usually ``base``, ``slow`` with probability p.
+    """
+    rng = np.random.default_rng(seed)
+    kind, *args = spec
+    if kind == "constant":
+        return lambda: float(args[0])
+    if kind == "uniform":
+        return lambda: float(rng.uniform(args[0], args[1]))
+    if kind == "lognormal":
+        return lambda: float(args[0] * np.exp(args[1] * rng.standard_normal()))
+    if kind == "straggler":
+        return lambda: float(args[2] if rng.random() < args[1] else args[0])
+    raise ValueError(f"unknown latency distribution {kind!r}")
+
+class SimulatedClient:
+    """A bank with its own data, local training and network/compute latency"""
+
+    def __init__(self, seed, encoding, latency=("constant", 0.0), n_samples=1200, epochs=1, eta0=0.01,
+                 codec=None):
+        self.id = seed
+        self.df, self.y = fed_sim.synth_client(seed, n=n_samples)
+        self.encoding = encoding
+        self.latency = latency_sampler(latency, seed) if isinstance(latency, tuple) else latency
+        self.epochs = epochs
+        self.eta0 = eta0
+        self.codec = codec or wire.UpdateCodec()
+        self.residual = None
+
+    def train(self, version, coef, intercept):
+        new_coef, new_intercept, n = fed_sim.client_update(self.df, self.y, self.encoding, coef, intercept,
+                                                           self.epochs, self.eta0)
+        delta = new_coef - coef + (0.0 if self.residual is None else self.residual)
+        frame, self.residual = self.codec.encode(delta, new_intercept - intercept, n, self.id, version)
+        return frame
+
+class AsyncCoordinator:
+    def __init__(self, clients, encoding, quorum=None, deadline=1.0, min_updates=1, alpha=0.5,
+                 max_staleness=4):
+        self.clients = clients
+        self.encoding = encoding
+        self.quorum = quorum or len(clients)
+        self.deadline = deadline          # seconds a round waits for its quorum
+        self.min_updates = min_updates    # a round that misses its quorum still merges this many
+        self.alpha = alpha                # staleness discount exponent
+        self.max_staleness = max_staleness
+        self.coef = np.zeros(encoding.n_features)
+        self.intercept = 0.0
+        self.version = 0
+        self.history = []
+        self.dropped = 0
+        self._inbox = None
+        self._published = None
+        self._buffer = {}   # client -> decoded update; a newer report from the same bank replaces the older
+
+    def staleness_weight(self, staleness):
+        return (1.0 + staleness) ** -self.alpha
+
+    async def _client_loop(self, client):
+        loop = asyncio.get_running_loop()
+        seen = -1
+        while True:
+            async with self._published:
+                await self._published.wait_for(lambda: self.version > seen)
+                seen, coef, intercept = self.version, self.coef.copy(), self.intercept
+            frame = await loop.run_in_executor(None, client.train, seen, coef, intercept)
+            await asyncio.sleep(client.latency())
+            await self._inbox.put(frame)
+
+    async def _round(self):
+        start = time.perf_counter()
+        deadline = start + self.deadline
+        buffered = self._buffer
+        while len(buffered) < self.quorum:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                frame = await asyncio.wait_for(self._inbox.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            update = wire.decode(frame)
+            if self.version - update["round"] > self.max_staleness:
+                self.dropped += 1
+                continue
+            buffered[update["client"]] = update
+        quorum_met = len(buffered) >= self.quorum
+        merged = len(buffered) >= self.min_updates
+        staleness = [self.version - u["round"] for u in buffered.values()]
+        if merged:  # otherwise the buffer carries over into the next round
+            self._merge(list(buffered.values()))
+            self._buffer = {}
+        return {"version": self.version, "seconds": time.perf_counter() - start, "updates": len(buffered),
+                "quorum_met": quorum_met, "merged": merged, "staleness": staleness}
+
+    def _merge(self, updates):
+        n = np.array([u["n_samples"] for u in updates], dtype=np.float64)
+        w = n * np.array([self.staleness_weight(self.version - u["round"]) for u in updates])
+        # fresh updates average exactly like FedAvg; stale ones count for less than a full share
+        self.coef = self.coef + np.sum([wi * u["delta"] for wi, u in zip(w, updates)], axis=0) / n.sum()
+        self.intercept += float(np.dot(w, [u["intercept_delta"] for u in updates]) / n.sum())
+        self.version += 1
+
+    async def run(self, rounds, val=None, verbose=False):
+        """Run until ``rounds`` merges have happened; returns the per-round history"""
+        self._inbox = asyncio.Queue()
+        self._published = asyncio.Condition()
+        tasks = [asyncio.create_task(self._client_loop(c)) for c in self.clients]
+        try:
+            while self.version < rounds:
+                stats = await self._round()
+                if stats["merged"]:
+                    async with self._published:
+                        self._published.notify_all()
+                if val is not None:
+                    stats["val_log_loss"] = fed_sim.log_loss(self.encoding, self.coef, self.intercept, *val)
+                self.history.append(stats)
+                if verbose:
+                    print(f"v{stats['version']}: {stats['updates']} updates in {stats['seconds']:.2f}s "
+                          f"(quorum {'met' if stats['quorum_met'] else 'missed'}, "
+                          f"staleness {stats['staleness']})"
+                          + (f", val log-loss {stats['val_log_loss']:.4f}" if val is not None else ""))
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return self.history
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Quorum-based asynchronous federation over simulated banks")
+    ap.add_argument("--clients", type=int, default=12)
+    ap.add_argument("--quorum", type=int, default=8)
+    ap.add_argument("--deadline", type=float, default=1.0, help="seconds per round")
+    ap.add_argument("--rounds", type=int, default=10)
+    ap.add_argument("--latency", type=float, nargs=2, default=(0.05, 0.8), metavar=("MEDIAN", "SIGMA"),
+                    help="lognormal report latency per bank")
+    args = ap.parse_args()
+    encoding = fed_sim.SharedEncoding.fit(fed_sim.synth_client(fed_sim.VALIDATION_SEED + 1, n=5000)[0])
+    clients = [SimulatedClient(s, encoding, ("lognormal", *args.latency)) for s in range(args.clients)]
+    coord = AsyncCoordinator(clients, encoding, quorum=args.quorum, deadline=args.deadline)
+    start = time.perf_counter()
+    asyncio.run(coord.run(args.rounds, val=fed_sim.synth_client(fed_sim.VALIDATION_SEED, n=5000), verbose=True))
+    print(f"{args.rounds} merges in {time.perf_counter() - start:.2f}s, {coord.dropped} updates dropped as too stale")
@@ -0,0 +1,151 @@
+"""Wire format and loopback transport for federated model updates.
+
+A client sends the *change* to the global weights it started the round from,
+not a model object. A frame is a fixed header followed by the coefficient
+delta, optionally:
+
+* quantized to float32 / float16, or to int8 with one float32 scale per frame
+* sparsified to the ``topk`` largest-magnitude entries (index + value pairs);
+  what is dropped is kept by the client as residual and added to its next
+  update (error feedback), so nothing is lost, only delayed
+
+``UpdateServer`` is a loopback TCP stand-in for the coordinator: length-prefixed
+frames in, decoded updates out on a queue.
+"""
+import queue
+import socket
+import socketserver
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b"SFU1"
+# magic, quant, sparse, round, client, n_samples, n_features, k, scale, intercept delta
+_HEADER = struct.Struct("<4sBBIIIIIfd")
+_LEN = struct.Struct("<I")
+QUANT = {"float64": (0, np.float64), "float32": (1, np.float32), "float16": (2, np.float16), "int8": (3, np.int8)}
+_QUANT_BY_ID = {code: (name, dtype) for name, (code, dtype) in QUANT.items()}
+
+class UpdateCodec:
+    def __init__(self, quant="float64", topk=None):
+        if quant not in QUANT:
+            raise ValueError(f"unknown quantization {quant!r}; expected one of {sorted(QUANT)}")
+        self.quant = quant
+        self.topk = topk      # entries kept per update (int), fraction of entries (float < 1), or None
+
+    def _k(self, n):
+        if self.topk is None:
+            return n
+        k = int(round(self.topk * n)) if isinstance(self.topk, float) and self.topk < 1 else int(self.topk)
+        return max(1, min(n, k))
+
+    def encode(self, delta, intercept_delta, n_samples, client=0, round_=0):
+        """Frame for ``delta``; also returns what the frame drops (the client's new residual)"""
+        delta = np.asarray(delta, dtype=np.float64)
+        n = len(delta)
+        k = self._k(n)
+        sparse = k < n
+        idx = np.sort(np.argpartition(-np.abs(delta), k - 1)[:k]) if sparse else None
+        vals = delta[idx] if sparse else delta
+        code, dtype = QUANT[self.quant]
+        scale = 1.0
+        if self.quant == "int8":
+            peak = float(np.max(np.abs(vals))) if len(vals) else 0.0
+            scale = peak / 127.0 if peak > 0 else 1.0
+            q = np.clip(np.rint(vals / scale), -127, 127).astype(np.int8)
+        else:
+            q = vals.astype(dtype)
+        header = _HEADER.pack(MAGIC, code, int(sparse), round_, client, n_samples, n, k, scale, intercept_delta)
+        body = (idx.astype(_index_dtype(n)).tobytes() if sparse else b"") + q.tobytes()
+        sent = _dequantize(q, self.quant, np.float32(scale))
+        residual = delta.copy()
+        if sparse:
+            residual[idx] -= sent
+        else:
+            residual -= sent
+        return header + body, residual
+
+def _index_dtype(n):
+    return np.uint16 if n <= 0xFFFF else np.uint32
+
+def _dequantize(q, quant, scale):
+    vals = q.astype(np.float64)
+    return vals * float(scale) if quant == "int8" else vals
+
+def decode(frame):
+    """Frame -> dict(round, client, n_samples, delta, intercept_delta)"""
+    magic, code, sparse, round_, client, n_samples, n, k, scale, b = _HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise ValueError("not a federated update frame")
+    quant, dtype = _QUANT_BY_ID[code]
+    off = _HEADER.size
+    if sparse:
+        idx = np.frombuffer(frame, dtype=_index_dtype(n), count=k, offset=off)
+        off += idx.nbytes
+    vals = _dequantize(np.frombuffer(frame, dtype=dtype, count=k, offset=off), quant, np.float32(scale))
+    if sparse:
+        delta = np.zeros(n)
+        delta[idx] = vals
+    else:
+        delta = vals
+    return {"round": round_, "client": client, "n_samples": n_samples, "delta": delta, "intercept_delta": b}
+
+# -- loopback transport ------------------------------------------------------
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("connection closed mid-frame")
+        buf += chunk
+    return bytes(buf)
+
+def send_frames(address, frames):
+    """Client side: send length-prefixed frames over one connection"""
+    with socket.create_connection(address) as sock:
+        sock.sendall(b"".join(_LEN.pack(len(f)) + f for f in frames))
+    return sum(_LEN.size + len(f) for f in frames)
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                (size,) = _LEN.unpack(_recv_exact(self.request, _LEN.size))
+            except ConnectionError:
+                return
+            frame = _recv_exact(self.request, size)
+            with self.server.lock:
+                self.server.bytes_received += _LEN.size + size
+            self.server.updates.put(decode(frame))
+
+class UpdateServer(socketserver.ThreadingTCPServer):
+    """Coordinator endpoint on 127.0.0.1; use as a context manager"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.updates = queue.Queue()
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server_address[:2]
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fl-update-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    def collect(self, n, timeout=60.0):
+        """Block until ``n`` updates have arrived"""
+        return [self.updates.get(timeout=timeout) for _ in range(n)]
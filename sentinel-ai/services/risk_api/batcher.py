@@ -0,0 +1,125 @@
+"""Asyncio micro-batching in front of the scoring models.
+
+Concurrent ``/score`` requests are parked on a queue for at most ``max_wait``
+seconds (or until ``max_batch`` have arrived) and then evaluated together with
+one batched call in the threadpool; each caller gets its own result back.
+
+Up to ``max_in_flight`` batches are evaluated at once; while they run, new
+requests queue up and go out as the next (larger) batch. The queue holds at
+most ``max_queue`` requests: beyond that ``submit`` raises ``Overloaded``
+straight away, so overload turns into rejections instead of unbounded latency.
+"""
+import asyncio
+import time
+
+class Overloaded(RuntimeError):
+    """The batcher's queue is full"""
+
+class MicroBatcher:
+    def __init__(self, fn, max_batch=64, max_wait=0.002, max_queue=4096, max_in_flight=2):
+        self.fn = fn                  # sync: list of items -> list of results (same order)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_in_flight = max_in_flight
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._slots = None
+        self._running = set()         # dispatched batches (referenced so they are not collected)
+        self.rejected = 0
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+        self.last_batch_size = 0
+        self.wait_total = 0.0         # seconds requests spent queued before dispatch
+        self.wait_max = 0.0
+        self.run_total = 0.0          # seconds spent in batched model evaluation
+
+    def _ensure_worker(self):
+        # one worker per event loop (tests may run several loops in one process)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue(self.max_queue)
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._running = set()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item):
+        self._ensure_worker()
+        fut = self._loop.create_future()
+        try:
+            self._queue.put_nowait((item, fut, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise Overloaded(f"{self.max_queue} requests already queued") from None
+        return await fut
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # anything already queued rides along without waiting further
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()   # released when the batch is done
+            batch = await self._collect()
+            task = self._loop.create_task(self._dispatch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            start = time.perf_counter()
+            waits = [start - t for _, _, t in batch]
+            self.batches += 1
+            self.items += len(batch)
+            self.last_batch_size = len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.wait_total += sum(waits)
+            self.wait_max = max(self.wait_max, max(waits))
+            try:
+                results = await self._loop.run_in_executor(None, self.fn, [item for item, _, _ in batch])
+            except Exception as e:
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                return
+            finally:
+                self.run_total += time.perf_counter() - start
+            for (_, fut, _), res in zip(batch, results):
+                if not fut.done():  # caller may have gone away
+                    fut.set_result(res)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "in_flight": len(self._running),
+            "max_in_flight": self.max_in_flight,
+            "rejected": self.rejected,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "requests": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_seen,
+            "avg_wait_ms": 1000.0 * self.wait_total / self.items if self.items else 0.0,
+            "max_wait_ms_seen": 1000.0 * self.wait_max,
+            "avg_run_ms": 1000.0 * self.run_total / self.batches if self.batches else 0.0,
+        }
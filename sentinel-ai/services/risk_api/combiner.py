@@ -0,0 +1,70 @@
+"""Calibrated combination of the risk heads into one score and a decision.
+
+``python -m services.training.calibrate`` fits a logistic regression over the
+head scores on analyst labels, calibrates its output (isotonic or sigmoid) and
+writes ``models/combiner.json``: one weight per head, a bias, the calibration
+tabulated on an evenly spaced grid of logits, and the two decision thresholds
+derived from target step-up / review rates. Thresholds cut the logit, not the
+calibrated score: isotonic calibration has flat stretches, and a cut on a flat
+stretch could not hit the target rate.
+
+Serving never touches sklearn: the logit is a weighted sum over the batch's
+head columns (term by term in a fixed head order, so a row scores bit for bit
+the same alone or in a batch) and the calibrated score is a gather from the
+table at the nearest grid point.
+"""
+import numpy as np
+
+DECISIONS = ("APPROVE", "STEP_UP", "REVIEW")
+# heads every bundle produces; "consortium" only exists with the federated model
+BASE_HEADS = {"behavioral", "network", "anomaly", "geo"}
+
+class Combiner:
+    def __init__(self, heads, weights, bias, lut, z_min, z_max, step_up, review, meta=None):
+        self.heads = list(heads)
+        self.weights = [float(w) for w in weights]
+        self.bias = float(bias)
+        self.lut = np.asarray(lut, dtype=np.float64)   # calibrated score at z_min .. z_max
+        self.z_min = float(z_min)
+        self.z_max = float(z_max)
+        self.step_up = float(step_up)   # logit >= step_up: STEP_UP
+        self.review = float(review)     # logit >= review: REVIEW
+        self.meta = meta or {}
+        span = self.z_max - self.z_min
+        self._per_step = (len(self.lut) - 1) / span if span > 0 else 0.0
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(cfg["heads"], cfg["weights"], cfg["bias"], cfg["lut"], cfg["z_min"], cfg["z_max"],
+                   cfg["thresholds"]["step_up"], cfg["thresholds"]["review"], cfg.get("meta"))
+
+    def to_config(self):
+        return {"heads": self.heads, "weights": self.weights, "bias": self.bias, "lut": self.lut.tolist(),
+                "z_min": self.z_min, "z_max": self.z_max,
+                "thresholds": {"step_up": self.step_up, "review": self.review}, "meta": self.meta}
+
+    @property
+    def head_weights(self):
+        """head -> logit weight (how explanations weigh each head's attributions)"""
+        return dict(zip(self.heads, self.weights))
+
+    def logits(self, heads):
+        """Bias + weighted sum over ``heads`` (name -> per-row scores); a head with no signal on a row (NaN)
+        adds nothing to its logit"""
+        z = np.full(len(heads[self.heads[0]]), self.bias)
+        for name, w in zip(self.heads, self.weights):
+            z += w * np.nan_to_num(np.asarray(heads[name], dtype=np.float64), nan=0.0)
+        return z
+
+    def calibrate(self, z):
+        """Calibrated fraud probability for logits ``z``"""
+        i = np.rint((np.asarray(z) - self.z_min) * self._per_step)
+        return self.lut[np.clip(i, 0, len(self.lut) - 1).astype(np.intp)]
+
+    def score(self, heads):
+        return self.calibrate(self.logits(heads))
+
+    def decide(self, z):
+        """Decision per row from its logit"""
+        codes = (np.asarray(z) >= self.step_up).astype(np.intp) + (np.asarray(z) >= self.review)
+        return [DECISIONS[c] for c in codes]
@@ -0,0 +1,108 @@
+"""Bounded cache of scoring results for retried authorizations.
+
+Payment networks retry, so the same transaction is often scored several
+times within seconds. An entry is keyed by ``txn_id`` plus a digest of the
+transaction's content as the caller sent it, so a retry that changed any field
+is scored afresh. A hit returns the stored ``RiskResponse`` without touching the
+feature store or the models, so a retry never counts twice towards velocity.
+
+Entries live for ``ttl`` seconds from when they were scored (a hit does not
+extend them) and at most ``max_entries`` are kept, oldest dropped first; with a
+fixed TTL, insertion order is also expiry order, so both limits are enforced
+from the front of one ``OrderedDict``. Each entry remembers the model version
+that produced it: ``clear`` runs on every registry swap, and a result scored by
+an older bundle while the swap happened is never served.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+class DecisionCache:
+    def __init__(self, max_entries=100_000, ttl=120.0):
+        self.max_entries = max_entries      # 0 disables the cache
+        self.ttl = ttl                      # seconds an entry is served after it was scored
+        self._entries = OrderedDict()       # key -> (expires_at, version, response), oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(rec):
+        """(txn_id, digest of every field as sent) for a ``Transaction.model_dump()``"""
+        content = repr(tuple(rec.values())).encode()
+        return rec["txn_id"], hashlib.blake2b(content, digest_size=16).digest()
+
+    def get(self, key, version):
+        """The stored response for ``key`` scored by model ``version``, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] <= now or entry[1] != version):
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[2]
+
+    def get_many(self, keys, version):
+        """``get`` per key; a key repeated within ``keys`` is a retry too and counts as a hit
+        (the caller scores it once and shares the result)"""
+        found = {}
+        out = []
+        for key in keys:
+            if key in found:
+                with self._lock:
+                    self.hits += 1
+            else:
+                found[key] = self.get(key, version)
+            out.append(found[key])
+        return out
+
+    def put_many(self, items, version):
+        """Store ``(key, response)`` pairs scored by model ``version``"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key, response in items:
+                self._entries.pop(key, None)
+                self._entries[key] = (now + self.ttl, version, response)
+            entries = self._entries
+            while entries and next(iter(entries.values()))[0] <= now:
+                entries.popitem(last=False)
+                self.expired += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.evicted += 1
+
+    def clear(self, *_):
+        """Drop every entry (registered as a model-swap listener)"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,110 @@
+"""Multi-head inference over one shared encoded feature matrix.
+
+Every model the API serves was trained behind its own ColumnTransformer. The
+transforms only differ in their one-hot vocabularies, so a batch is encoded
+once with the union vocabulary (float64, exactly what the ColumnTransformers
+emit) and each head reads its own layout as a column gather. Tree heads share
+a single float32 cast of that matrix.
+"""
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from services.shared.features import FeatureEncoder, pipeline_categories
+from services.shared.forest import COMPILED_TYPES, CompiledLinear, compile_estimator
+
+# risk head -> registry model role that backs it
+HEAD_MODELS = {
+    "anomaly": "anomaly",        # IsolationForest (bootstrap_model)
+    "behavioral": "behavioral",  # GradientBoosting on analyst feedback (retrain)
+    "consortium": "federated",   # SGD global model (fed_sim)
+}
+
+class Head:
+    def __init__(self, name, model, cols):
+        self.name = name
+        self.model = model    # compiled engine from services.shared.forest
+        self.cols = cols      # gather into the shared matrix, or None when the layout is identical
+
+    def risk(self, X, X32):
+        Xh = X if isinstance(self.model, CompiledLinear) else X32
+        if self.cols is not None:
+            Xh = Xh[:, self.cols]
+        if self.name == "anomaly":
+            # IF score (higher = more normal) → anomaly risk in [0,1]
+            return np.clip(0.5 - self.model.decision_function(Xh), 0, 1.0)
+        return self.model.predict_proba(Xh)[:, 1]
+
+class RiskEngine:
+    def __init__(self, encoder, heads):
+        self.encoder = encoder    # float64, union vocabulary
+        self.heads = heads        # name -> Head
+
+    @classmethod
+    def from_models(cls, models):
+        """Build from the registry's role -> fitted sklearn pipeline mapping"""
+        present = {head: models[role] for head, role in HEAD_MODELS.items() if role in models}
+        if not present:
+            return cls(None, {})
+        encoder = FeatureEncoder.union(list(present.values()))
+        heads = {}
+        for name, pipe in present.items():
+            cols = encoder.column_index(pipeline_categories(pipe))
+            if len(cols) == encoder.n_features and np.array_equal(cols, np.arange(encoder.n_features)):
+                cols = None
+            heads[name] = Head(name, compile_estimator(pipe.steps[-1][1]), cols)
+        return cls(encoder, heads)
+
+    def model(self, name):
+        head = self.heads.get(name)
+        return head.model if head is not None else None
+
+    def head_input(self, name, X):
+        """The matrix a head's model sees for shared-layout X (for checks and explanations)"""
+        head = self.heads[name]
+        Xh = X if isinstance(head.model, CompiledLinear) else np.ascontiguousarray(X, dtype=np.float32)
+        return Xh if head.cols is None else Xh[:, head.cols]
+
+    def evaluate(self, cols, X=None, timer=None):
+        """Risk per head for a batch: name -> (n,) array in [0, 1]
+
+        ``timer(stage, start_ns)``, when given, is called after each head.
+        """
+        if not self.heads:
+            return {}
+        if X is None:
+            X = self.encoder.encode_columns(cols)
+        X32 = X.astype(np.float32)  # one cast shared by all tree heads
+        if timer is None:
+            return {name: head.risk(X, X32) for name, head in self.heads.items()}
+        out = {}
+        for name, head in self.heads.items():
+            start = time.perf_counter_ns()
+            out[name] = head.risk(X, X32)
+            timer(f"head.{name}", start)
+        return out
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        self.encoder.save(path / "encoder.json")
+        spec = {}
+        for name, head in self.heads.items():
+            head.model.save(path / name)
+            if head.cols is not None:
+                np.save(path / name / "cols.npy", head.cols)
+            spec[name] = type(head.model).__name__
+        (path / "heads.json").write_text(json.dumps(spec))
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        path = Path(path)
+        spec = json.loads((path / "heads.json").read_text())
+        heads = {}
+        for name, kind in spec.items():
+            cols_path = path / name / "cols.npy"
+            cols = np.load(cols_path) if cols_path.exists() else None
+            heads[name] = Head(name, COMPILED_TYPES[kind].load(path / name, mmap_mode=mmap_mode), cols)
+        return cls(FeatureEncoder.load(path / "encoder.json"), heads)
@@ -0,0 +1,312 @@
+"""Per-transaction attributions for the tree heads, cheap enough to run inline on /score.
+
+* ``TreeShap`` -- exact path-dependent TreeSHAP for the GradientBoosting head
+  (what ``shap.TreeExplainer`` returns, in log-odds). Every leaf path of every
+  tree is precomputed once per model version; a batch is then evaluated for
+  all paths at once: which splits each row satisfies, then a small polynomial
+  per path gives the Shapley weights (GPUTreeShap's formulation).
+* ``IsolationPaths`` -- path-based credit for the IsolationForest head: each
+  split on a row's path credits its feature with ``1 / path length`` of that
+  tree (features that isolate the row early count most), scaled so the credits
+  add up to the head's risk above an average-depth point.
+
+Tables are built from the compiled arrays, so mmap-loaded bundles explain too.
+``Explainer`` maps head attributions back to raw ``Transaction`` fields (one-hot
+columns fold into their categorical) and weights them like ``summarize``.
+"""
+import math
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from services.shared.features import CATEGORICALS
+from services.shared.forest import CompiledGradientBoosting, CompiledIsolationForest
+
+def _parents(t):
+    ids = np.arange(len(t.feature))
+    inner = t.left != ids
+    parent = np.full(len(ids), -1, dtype=np.intp)
+    parent[t.left[inner]] = ids[inner]
+    parent[t.right[inner]] = ids[inner]
+    return parent, np.flatnonzero(~inner)
+
+class TreeShap:
+    """Exact TreeSHAP over every leaf path of a compiled GradientBoosting model"""
+
+    def __init__(self, model):
+        self.model = model
+        parent, leaves = _parents(model)
+        P, D = len(leaves), max(1, model.max_depth)
+        feat = np.zeros((P, D), dtype=np.intp)
+        thr = np.zeros((P, D), dtype=np.float32)
+        go_left = np.ones((P, D), dtype=bool)
+        missing = np.zeros((P, D), dtype=bool)
+        ratio = np.ones((P, D))
+        split = np.zeros((P, D), dtype=bool)
+        node = leaves.copy()
+        for d in range(D):  # walk every leaf up to its root, one level per step
+            par = parent[node]
+            has = par >= 0
+            p = par[has]
+            feat[has, d] = model.feature[p]
+            thr[has, d] = model.threshold32[p]
+            go_left[has, d] = model.left[p] == node[has]
+            missing[has, d] = model.missing_left[p]
+            ratio[has, d] = model.cover[node[has]] / model.cover[p]
+            split[has, d] = True
+            node = np.where(has, par, node)
+        # a feature split on twice in a path is one player: give each distinct feature a slot
+        first = np.tile(np.arange(D), (P, 1))
+        for d in range(D):
+            for e in range(d):
+                same = split[:, e] & split[:, d] & (feat[:, e] == feat[:, d]) & (first[:, d] == d)
+                first[same, d] = first[same, e]
+        rows = np.arange(P)[:, None]
+        is_first = (first == np.arange(D)) & split
+        slot_of = np.cumsum(is_first, axis=1) - 1
+        slot = np.where(split, slot_of[rows, first], 0)
+        m = is_first.sum(axis=1)
+        self.slot_valid = np.arange(D)[None, :] < m[:, None]
+        slot_feat = np.zeros((P, D), dtype=np.intp)
+        z = np.ones((P, D))
+        for d in range(D):
+            s = split[:, d]
+            slot_feat[s, slot[s, d]] = feat[s, d]
+            z[np.arange(P), slot[:, d]] *= np.where(s, ratio[:, d], 1.0)
+        # Shapley weight of a coalition of k other players on a path with m players
+        k = np.arange(D)[None, :]
+        mm = np.maximum(m, 1)[:, None]
+        fact = np.vectorize(math.factorial, otypes=[np.float64])
+        self.weights = np.where(k < mm, fact(k) * fact(np.maximum(mm - k - 1, 0)) / fact(mm), 0.0)
+        self.feat, self.thr, self.go_left, self.missing, self.split = feat, thr, go_left, missing, split
+        self.slot, self.z, self.m = slot, z, m
+        self.value = model.leaf_value[leaves]
+        self.slot_feat = slot_feat
+        self.expected_value = float(model.init_raw + np.sum(self.value * np.prod(z, axis=1)))
+
+    def shap_values(self, X):
+        """(n, n_features) log-odds attributions; rows sum to decision_function - expected_value"""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n, (P, D) = len(X), self.feat.shape
+        x = X[:, self.feat]                                    # (n, P, D)
+        left = np.where(np.isnan(x), self.missing, x <= self.thr)
+        sat = (left == self.go_left) | ~self.split
+        o = np.broadcast_to(self.slot_valid, (n, P, D)).astype(np.float64)
+        paths = np.arange(P)
+        for d in range(D):
+            o[:, paths, self.slot[:, d]] *= sat[:, :, d]
+        z = self.z
+        phi = np.empty((n, P, D))
+        for i in range(D):
+            # coefficients of prod_{j != i} (z_j + o_j t): coalitions of the other players by size
+            poly = np.zeros((n, P, D))
+            poly[..., 0] = 1.0
+            for j in range(D):
+                if j != i:
+                    shifted = np.concatenate([np.zeros((n, P, 1)), poly[..., :-1]], axis=2)
+                    poly = poly * z[:, j, None] + shifted * o[:, :, j, None]
+            # term by term (no einsum/BLAS), so a row gets the same bits alone or in a batch
+            acc = poly[..., 0] * self.weights[:, 0]
+            for k in range(1, D):
+                acc = acc + poly[..., k] * self.weights[:, k]
+            phi[..., i] = (o[:, :, i] - z[:, i]) * acc
+        phi *= self.value[:, None] * self.slot_valid
+        # per row, slots are summed into their features in a fixed (path, slot) order
+        F = self.model.n_features
+        idx = np.arange(n)[:, None, None] * F + self.slot_feat[None]
+        return np.bincount(idx.ravel(), phi.ravel(), n * F).reshape(n, F)
+
+    def risk_attributions(self, X):
+        """Attributions in probability units: rows sum to predict_proba - sigmoid(expected_value)"""
+        phi = self.shap_values(X)
+        raw = self.expected_value + phi.sum(axis=1)
+        p, p0 = 1 / (1 + np.exp(-raw)), 1 / (1 + np.exp(-self.expected_value))
+        gap = raw - self.expected_value
+        slope = np.where(np.abs(gap) > 1e-12, (p - p0) / np.where(gap == 0, 1.0, gap), p * (1 - p))
+        return phi * slope[:, None]
+
+class IsolationPaths:
+    """Depth-weighted split credit along each row's path through every isolation tree"""
+
+    def __init__(self, model):
+        self.model = model
+        parent, leaves = _parents(model)
+        # per leaf: how often each feature is split on above it, over the tree's path length there
+        credit = np.zeros((len(leaves), model.n_features))
+        node = leaves.copy()
+        for _ in range(max(1, model.max_depth)):
+            par = parent[node]
+            has = np.flatnonzero(par >= 0)
+            np.add.at(credit, (has, model.feature[par[has]]), 1.0)
+            node = np.where(par >= 0, par, node)
+        self.leaf_credit = np.zeros((len(model.feature), model.n_features))
+        self.leaf_credit[leaves] = credit / model.leaf_value[leaves][:, None]
+        # risk of a row whose expected path length equals the average c(max_samples): 2^-1
+        self.reference = 0.5 + 0.5 + model.offset
+
+    def risk_attributions(self, X):
+        """(n, n_features); rows sum to the unclipped anomaly risk minus ``reference``"""
+        m = self.model
+        leaves = m.apply(X)                                    # (n_trees, n)
+        share = self.leaf_credit[leaves].sum(axis=0)
+        share /= np.maximum(share.sum(axis=1, keepdims=True), 1e-300)
+        score = -(2 ** (-(m._accumulate(leaves) / m.denominator))) if m.denominator else -np.ones(len(X))
+        risk = 0.5 - (score - m.offset)                        # 0.5 - decision_function, unclipped
+        return share * (risk - self.reference)[:, None]
+
+EXPLAINERS = {CompiledGradientBoosting: TreeShap, CompiledIsolationForest: IsolationPaths}
+
+class Explainer:
+    """Attributions of a ``RiskEngine``'s tree heads, on the raw ``Transaction`` fields"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.heads = {name: EXPLAINERS[type(head.model)](head.model) for name, head in engine.heads.items()
+                      if type(head.model) in EXPLAINERS}
+        enc = engine.encoder
+        self.features = list(CATEGORICALS) + enc.columns[enc.n_onehot:]
+        # shared-encoder column -> raw field (one-hot columns sum into their categorical)
+        self.owner = np.concatenate([np.repeat(np.arange(len(CATEGORICALS)), np.diff(enc._offsets)),
+                                     len(CATEGORICALS) + np.arange(enc.n_features - enc.n_onehot)])
+        self.fixed_ms = 0.0       # cost model for the inline budget: fixed_ms + ms_per_row * rows
+        self.ms_per_row = None
+        self._lock = threading.Lock()
+
+    def calibrate(self, rows=64):
+        """Seed the cost model by timing a one-row and a ``rows``-row explanation"""
+        if not self.heads:
+            return
+        enc = self.engine.encoder
+        cols = {c: np.full(rows, "", dtype=object) for c in CATEGORICALS}
+        timings = []
+        for n in (1, rows):
+            X = np.zeros((n, enc.n_features))
+            start = time.perf_counter()
+            self.head_attributions(cols, X, record=False)
+            timings.append((time.perf_counter() - start) * 1e3)
+        self.ms_per_row = max(0.0, (timings[1] - timings[0]) / (rows - 1))
+        self.fixed_ms = max(0.0, timings[0] - self.ms_per_row)
+
+    def head_attributions(self, cols, X=None, record=True):
+        """head -> (n, n_raw_features) contributions to that head's risk"""
+        if X is None:
+            X = self.engine.encoder.encode_columns(cols)
+        start = time.perf_counter()
+        X32 = np.asarray(X, dtype=np.float32)
+        out = {}
+        for name, explainer in self.heads.items():
+            head = self.engine.heads[name]
+            Xh = X32 if head.cols is None else X32[:, head.cols]
+            phi = explainer.risk_attributions(Xh)
+            owner = self.owner if head.cols is None else self.owner[head.cols]
+            raw = np.zeros((len(X32), len(self.features)))
+            for j, f in enumerate(owner):
+                raw[:, f] += phi[:, j]
+            out[name] = raw
+        if record:
+            per_row = max(0.0, (time.perf_counter() - start) * 1e3 - self.fixed_ms) / len(X32)
+            with self._lock:
+                self.ms_per_row = per_row if self.ms_per_row is None else 0.9 * self.ms_per_row + 0.1 * per_row
+        return out
+
+    def fits(self, n_rows, budget_ms):
+        """Whether explaining ``n_rows`` inline is expected to stay within ``budget_ms``"""
+        return self.ms_per_row is None or self.fixed_ms + self.ms_per_row * n_rows <= budget_ms
+
+    def combine(self, attributions, heads, weights):
+        """(n, n_raw_features) contributions to the risk score: head attributions weighted like summarize.
+
+        ``heads`` names the heads scored, or maps them to per-row scores; a row where a head is NaN (no
+        signal) leaves that head out of its weighted mean, as ``risk_vectors`` / ``summarize`` do.
+        """
+        keys = [k for k in weights if k in heads]
+        n = len(next(iter(attributions.values())))
+        total = np.zeros(n)
+        for k in keys:
+            present = ~np.isnan(np.asarray(heads[k], dtype=np.float64)) if hasattr(heads, "items") else True
+            total += weights[k] * present
+        scale = np.where(total > 0, 1.0 / np.where(total > 0, total, 1.0), 1.0)[:, None]
+        out = np.zeros((n, len(self.features)))
+        for name, phi in attributions.items():
+            if name in keys:
+                out += weights[name] * scale * phi
+        return out
+
+    def top(self, combined, k=4):
+        """Per row: the ``k`` fields with the largest absolute contribution"""
+        order = np.argsort(-np.abs(combined), axis=1, kind="stable")[:, :k]
+        return [{self.features[j]: float(row[j]) for j in idx} for row, idx in zip(combined, order)]
+
+class ExplanationWorker:
+    """Background thread for full (all-field, per-head) explanations, kept by txn_id"""
+
+    def __init__(self, max_pending=1024, max_results=10_000):
+        self.max_results = max_results
+        self._queue = queue.Queue(max_pending)
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dropped = 0
+        self.done = 0
+        self.failed = 0
+
+    def submit(self, explainer, txn_ids, cols, heads, weights):
+        """Queue a batch; returns False (and drops it) when the worker is saturated"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="explain-worker", daemon=True)
+            self._thread.start()
+        with self._lock:
+            for t in txn_ids:
+                self._store(t, None)
+        try:
+            self._queue.put_nowait((explainer, list(txn_ids), cols, heads, weights))
+            return True
+        except queue.Full:
+            with self._lock:
+                for t in txn_ids:
+                    self._results.pop(t, None)
+            self.dropped += len(txn_ids)
+            return False
+
+    def _store(self, txn_id, value):
+        self._results[txn_id] = value
+        self._results.move_to_end(txn_id)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def _run(self):
+        while True:
+            explainer, txn_ids, cols, heads, weights = self._queue.get()
+            try:
+                per_head = explainer.head_attributions(cols)
+                combined = explainer.combine(per_head, heads, weights)
+                results = [{
+                    "reasons": dict(zip(explainer.features, combined[i].tolist())),
+                    "heads": {h: dict(zip(explainer.features, a[i].tolist())) for h, a in per_head.items()},
+                } for i in range(len(txn_ids))]
+            except Exception as e:  # keep the worker alive; callers see why instead of "pending" forever
+                self.failed += len(txn_ids)
+                results = [{"error": f"{type(e).__name__}: {e}"}] * len(txn_ids)
+            else:
+                self.done += len(txn_ids)
+            try:
+                with self._lock:
+                    for t, result in zip(txn_ids, results):
+                        self._store(t, result)
+            finally:  # only now: join() promises the results are readable
+                self._queue.task_done()
+
+    def get(self, txn_id):
+        """The explanation, None while pending; KeyError when unknown (or evicted)"""
+        with self._lock:
+            return self._results[txn_id]
+
+    def join(self):
+        self._queue.join()
+
+    def stats(self):
+        return {"pending": self._queue.qsize(), "done": self.done, "failed": self.failed, "dropped": self.dropped,
+                "stored": len(self._results)}
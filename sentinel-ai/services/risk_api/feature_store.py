@@ -0,0 +1,285 @@
+"""In-memory per-user behavioral feature store for the risk API.
+
+Derives the velocity fields of a ``Transaction`` from what the API itself has
+seen, so callers no longer have to:
+
+* ``past_24h_txn_count``  -- transactions in the last 24 hourly buckets
+* ``velocity_usd_7d``     -- amount spent in the last 7 daily buckets
+* ``past_7d_chargebacks`` -- chargebacks (fraud labels) in the last 7 daily buckets
+* ``is_new_device``       -- device not seen for this user within ``device_ttl``
+
+It also keeps each user's last location, for the geo head's travel speed.
+
+Every user owns one row of fixed-size ring buffers in preallocated numpy arrays
+(about 110 bytes per user), so a window query is a constant-size row sum and a
+batch is a handful of vectorized gathers/scatters. Once ``capacity`` users are
+tracked, users idle for longer than ``ttl`` are evicted first, then the least
+recently seen. ``snapshot``/``restore`` persist the state as one ``.npz``.
+Windows are bucket-aligned: "24h" means the current hour plus the 23 before it.
+"""
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+HOURS = 24   # hourly buckets for the 24h count
+DAYS = 7     # daily buckets for the 7d sums
+DERIVED = ("past_24h_txn_count", "past_7d_chargebacks", "velocity_usd_7d", "is_new_device")
+
+# per-user row layout: newest bucket written (hour / day since epoch) and the ring buffers
+_LAYOUT = {
+    "hour": ((), np.int32),
+    "day": ((), np.int32),
+    "counts": ((HOURS,), np.uint16),
+    "amounts": ((DAYS,), np.float32),
+    "chargebacks": ((DAYS,), np.uint8),
+    "lat": ((), np.float32),
+    "lon": ((), np.float32),
+    "seen": ((), np.float64),   # time of the last located transaction; 0 = none yet
+}
+
+def _typed(out):
+    for name in ("past_24h_txn_count", "past_7d_chargebacks"):
+        out[name] = out[name].astype(np.int64)
+    return out
+
+class FeatureStore:
+    ARRAYS = tuple(_LAYOUT)
+
+    def __init__(self, capacity=2_000_000, ttl=30 * 86400, device_capacity=4_000_000,
+                 device_ttl=90 * 86400, initial=1024):
+        self.capacity = capacity            # users tracked before LRU eviction kicks in
+        self.ttl = ttl                      # seconds idle before a user's history is dropped
+        self.device_capacity = device_capacity
+        self.device_ttl = device_ttl
+        self.slots = {}                     # user_id -> row
+        self.users = np.empty(0, dtype=object)
+        self.free = []
+        self.devices = OrderedDict()        # (user_id, device_id) -> last seen (s), oldest first
+        self.lock = threading.Lock()        # score_records runs on several threads
+        self.evictions = 0
+        self._alloc(min(initial, capacity))
+
+    def _alloc(self, n):
+        old = len(self.users)
+        for name, (shape, dtype) in _LAYOUT.items():
+            extra = np.zeros((n - old,) + shape, dtype=dtype)
+            setattr(self, name, np.concatenate([getattr(self, name), extra]) if old else extra)
+        self.users = np.concatenate([self.users, np.full(n - old, None, dtype=object)])
+        self.free.extend(range(n - 1, old - 1, -1))
+
+    def __len__(self):
+        return len(self.slots)
+
+    # -- slots -------------------------------------------------------------
+
+    def _evict(self, n, protect):
+        # users idle past the TTL go first, then the least recently written (approximate LRU)
+        used = np.flatnonzero(self.users != None)  # noqa: E711 (elementwise)
+        used = used[~np.isin(used, protect)]
+        idle = used[(int(self.hour.max()) - self.hour[used]) * 3600 > self.ttl]
+        rest = np.setdiff1d(used, idle)
+        need = max(0, n - len(idle))
+        lru = rest[np.argpartition(self.hour[rest], need - 1)[:need]] if 0 < need < len(rest) else rest[:need]
+        victims = np.concatenate([idle, lru])
+        for row in victims:
+            del self.slots[self.users[row]]
+        self.users[victims] = None
+        for name in self.ARRAYS:
+            getattr(self, name)[victims] = 0
+        self.free.extend(victims.tolist())
+        self.evictions += len(victims)
+
+    def _rows(self, user_ids, create=True):
+        if create:
+            missing = len({u for u in user_ids if u not in self.slots})
+            if missing > len(self.free):
+                if len(self.users) < self.capacity:
+                    self._alloc(min(self.capacity, max(2 * len(self.users), len(self.slots) + missing)))
+                if missing > len(self.free):
+                    if missing > self.capacity:
+                        raise ValueError(f"batch has {missing} new users; capacity is {self.capacity}")
+                    protect = [self.slots[u] for u in user_ids if u in self.slots]
+                    self._evict(missing - len(self.free) + self.capacity // 100, protect)
+        rows = np.empty(len(user_ids), dtype=np.intp)
+        for i, u in enumerate(user_ids):
+            row = self.slots.get(u)
+            if row is None:
+                if not create:
+                    rows[i] = -1
+                    continue
+                row = self.free.pop()
+                self.slots[u] = row
+                self.users[row] = u
+            rows[i] = row
+        return rows
+
+    # -- ring buffers ------------------------------------------------------
+
+    @staticmethod
+    def _roll(buckets, last, now, width):
+        """Zero the buckets of ``rows`` that fell out of the window between ``last`` and ``now``"""
+        gap = (now - last)[:, None]
+        off = (np.arange(width)[None, :] - last[:, None]) % width
+        stale = ((off != 0) & (off <= gap)) | (gap >= width)
+        buckets[stale] = 0
+
+    def _advance(self, rows, hour, day):
+        # move each distinct user's buffers forward to the newest bucket in the batch
+        uniq, inv = np.unique(rows, return_inverse=True)
+        h = np.full(len(uniq), np.iinfo(np.int32).min, dtype=np.int64)
+        d = h.copy()
+        np.maximum.at(h, inv, hour)
+        np.maximum.at(d, inv, day)
+        for buckets, last, now, width in ((self.counts, self.hour, h, HOURS), (self.amounts, self.day, d, DAYS),
+                                          (self.chargebacks, self.day, d, DAYS)):
+            sub = buckets[uniq]
+            self._roll(sub, np.asarray(last[uniq], dtype=np.int64), now, width)
+            buckets[uniq] = sub
+        self.hour[uniq] = np.maximum(self.hour[uniq], h)
+        self.day[uniq] = np.maximum(self.day[uniq], d)
+        return uniq, inv
+
+    @staticmethod
+    def _prior_in_batch(inv, values):
+        # per row: sum of ``values`` over earlier rows of the same user in this batch
+        order = np.argsort(inv, kind="stable")
+        v = values[order]
+        csum = np.cumsum(v)
+        starts = np.r_[0, np.flatnonzero(np.diff(inv[order])) + 1]
+        group_start = np.repeat(starts, np.diff(np.r_[starts, len(v)]))
+        before = csum - v - np.where(group_start > 0, csum[group_start - 1], 0)
+        out = np.empty_like(before)
+        out[order] = before
+        return out
+
+    def _window_sums(self, rows, hour, day):
+        # per-row window totals as of each row's own time, without touching the state
+        sums = {}
+        for name, buckets, last, now, width in (("past_24h_txn_count", self.counts, self.hour, hour, HOURS),
+                                               ("velocity_usd_7d", self.amounts, self.day, day, DAYS),
+                                               ("past_7d_chargebacks", self.chargebacks, self.day, day, DAYS)):
+            sub = buckets[rows].astype(np.float64)
+            self._roll(sub, np.asarray(last[rows], dtype=np.int64), now, width)
+            sums[name] = sub.sum(axis=1)
+        return sums
+
+    def observe(self, user_ids, device_ids, amounts, now=None, lat=None, lon=None):
+        """Record a batch of transactions; returns the derived fields *before* each one.
+
+        Rows of the same user within the batch see the earlier rows, as if the
+        batch had been processed one transaction at a time (a batch is assumed
+        to span less than a bucket, as API batches do). With ``lat``/``lon``
+        the output also has each user's previous location (``prev_lat``,
+        ``prev_lon``, ``prev_seen``; NaN when there is none).
+        """
+        n = len(user_ids)
+        if n == 0:
+            return {name: np.zeros(0, dtype=bool if name == "is_new_device" else np.float64) for name in DERIVED}
+        if now is None or np.ndim(now) == 0:
+            now = np.full(n, time.time() if now is None else now, dtype=np.float64)
+        now = np.asarray(now, dtype=np.float64)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        hour, day = (now // 3600).astype(np.int64), (now // 86400).astype(np.int64)
+        with self.lock:
+            users = list(user_ids)
+            rows = self._rows(users)
+            out = self._window_sums(rows, hour, day)
+            uniq, inv = self._advance(rows, hour, day)
+            if len(uniq) < n:  # some user appears more than once in this batch
+                out["past_24h_txn_count"] += self._prior_in_batch(inv, np.ones(n))
+                out["velocity_usd_7d"] += self._prior_in_batch(inv, amounts)
+            np.add.at(self.counts, (rows, hour % HOURS), 1)
+            np.add.at(self.amounts, (rows, day % DAYS), amounts.astype(np.float32))
+            out["is_new_device"] = self._touch_devices(users, device_ids, now)
+            if lat is not None:
+                out.update(self._move(rows, inv, np.asarray(lat, dtype=np.float64),
+                                      np.asarray(lon, dtype=np.float64), now))
+        return _typed(out)
+
+    def _move(self, rows, inv, lat, lon, now):
+        # previous location per row (the user's earlier row in this batch wins over the stored one)
+        seen = self.seen[rows]
+        prev = {"prev_lat": self.lat[rows].astype(np.float64), "prev_lon": self.lon[rows].astype(np.float64),
+                "prev_seen": np.where(seen > 0, seen, np.nan)}
+        order = np.argsort(inv, kind="stable")
+        same = inv[order][1:] == inv[order][:-1]
+        cur, before = order[1:][same], order[:-1][same]
+        for name, v in (("prev_lat", lat), ("prev_lon", lon), ("prev_seen", now)):
+            prev[name][cur] = v[before]
+        last = order[np.r_[~same, True]]   # each user's last row in the batch
+        self.lat[rows[last]] = lat[last]
+        self.lon[rows[last]] = lon[last]
+        self.seen[rows[last]] = now[last]
+        return prev
+
+    def _touch_devices(self, users, device_ids, now):
+        new = np.empty(len(users), dtype=bool)
+        for i, key in enumerate(zip(users, device_ids)):
+            seen = self.devices.pop(key, None)
+            new[i] = seen is None or now[i] - seen > self.device_ttl
+            self.devices[key] = now[i]
+        while len(self.devices) > self.device_capacity:
+            self.devices.popitem(last=False)
+        return new
+
+    def peek(self, user_ids, device_ids, now=None):
+        """The derived fields for users as of ``now``, without recording anything"""
+        now = time.time() if now is None else now
+        with self.lock:
+            rows = self._rows(list(user_ids), create=False)
+            known = rows >= 0
+            out = {name: np.zeros(len(rows)) for name in DERIVED if name != "is_new_device"}
+            r = rows[known]
+            for name, v in self._window_sums(r, np.full(len(r), int(now // 3600)),
+                                             np.full(len(r), int(now // 86400))).items():
+                out[name][known] = v
+            out["is_new_device"] = np.array([now - self.devices.get(k, -np.inf) > self.device_ttl
+                                             for k in zip(user_ids, device_ids)], dtype=bool)
+        return _typed(out)
+
+    def record_chargeback(self, user_id, now=None):
+        now = time.time() if now is None else now
+        day = int(now // 86400)
+        with self.lock:
+            rows = self._rows([user_id])
+            self._advance(rows, np.array([int(now // 3600)]), np.array([day]))
+            self.chargebacks[rows[0], day % DAYS] = min(255, int(self.chargebacks[rows[0], day % DAYS]) + 1)
+
+    # -- persistence ---------------------------------------------------------
+
+    def snapshot(self, path):
+        """Write the live rows and device table to ``path`` (.npz), atomically"""
+        path = Path(path)
+        with self.lock:
+            rows = np.fromiter(self.slots.values(), dtype=np.intp, count=len(self.slots))
+            arrays = {name: getattr(self, name)[rows] for name in self.ARRAYS}
+            arrays["users"] = np.array(list(self.slots), dtype=str)
+            keys = list(self.devices)
+            arrays["device_users"] = np.array([k[0] for k in keys], dtype=str)
+            arrays["device_ids"] = np.array([k[1] for k in keys], dtype=str)
+            arrays["device_seen"] = np.fromiter(self.devices.values(), dtype=np.float64, count=len(keys))
+        tmp = path.with_name(f".{path.name}.tmp.npz")
+        np.savez(tmp, **arrays)
+        tmp.replace(path)
+        return path
+
+    @classmethod
+    def restore(cls, path, **kwargs):
+        with np.load(path) as z:
+            users = z["users"].tolist()
+            store = cls(initial=max(1, len(users)), **kwargs)
+            rows = store._rows(users)
+            for name in cls.ARRAYS:
+                if name in z.files:  # snapshots from before a field existed leave it zeroed
+                    getattr(store, name)[rows] = z[name]
+            for u, d, t in zip(z["device_users"].tolist(), z["device_ids"].tolist(), z["device_seen"].tolist()):
+                store.devices[(u, d)] = t
+        return store
+
+    def stats(self):
+        return {"users": len(self.slots), "allocated": len(self.users), "capacity": self.capacity,
+                "devices": len(self.devices), "evictions": self.evictions,
+                "bytes": int(sum(getattr(self, name).nbytes for name in self.ARRAYS))}
@@ -1,63 +1,133 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from services.shared.schemas import Transaction, RiskResponse
-from services.shared.features import to_frame, CATEGORICALS, NUMERICS, BINARIES
-import joblib, numpy as np
-from typing import Literal
+from services.shared.features import to_columns, CATEGORICALS, NUMERICS, BINARIES
+from services.risk_api.batcher import MicroBatcher, Overloaded
+from services.risk_api.registry import ModelRegistry
+from services.shared.feedback_log import FeedbackLog
+from services.risk_api.feature_store import FeatureStore, DERIVED
+from services.risk_api.explain import ExplanationWorker
+from services.risk_api.decision_cache import DecisionCache
+from services.risk_api import scoring
+from services.risk_api.scoring import (LOW_T, HIGH_T, DEFAULT_WEIGHTS, risk_vectors, summarize,
+                                       decide)
+from services.shared import geo
+from services.shared.latency import LatencyRecorder
+import os, time, numpy as np
+from typing import List, Literal
 
 app = FastAPI(title="Sentinel AI – Risk API")
 
-# thresholds from PRD: low <0.2, medium 0.2–0.6, high >0.6 (tune later)
-LOW_T, HIGH_T = 0.2, 0.6
+# per-stage latency histograms of the scoring path (constant memory; GET /metrics)
+metrics = LatencyRecorder(enabled=os.environ.get("SENTINEL_METRICS", "1") != "0")
+TIMED_PATHS = {"/score", "/score/batch", "/feedback"}
 
-# Load the bootstrap model
+class RequestTimer:
+    # plain ASGI wrapper (no BaseHTTPMiddleware overhead): request in -> last body byte out,
+    # so the route's time includes queueing in the batcher and JSON serialization
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in TIMED_PATHS or not metrics.enabled:
+            return await self.app(scope, receive, send)
+        start = time.perf_counter_ns()
+        stage = f"http {scope['method']} {scope['path']}"
+
+        async def timed_send(message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                metrics.record(stage, start)
+
+        await self.app(scope, receive, timed_send)
+
+app.add_middleware(RequestTimer)
+
+# retried authorizations (same txn_id and content) get the stored decision back; 0 entries disables
+DECISION_CACHE_SIZE = int(os.environ.get("SENTINEL_DECISION_CACHE_SIZE", "100000"))
+DECISION_CACHE_TTL_S = float(os.environ.get("SENTINEL_DECISION_CACHE_TTL_S", "120"))
+decision_cache = DecisionCache(DECISION_CACHE_SIZE, DECISION_CACHE_TTL_S)
+
+# micro-batching window for /score: flush after this many requests or this long
+BATCHING = os.environ.get("SENTINEL_BATCHING", "1") != "0"
+BATCH_MAX_SIZE = int(os.environ.get("SENTINEL_BATCH_MAX_SIZE", "64"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("SENTINEL_BATCH_MAX_WAIT_MS", "2"))
+BATCH_MAX_QUEUE = int(os.environ.get("SENTINEL_BATCH_MAX_QUEUE", "4096"))   # /score answers 503 beyond this
+BATCH_IN_FLIGHT = int(os.environ.get("SENTINEL_BATCH_IN_FLIGHT", "2"))      # batches evaluated at once
+
+# models live in a registry so retrained versions can be swapped in without a restart;
+# each bundle carries the pandas-free encoder and the compiled IsolationForest
+MODELS_DIR = os.environ.get("SENTINEL_MODELS_DIR", "models")
+MODEL_WATCH_S = float(os.environ.get("SENTINEL_MODEL_WATCH_S", "0"))  # 0 = admin endpoint only
+MODEL_FORMAT = os.environ.get("SENTINEL_MODEL_FORMAT", "joblib")     # "mmap" for fast worker startup
+MODEL_BUDGET = os.environ.get("SENTINEL_BUDGET", "warn")             # models/budget.json: off | warn | enforce
+
+registry = ModelRegistry(MODELS_DIR, fmt=MODEL_FORMAT, budget=MODEL_BUDGET)
 try:
-    pipe = joblib.load("models/anomaly_iforest.joblib")
+    registry.reload()
 except FileNotFoundError:
     print("Warning: Bootstrap model not found. Run 'python -m services.training.bootstrap_model' first")
-    pipe = None
-
-def compute_risk_vector(df):
-    # 3 heads (toy): behavioral, network, anomaly
-    # you can replace these with dedicated models later
-    behavioral = np.tanh(
-        0.4*df["past_24h_txn_count"].values[0] +
-        0.6*df["velocity_usd_7d"].values[0]/1000.0 +
-        0.8*df["is_new_device"].astype(int).values[0]
-    )
-    network = np.tanh( df["ip_asn_risk"].values[0] + (1 if df["merchant_category"].astype(str).values[0] in ["luxury","gaming"] else 0)*0.3 )
-    
-    # anomaly via IF: convert score (higher = more normal) → anomaly risk in [0,1]
-    if pipe is not None:
-        score = pipe.decision_function(df.drop(columns=[]))  # ~ [-0.5..0.5]
-        anomaly = np.clip(0.5 - score[0], 0, 1.0)
-    else:
-        anomaly = 0.1  # fallback if no model
+registry.on_swap(decision_cache.clear)  # decisions of the previous version are not served again
 
-    return {
-        "behavioral": float(np.clip(behavioral, 0, 1)),
-        "network": float(np.clip(network, 0, 1)),
-        "anomaly": float(anomaly)
-    }
+# analyst feedback is buffered in-process and group-committed to a segmented log
+FEEDBACK_DIR = os.environ.get("SENTINEL_FEEDBACK_DIR", "data/feedback")
+feedback_log = FeedbackLog(FEEDBACK_DIR)
 
-def summarize(vector):
-    # simple learned weights placeholder (later from logistic/CalibratedClassifierCV)
-    w = {"behavioral":0.4, "network":0.25, "anomaly":0.35}
-    s = sum(w[k]*vector[k] for k in w)
-    return float(s)
-
-def decide(risk_score: float):
-    if risk_score < LOW_T: return "APPROVE"
-    if risk_score < HIGH_T: return "STEP_UP"
-    return "REVIEW"
-
-def top_reasons(df):
-    # lightweight "explainability" fallback if SHAP not computed
-    reasons = {}
-    reasons["is_new_device"] = float(df["is_new_device"].astype(int).values[0])
-    reasons["velocity_usd_7d"] = float(df["velocity_usd_7d"].values[0])
-    reasons["past_24h_txn_count"] = float(df["past_24h_txn_count"].values[0])
-    reasons["ip_asn_risk"] = float(df["ip_asn_risk"].values[0])
-    return dict(sorted(reasons.items(), key=lambda kv: abs(kv[1]), reverse=True)[:4])
+# per-user velocity state, so callers may leave the derived Transaction fields out
+FEATURE_STORE_CAPACITY = int(os.environ.get("SENTINEL_FEATURE_STORE_USERS", "2000000"))
+FEATURE_SNAPSHOT = os.environ.get("SENTINEL_FEATURE_SNAPSHOT", "")  # .npz restored at start, written at exit
+if FEATURE_SNAPSHOT and os.path.exists(FEATURE_SNAPSHOT):
+    feature_store = FeatureStore.restore(FEATURE_SNAPSHOT, capacity=FEATURE_STORE_CAPACITY)
+else:
+    feature_store = FeatureStore(capacity=FEATURE_STORE_CAPACITY)
+
+def fill_derived(recs):
+    # record the batch in the feature store and fill whatever derived fields the caller left out;
+    # returns the travel columns (distance / speed from each user's last location, and whether there
+    # was one) for the geo head
+    if not recs:
+        return {}
+    lat = np.array([r["geo_lat"] for r in recs], dtype=np.float64)
+    lon = np.array([r["geo_lon"] for r in recs], dtype=np.float64)
+    now = time.time()
+    derived = feature_store.observe([r["user_id"] for r in recs], [r["device_id"] for r in recs],
+                                    [r["amount"] for r in recs], now, lat, lon)
+    for i, r in enumerate(recs):
+        for f in DERIVED:
+            if r[f] is None:
+                r[f] = derived[f][i].item()
+    km, kmh = geo.travel(derived["prev_lat"], derived["prev_lon"], derived["prev_seen"], lat, lon, now)
+    return {"travel_km": km, "travel_kmh": kmh, "travel_known": ~np.isnan(derived["prev_seen"])}
+
+# reasons: attributions of the tree heads, inline while they fit the budget, else in the background
+EXPLAIN_MODE = os.environ.get("SENTINEL_EXPLAIN", "inline")   # "inline" | "async" | "off"
+EXPLAIN_BUDGET_MS = float(os.environ.get("SENTINEL_EXPLAIN_BUDGET_MS", "3"))
+explanations = ExplanationWorker()
+
+def compute_heads(cols, X=None, bundle=None, timer=None):
+    # scoring.compute_heads under the active model version unless a bundle is given
+    return scoring.compute_heads(cols, X, bundle or registry.active, timer)
+
+def compute_risk_vectors(cols, X=None, bundle=None, timer=None):
+    return scoring.compute_risk_vectors(cols, X, bundle or registry.active, timer)
+
+def compute_risk_vector(cols, X=None, bundle=None):
+    return compute_risk_vectors(cols, X, bundle)[0]
+
+REASON_FEATURES = ["is_new_device","velocity_usd_7d","past_24h_txn_count","ip_asn_risk"]
+
+def top_reasons_many(cols):
+    # lightweight "explainability" fallback when attributions are off, deferred or unavailable
+    vals = {f: np.asarray(cols[f], dtype=np.float64) for f in REASON_FEATURES}
+    out = []
+    for i in range(len(vals[REASON_FEATURES[0]])):
+        reasons = {f: float(vals[f][i]) for f in REASON_FEATURES}
+        out.append(dict(sorted(reasons.items(), key=lambda kv: abs(kv[1]), reverse=True)[:4]))
+    return out
+
+def top_reasons(cols):
+    return top_reasons_many(cols)[0]
 
 def user_messages(decision, reasons):
     if decision=="STEP_UP":
@@ -66,35 +136,209 @@ def user_messages(decision, reasons):
         return "We've paused this payment for a quick safety check due to unusual patterns."
     return "Payment approved securely."
 
+def explain_reasons(bundle, recs, cols, X, heads, weights):
+    explainer = bundle.explainer if bundle is not None else None
+    if explainer is None or not explainer.heads or EXPLAIN_MODE == "off":
+        return top_reasons_many(cols)
+    if EXPLAIN_MODE == "inline" and explainer.fits(len(recs), EXPLAIN_BUDGET_MS):
+        return explainer.top(explainer.combine(explainer.head_attributions(cols, X), heads, weights))
+    # async mode, or over budget: full explanation later at GET /explain/{txn_id}
+    explanations.submit(explainer, [r["txn_id"] for r in recs], cols, heads, weights)
+    return top_reasons_many(cols)
+
+def score_records(txns):
+    # shared scoring path: retries come from the decision cache, the rest get one encode +
+    # one model call for the whole list
+    if not txns:
+        return []
+    record = metrics.record
+    t0 = time.perf_counter_ns()
+    bundle = registry.active  # pinned for the whole call; swaps don't affect it
+    version = bundle.version if bundle is not None else None
+    recs = [t.model_dump() for t in txns]
+    if not decision_cache.enabled:
+        out = score_fresh(bundle, recs)
+        record("score_records", t0)
+        return out
+    t = time.perf_counter_ns()
+    keys = [decision_cache.key(r) for r in recs]
+    out = decision_cache.get_many(keys, version)
+    fresh = {}  # key -> first index; a retry inside the same batch is scored once
+    for i, (k, cached) in enumerate(zip(keys, out)):
+        if cached is None and k not in fresh:
+            fresh[k] = i
+    record("cache", t)
+    if fresh:
+        scored = dict(zip(fresh, score_fresh(bundle, [recs[i] for i in fresh.values()])))
+        decision_cache.put_many(scored.items(), version)
+        out = [cached if cached is not None else scored[k] for k, cached in zip(keys, out)]
+    record("score_records", t0)
+    return out
+
+def score_fresh(bundle, recs):
+    # feature store, models, reasons and decisions for Transaction.model_dump() records
+    record = metrics.record
+    t = time.perf_counter_ns()
+    travel = fill_derived(recs)
+    record("feature_store", t)
+    t = time.perf_counter_ns()
+    cols = to_columns(recs) | travel
+    # single transactions use the encoder's preallocated row
+    X = None
+    if bundle is not None and bundle.encoder is not None:
+        X = bundle.encoder.encode(recs[0]) if len(recs) == 1 else bundle.encoder.encode_columns(cols)
+    record("frame", t)
+    heads = compute_heads(cols, X, bundle, record if metrics.enabled else None)
+    t = time.perf_counter_ns()
+    vecs = risk_vectors(heads)
+    record("vector", t)
+    # a trained combiner (models/combiner.json) replaces the hand-set weights and thresholds
+    combiner = bundle.combiner if bundle is not None else None
+    if combiner is not None:
+        weights = combiner.head_weights
+    else:
+        weights = bundle.ensemble_weights if bundle is not None else None
+    t = time.perf_counter_ns()
+    reasons = explain_reasons(bundle, recs, cols, X, heads, weights or DEFAULT_WEIGHTS)
+    record("explain", t)
+    t = time.perf_counter_ns()
+    if combiner is not None:
+        z = combiner.logits(heads)
+        scores = combiner.calibrate(z).tolist()
+        t1 = time.perf_counter_ns()
+        decisions = combiner.decide(z)
+    else:
+        scores = [summarize(vec, weights) for vec in vecs]
+        t1 = time.perf_counter_ns()
+        decisions = [decide(s) for s in scores]
+    t2 = time.perf_counter_ns()
+    version = bundle.version if bundle is not None else None
+    out = [RiskResponse(risk_vector=vec, risk_score=s, decision=d, reasons=rs, model_version=version)
+           for vec, s, d, rs in zip(vecs, scores, decisions, reasons)]
+    t3 = time.perf_counter_ns()
+    record("summarize", t, t1)
+    record("decide", t1, t2)
+    record("serialize", t2, t3)
+    return out
+
+# concurrent /score calls are coalesced into one batched model evaluation
+batcher = MicroBatcher(score_records, max_batch=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT_MS/1000.0,
+                       max_queue=BATCH_MAX_QUEUE, max_in_flight=BATCH_IN_FLIGHT)
+
 @app.post("/score", response_model=RiskResponse)
-def score(txn: Transaction):
-    df = to_frame(txn.dict())
-    vec = compute_risk_vector(df)
-    s = summarize(vec)
-    decision = decide(s)
-    message = user_messages(decision, vec)
-    return RiskResponse(
-        risk_vector=vec, 
-        risk_score=s, 
-        decision=decision, 
-        reasons=top_reasons(df)
-    )
+async def score(txn: Transaction):
+    if not BATCHING:
+        return (await run_in_threadpool(score_records, [txn]))[0]
+    try:
+        return await batcher.submit(txn)
+    except Overloaded as e:
+        # shed load early; the client retries (a retry with the same content hits the decision cache)
+        raise HTTPException(status_code=503, detail=f"scoring queue full: {e}", headers={"Retry-After": "1"})
+
+@app.post("/score/batch", response_model=List[RiskResponse])
+def score_batch(txns: List[Transaction]):
+    # bursts from card processors go straight to the batched path
+    return score_records(txns)
+
+@app.get("/score/batcher")
+def batcher_stats():
+    # queue depth, batch sizes and queueing delay of the /score micro-batcher
+    return batcher.stats()
+
+@app.get("/score/cache")
+def decision_cache_stats():
+    # hits / misses of the retry cache
+    return decision_cache.stats()
+
+@app.on_event("startup")
+def start_model_watch():
+    if MODEL_WATCH_S > 0:
+        registry.watch(MODEL_WATCH_S)
+
+@app.get("/admin/models")
+def models_info():
+    return registry.info()
+
+@app.post("/admin/models/reload")
+async def models_reload(force: bool = False):
+    # load + warm off the event loop; in-flight scoring keeps the old bundle
+    version = await run_in_threadpool(registry.reload, force)
+    return registry.info() | {"version": version}
 
 # Feedback for continuous learning
 class FeedbackIn(Transaction):
     label: Literal["FRAUD","LEGIT"]
 
 @app.post("/feedback")
-def feedback(fb: FeedbackIn):
-    # append to training set for retrain job
-    import json, os
-    os.makedirs("data", exist_ok=True)
-    with open("data/labels.jsonl","a") as f:
-        rec = fb.dict()
-        rec["label"] = 1 if fb.label=="FRAUD" else 0
-        f.write(json.dumps(rec)+"\n")
+async def feedback(fb: FeedbackIn):
+    # queue for the retrain job; the disk write happens on the log's flusher thread
+    rec = fb.model_dump()
+    rec["label"] = 1 if fb.label=="FRAUD" else 0
+    missing = [f for f in DERIVED if rec[f] is None]
+    if missing:  # label with the features as the store sees them now
+        derived = feature_store.peek([fb.user_id], [fb.device_id])
+        for f in missing:
+            rec[f] = derived[f][0].item()
+    if rec["label"]:
+        feature_store.record_chargeback(fb.user_id)
+    feedback_log.append(rec)
     return {"status":"ok"}
 
+@app.get("/feedback/log")
+def feedback_stats():
+    return feedback_log.stats()
+
+@app.on_event("shutdown")
+def flush_feedback():
+    feedback_log.close()
+    if FEATURE_SNAPSHOT:
+        feature_store.snapshot(FEATURE_SNAPSHOT)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_scrape():
+    # Prometheus text format: p50/p95/p99 per stage (seconds), cumulative since start or reset
+    return metrics.prometheus()
+
+@app.get("/metrics/latency")
+def metrics_latency():
+    return metrics.summary()
+
+@app.post("/admin/metrics/reset")
+def metrics_reset():
+    metrics.reset()
+    return {"status": "ok"}
+
+@app.get("/explain/{txn_id}")
+def explain(txn_id: str):
+    # all-field, per-head attributions for transactions explained in the background
+    try:
+        result = explanations.get(txn_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"no background explanation for {txn_id}")
+    if result is None:
+        return {"txn_id": txn_id, "status": "pending"}
+    return {"txn_id": txn_id, "status": "failed" if "error" in result else "done"} | result
+
+@app.get("/explanations/stats")
+def explanation_stats():
+    explainer = registry.active.explainer if registry.active is not None else None
+    return explanations.stats() | {
+        "mode": EXPLAIN_MODE, "budget_ms": EXPLAIN_BUDGET_MS,
+        "heads": sorted(explainer.heads) if explainer is not None else [],
+        "fixed_ms": explainer.fixed_ms if explainer is not None else None,
+        "ms_per_row": explainer.ms_per_row if explainer is not None else None,
+    }
+
+@app.get("/features/stats")
+def feature_store_stats():
+    return feature_store.stats()
+
+@app.post("/admin/features/snapshot")
+def feature_store_snapshot():
+    if not FEATURE_SNAPSHOT:
+        return {"status": "skipped", "reason": "SENTINEL_FEATURE_SNAPSHOT is not set"}
+    return {"status": "ok", "path": str(feature_store.snapshot(FEATURE_SNAPSHOT))} | feature_store.stats()
+
 @app.get("/")
 def root():
     return {"message": "Sentinel AI Risk API", "status": "running"}
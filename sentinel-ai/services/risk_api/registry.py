@@ -0,0 +1,340 @@
+"""In-process model registry for the risk API.
+
+The registry owns the models the API scores with. A new version is loaded,
+compiled and warmed in the caller's (or a background) thread while the current
+version keeps serving; the switch is a single reference assignment, so a
+scoring call that already grabbed ``registry.active`` finishes on the version
+it started with.
+
+Startup: with ``fmt="mmap"`` the compiled arrays of each version are exported
+once under ``models/compiled/<version>/`` and later workers load them with
+``np.load(mmap_mode="r")`` -- no unpickling, no sklearn/joblib import, and
+processes on the same host share the pages through the OS cache. Run
+``python -m services.risk_api.registry`` to export ahead of a rollout.
+
+Budget: ``python -m services.training.budget`` records the serving latency and
+footprint the models were pruned to, with the hash of every model file, in
+``models/budget.json``. Each load checks the bundle against it
+(``ModelBundle.check_budget``) and, by policy, warns or refuses the version.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from services.shared.features import to_columns, CATEGORICALS, NUMERICS, BINARIES
+from services.shared.geo import DensityGrid
+from services.risk_api.engine import RiskEngine
+from services.risk_api.explain import Explainer
+from services.risk_api.combiner import Combiner, BASE_HEADS
+
+# artifacts the API knows about, by role
+MODEL_FILES = {
+    "anomaly": "anomaly_iforest.joblib",         # services.training.bootstrap_model
+    "behavioral": "behavioral_gb.joblib",        # services.training.retrain
+    "federated": "behavioral_global_fl.joblib",  # services.federation.fed_sim
+    "geo": "geo_density.joblib",                 # services.training.bootstrap_model (DensityGrid)
+}
+# bump when the layout written by ModelBundle.export changes
+EXPORT_FORMAT = 4
+
+# optional json settings versioned together with the models
+CONFIG_FILES = {
+    "ensemble": "ensemble.json",   # {"weights": {head: weight}} for summarize()
+    "combiner": "combiner.json",   # services.training.calibrate; replaces the weights and thresholds
+    "budget": "budget.json",       # services.training.budget; checked at load
+}
+# what load_bundle does when a version breaks its budget: "off", "warn" or "enforce" (refuse it)
+BUDGET_POLICIES = ("off", "warn", "enforce")
+BUDGET_LOAD_SLACK = 1.5   # p99 measured at load may exceed the recorded budget by this factor (host, noise)
+BUDGET_LOAD_CALLS = 200
+
+class ModelBundle:
+    """One immutable, ready-to-score set of models"""
+
+    def __init__(self, version, models, paths, engine=None, config=None, geo=None):
+        self.version = version
+        self.models = models      # role -> fitted sklearn pipeline (empty when loaded compiled)
+        self.paths = paths        # role -> source file
+        self.config = config or {}
+        self.loaded_at = time.time()
+        pipe = models.get("anomaly")
+        self.pipe = pipe
+        self.iso = pipe.named_steps["iso"] if pipe is not None else None
+        self.geo = geo if geo is not None else models.get("geo")  # DensityGrid for the geo head
+        # every head compiled over one shared encoding
+        self.engine = engine if engine is not None else RiskEngine.from_models(models)
+        self.encoder = self.engine.encoder
+        self.forest = self.engine.model("anomaly")
+        self.source = "joblib" if models else "compiled"
+        self._explainer = None
+        self.budget_problems = None   # set by check_budget
+        self.load_p99_us = None
+        self.combiner = None
+        if "combiner" in self.config:
+            combiner = Combiner.from_config(self.config["combiner"])
+            missing = set(combiner.heads) - BASE_HEADS - set(self.engine.heads)
+            if missing:  # e.g. trained with the consortium head, served without the federated model
+                print(f"Warning: combiner needs heads {sorted(missing)}; using the ensemble weights")
+            else:
+                self.combiner = combiner
+
+    @property
+    def explainer(self):
+        # attribution tables are built on first use (or by warm), once per version
+        if self._explainer is None and self.encoder is not None:
+            self._explainer = Explainer(self.engine)
+        return self._explainer
+
+    @property
+    def ensemble_weights(self):
+        return self.config.get("ensemble", {}).get("weights")
+
+    def warm(self):
+        # touch every array once so the first real request doesn't pay for page faults
+        if self.encoder is None:
+            return
+        probe = _probe()
+        self.engine.evaluate(to_columns([probe]), self.encoder.encode(probe))
+        self.explainer.calibrate()
+
+    def check_budget(self, measure=True):
+        """Ways this version breaks ``budget.json``; empty when it holds.
+
+        Model files must hash as recorded (a retrain after the budget compile does not), every tree
+        head must be covered, and the compiled footprint must be within the budget. With
+        ``measure``, single-row calls are also timed here and must stay within ``BUDGET_LOAD_SLACK``
+        of the p99 budget.
+        """
+        from services.shared.forest import footprint
+        budget = self.config.get("budget")
+        if budget is None:
+            problems = ["no budget.json (run services.training.budget)"]
+        else:
+            problems = list(budget.get("problems", []))   # compiled with --force
+            for role, f in budget.get("files", {}).items():
+                path = self.paths.get(role)
+                if path is None or file_sha256(path) != f["sha256"]:
+                    problems.append(f"{role} model is not the one budgeted ({f['file']})")
+            missing = sorted(set(self.engine.heads) - set(budget.get("heads", {})))
+            if missing:
+                problems.append(f"heads {missing} are not covered by the budget")
+            limits = budget["budget"]
+            size = sum(footprint(head.model) for head in self.engine.heads.values())
+            if size > limits["max_bytes"]:
+                problems.append(f"compiled models take {size} bytes > {limits['max_bytes']}")
+            if measure and self.encoder is not None:
+                from services.shared.latency import time_calls
+                X = self.encoder.encode(_probe())
+                self.load_p99_us = time_calls(lambda x: self.engine.evaluate(None, x), [X],
+                                              BUDGET_LOAD_CALLS)["p99_us"]
+                if self.load_p99_us > limits["p99_us"] * BUDGET_LOAD_SLACK:
+                    problems.append(f"p99 {self.load_p99_us:.0f}µs on this host > "
+                                    f"{BUDGET_LOAD_SLACK:g} x {limits['p99_us']:.0f}µs budget")
+        self.budget_problems = problems
+        return problems
+
+    def export(self, path):
+        """Write the compiled form (plain .npy/.json) for mmap loading; atomic per directory"""
+        path = Path(path)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        self.engine.save(tmp / "engine")
+        if self.geo is not None:
+            self.geo.save(tmp / "geo.npz")
+        (tmp / "bundle.json").write_text(json.dumps({"version": self.version, "config": self.config}))
+        try:
+            os.rename(tmp, path)
+        except OSError:  # another worker exported the same version first
+            shutil.rmtree(tmp, ignore_errors=True)
+        return path
+
+    @classmethod
+    def from_export(cls, path, paths, mmap_mode="r"):
+        path = Path(path)
+        meta = json.loads((path / "bundle.json").read_text())
+        geo = DensityGrid.load(path / "geo.npz") if (path / "geo.npz").exists() else None
+        return cls(meta["version"], {}, paths, config=meta.get("config"), geo=geo,
+                   engine=RiskEngine.load(path / "engine", mmap_mode=mmap_mode))
+
+    def info(self):
+        budget = self.config.get("budget")
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "source": self.source,
+            "heads": sorted(self.engine.heads),
+            "combiner": self.combiner.meta if self.combiner is not None else None,
+            "models": {role: str(p) for role, p in self.paths.items()},
+            "budget": None if budget is None else {**budget["budget"], "compiled_p99_us": budget["measured"]["p99_us"],
+                                                   "load_p99_us": self.load_p99_us,
+                                                   "problems": self.budget_problems},
+        }
+
+def _probe():
+    probe = {c: "" for c in CATEGORICALS}
+    probe.update({f: 0.0 for f in NUMERICS + BINARIES})
+    return probe
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _fingerprint(paths):
+    # content hash over every artifact, so a re-save with identical bytes is not a new version
+    h = hashlib.sha256()
+    for role in sorted(paths):
+        h.update(role.encode())
+        with open(paths[role], "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:12]
+
+class ModelRegistry:
+    def __init__(self, models_dir="models", files=None, fmt="joblib", configs=None, budget="warn"):
+        if budget not in BUDGET_POLICIES:
+            raise ValueError(f"budget policy must be one of {BUDGET_POLICIES}, got {budget!r}")
+        self.models_dir = Path(models_dir)
+        self.files = dict(files or MODEL_FILES)
+        self.configs = dict(CONFIG_FILES if configs is None else configs)
+        self.fmt = fmt            # "joblib": unpickle sources; "mmap": compiled export, memory-mapped
+        self.budget = budget
+        self._active = None
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+        self._listeners = []
+        self.swaps = 0
+        self.last_error = None
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def version(self):
+        return self._active.version if self._active is not None else None
+
+    def on_swap(self, fn):
+        """Call ``fn(old_bundle, new_bundle)`` after every swap"""
+        self._listeners.append(fn)
+        return fn
+
+    def _paths(self):
+        # models and configs; all of them feed the version fingerprint
+        files = {**self.files, **self.configs}
+        return {role: self.models_dir / name for role, name in files.items()
+                if (self.models_dir / name).exists()}
+
+    def _signature(self):
+        sig = []
+        for role, p in sorted(self._paths().items()):
+            st = p.stat()
+            sig.append((role, st.st_mtime_ns, st.st_size))
+        return tuple(sig)
+
+    def load_bundle(self):
+        """Load, compile and warm whatever is in models_dir (does not activate it)"""
+        paths = self._paths()
+        if "anomaly" not in paths:
+            raise FileNotFoundError(self.models_dir / self.files["anomaly"])
+        version = _fingerprint(paths)
+        compiled = self.compiled_dir(version)
+        if self.fmt == "mmap" and compiled.exists():
+            bundle = ModelBundle.from_export(compiled, paths)
+        else:
+            import joblib  # heavy (and pulls in sklearn on unpickle); only needed for sources
+            models = {role: joblib.load(p) for role, p in paths.items() if role in self.files}
+            config = {role: json.loads(p.read_text()) for role, p in paths.items() if role in self.configs}
+            bundle = ModelBundle(version, models, paths, config=config)
+            if self.fmt == "mmap":
+                try:
+                    bundle.export(compiled)
+                except OSError as e:  # read-only models dir: still serve from memory
+                    print(f"Warning: could not export compiled models to {compiled}: {e}")
+        bundle.warm()
+        if self.budget != "off":
+            # without budget.json there is nothing to warn about; enforce still requires one
+            problems = bundle.check_budget() if "budget" in bundle.config or self.budget == "enforce" else []
+            if problems and self.budget == "enforce":
+                raise ValueError(f"model version {version} breaks its budget: " + "; ".join(problems))
+            for problem in problems:
+                print(f"Warning: model version {version} budget: {problem}")
+        return bundle
+
+    def compiled_dir(self, version):
+        return self.models_dir / "compiled" / f"{version}-f{EXPORT_FORMAT}"
+
+    def reload(self, force=False):
+        """Build the next version and swap it in; returns the active version"""
+        with self._reload_lock:  # one loader at a time; scoring never takes this lock
+            try:
+                paths = self._paths()
+                if not force and self._active is not None and "anomaly" in paths \
+                        and _fingerprint(paths) == self._active.version:
+                    return self._active.version
+                bundle = self.load_bundle()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if self._active is None:
+                    raise
+                print(f"Warning: model reload failed, keeping {self._active.version}: {self.last_error}")
+                return self._active.version
+            old, self._active = self._active, bundle
+            self.swaps += 1
+            self.last_error = None
+        for fn in self._listeners:
+            fn(old, bundle)
+        return bundle.version
+
+    def reload_in_background(self):
+        t = threading.Thread(target=self.reload, name="model-reload", daemon=True)
+        t.start()
+        return t
+
+    def watch(self, interval=5.0):
+        """Poll models_dir and reload once a changed file has stopped changing"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return self._watcher
+        self._stop.clear()
+
+        def loop():
+            seen = self._signature()
+            pending = None
+            while not self._stop.wait(interval):
+                sig = self._signature()
+                if sig == seen:
+                    pending = None
+                    continue
+                if sig != pending:  # still being written; look again next tick
+                    pending = sig
+                    continue
+                seen, pending = sig, None
+                self.reload()
+
+        self._watcher = threading.Thread(target=loop, name="model-watch", daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def stop(self):
+        self._stop.set()
+
+    def info(self):
+        out = self._active.info() if self._active is not None else {"version": None}
+        out.update({"swaps": self.swaps, "last_error": self.last_error,
+                    "watching": self._watcher is not None and self._watcher.is_alive()})
+        return out
+
+if __name__ == "__main__":
+    # export the compiled arrays for the current models so workers can start in mmap mode
+    import sys
+    reg = ModelRegistry(sys.argv[1] if len(sys.argv) > 1 else "models", fmt="mmap")
+    version = reg.reload()
+    print(f"Exported {version} → {reg.compiled_dir(version)}")
@@ -0,0 +1,89 @@
+"""Risk heads, risk vectors and the hand-set ensemble for a model bundle.
+
+The scoring math shared by the API and the offline jobs (backtest, combiner
+calibration). Importing it has no side effects: nothing here builds the model
+registry, the feature store, the feedback log or the explanation worker that
+``services.risk_api.main`` starts, so callers pass the ``ModelBundle`` to score
+with (``None`` scores with the fallback formulas only).
+"""
+import time
+
+import numpy as np
+
+from services.shared.features import NUMERICS
+from services.shared import geo
+
+# thresholds from PRD: low <0.2, medium 0.2–0.6, high >0.6 (tune later)
+LOW_T, HIGH_T = 0.2, 0.6
+
+RISKY_MERCHANTS = ["luxury","gaming"]
+
+# default ensemble; override per model version with models/ensemble.json {"weights": {...}}
+DEFAULT_WEIGHTS = {"behavioral":0.4, "network":0.25, "anomaly":0.35, "consortium":0.2, "geo":0.15}
+
+def _untimed(stage, start_ns, end_ns=None):
+    pass
+
+def compute_heads(cols, X=None, bundle=None, timer=None):
+    # heads: behavioral, network, anomaly, geo (+ consortium once the federated model exists),
+    # column-wise over a batch (cols from to_columns, optionally with the travel columns from
+    # fill_derived; X optionally pre-encoded by the caller); returns head -> array of scores.
+    # Learned heads come from the bundle's models, all scored over one shared encoding.
+    # timer(stage, start_ns) is called after each head when given.
+    learned = bundle.engine.evaluate(cols, X, timer) if bundle is not None else {}
+    n = len(cols[NUMERICS[0]])
+    record = timer or _untimed
+
+    behavioral = learned.get("behavioral")
+    if behavioral is None:
+        # toy formula until retrain has produced behavioral_gb.joblib
+        behavioral = np.clip(np.tanh(
+            0.4*np.asarray(cols["past_24h_txn_count"]) +
+            0.6*np.asarray(cols["velocity_usd_7d"])/1000.0 +
+            0.8*np.asarray(cols["is_new_device"], dtype=np.float64)
+        ), 0, 1)
+    anomaly = learned.get("anomaly")
+    if anomaly is None:
+        anomaly = np.full(n, 0.1)  # fallback if no model
+
+    start = time.perf_counter_ns()
+    risky = np.isin(np.asarray(cols["merchant_category"]).astype(str), RISKY_MERCHANTS).astype(int)
+    network = np.clip(np.tanh( np.asarray(cols["ip_asn_risk"]) + risky*0.3 ), 0, 1)
+    record("head.network", start)
+
+    # impossible travel + how unusual the region is (density grid from the training history);
+    # NaN on rows with neither signal, which then leave geo out of their vector
+    start = time.perf_counter_ns()
+    geo_risk = geo.geo_risk(cols, bundle.geo if bundle is not None else None)
+    record("head.geo", start)
+
+    heads = {"behavioral": behavioral, "network": network, "anomaly": anomaly, "geo": geo_risk}
+    if "consortium" in learned:
+        heads["consortium"] = learned["consortium"]
+    return heads
+
+def risk_vectors(heads):
+    # head -> array  =>  one {head: score} dict per row, without the heads that are NaN (no signal) there
+    names = list(heads)
+    return [{h: v for h, v in zip(names, row) if v == v}
+            for row in zip(*(np.asarray(v, dtype=np.float64).tolist() for v in heads.values()))]
+
+def compute_risk_vectors(cols, X=None, bundle=None, timer=None):
+    heads = compute_heads(cols, X, bundle, timer)
+    start = time.perf_counter_ns()
+    vecs = risk_vectors(heads)
+    (timer or _untimed)("vector", start)
+    return vecs
+
+def summarize(vector, weights=None):
+    # weighted mean over the heads present in the vector
+    w = weights or DEFAULT_WEIGHTS
+    keys = [k for k in w if k in vector]
+    total = sum(w[k] for k in keys)
+    s = sum(w[k]*vector[k] for k in keys)
+    return float(s / total if total > 0 else s)
+
+def decide(risk_score: float, low=LOW_T, high=HIGH_T):
+    if risk_score < low: return "APPROVE"
+    if risk_score < high: return "STEP_UP"
+    return "REVIEW"
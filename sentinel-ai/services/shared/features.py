@@ -1,5 +1,6 @@
+import json
+import threading
 import numpy as np
-import pandas as pd
 
 CATEGORICALS = ["merchant_category"]
 NUMERICS = ["amount","geo_lat","geo_lon","hour_of_day","past_24h_txn_count",
@@ -7,10 +8,116 @@ NUMERICS = ["amount","geo_lat","geo_lon","hour_of_day","past_24h_txn_count",
 BINARIES = ["is_new_device"]
 
 def to_frame(txn_dict):
-    df = pd.DataFrame([txn_dict])
+    return to_frame_many([txn_dict])
+
+def to_frame_many(txn_dicts):
+    # one frame for a whole batch of transactions (row order preserved)
+    import pandas as pd  # only the DataFrame path needs pandas; keep API startup light
+    df = pd.DataFrame(list(txn_dicts))
     # simple encodings (replace later with sklearn ColumnTransformer pipeline)
     for b in BINARIES:
         df[b] = df[b].astype(int)
     for c in CATEGORICALS:
         df[c] = df[c].astype("category")
     return df
+
+def to_columns(txn_dicts):
+    # pandas-free columnar view of a batch: float64 numerics/binaries, object categoricals
+    txn_dicts = list(txn_dicts)
+    cols = {f: np.array([t[f] for t in txn_dicts], dtype=np.float64) for f in NUMERICS+BINARIES}
+    for c in CATEGORICALS:
+        cols[c] = np.array([t[c] for t in txn_dicts], dtype=object)
+    return cols
+
+def pipeline_categories(pipe):
+    # categories come from the fitted OneHotEncoder inside the "pre" ColumnTransformer
+    return [list(c) for c in pipe.named_steps["pre"].named_transformers_["cat"].categories_]
+
+class FeatureEncoder:
+    """Precompiled stand-in for the fitted ColumnTransformer (one-hot + passthrough).
+
+    Produces the same float32 matrix the IsolationForest sees after
+    ``pipe.named_steps["pre"].transform(df)``, without building a DataFrame.
+    With ``dtype=np.float64`` the output is the ColumnTransformer output itself
+    (what linear models consume; trees cast it to float32 on their own).
+    """
+
+    def __init__(self, categories, dtype=np.float32):
+        self.categories = [list(cats) for cats in categories]
+        self.dtype = np.dtype(dtype)
+        self._lookup = [{v: i for i, v in enumerate(cats)} for cats in self.categories]
+        self._offsets = np.cumsum([0] + [len(cats) for cats in self.categories])
+        self.n_onehot = int(self._offsets[-1])
+        self.columns = [f"{c}_{v}" for c, cats in zip(CATEGORICALS, self.categories) for v in cats] \
+            + NUMERICS + BINARIES
+        self.n_features = len(self.columns)
+        self._local = threading.local()
+
+    @classmethod
+    def from_pipeline(cls, pipe, dtype=np.float32):
+        return cls(pipeline_categories(pipe), dtype)
+
+    @classmethod
+    def union(cls, pipes, dtype=np.float64):
+        """One encoder whose layout covers the one-hot vocabularies of several pipelines"""
+        cats = [sorted(set().union(*vocab)) for vocab in zip(*(pipeline_categories(p) for p in pipes))]
+        return cls(cats, dtype)
+
+    def column_index(self, categories):
+        """Columns of this encoder's output that form another encoder's layout.
+
+        Values missing from ``categories`` are simply not selected, which is what
+        that model's ``handle_unknown="ignore"`` would have produced anyway.
+        """
+        idx = []
+        for lookup, off, cats in zip(self._lookup, self._offsets, categories):
+            idx.extend(int(off) + lookup[v] for v in cats)
+        idx.extend(range(self.n_onehot, self.n_features))
+        return np.asarray(idx, dtype=np.intp)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"categoricals": CATEGORICALS, "categories": self.categories,
+                       "dtype": self.dtype.name}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            spec = json.load(f)
+        if spec["categoricals"] != CATEGORICALS:
+            raise ValueError(f"encoder was saved for {spec['categoricals']}, expected {CATEGORICALS}")
+        return cls(spec["categories"], spec.get("dtype", "float32"))
+
+    def _row(self):
+        row = getattr(self._local, "row", None)
+        if row is None:
+            row = self._local.row = np.zeros((1, self.n_features), dtype=self.dtype)
+        return row
+
+    def encode(self, txn):
+        """Encode one transaction dict into a preallocated (per-thread) row.
+
+        The returned array is reused by the next ``encode`` call on the same thread.
+        """
+        row = self._row()
+        row[0, :self.n_onehot] = 0.0
+        for c, lookup, off in zip(CATEGORICALS, self._lookup, self._offsets):
+            j = lookup.get(txn[c])
+            if j is not None:  # handle_unknown="ignore" -> all zeros
+                row[0, off + j] = 1.0
+        for k, f in enumerate(NUMERICS + BINARIES):
+            row[0, self.n_onehot + k] = float(txn[f])
+        return row
+
+    def encode_columns(self, cols):
+        """Encode a ``to_columns`` batch into a new (n, n_features) matrix"""
+        n = len(cols[NUMERICS[0]])
+        X = np.zeros((n, self.n_features), dtype=self.dtype)
+        rows = np.arange(n)
+        for c, lookup, off in zip(CATEGORICALS, self._lookup, self._offsets):
+            codes = np.fromiter((lookup.get(v, -1) for v in cols[c]), dtype=np.intp, count=n)
+            hit = codes >= 0
+            X[rows[hit], off + codes[hit]] = 1.0
+        for k, f in enumerate(NUMERICS + BINARIES):
+            X[:, self.n_onehot + k] = cols[f]
+        return X
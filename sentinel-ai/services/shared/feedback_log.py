@@ -0,0 +1,254 @@
+"""Append-optimized analyst feedback log.
+
+Layout of ``data/feedback/``::
+
+    segment-000001.npz    sealed + compacted: one NumPy array per column
+    segment-000002.jsonl  sealed, waiting for compaction
+    segment-000003.jsonl  active segment (appends go here)
+    .lock                 flock()ed by every writer/rotator/compactor
+
+Writers never touch the disk on the request path: ``append`` puts the record
+on an in-process buffer and a flusher thread group-commits everything buffered
+with one ``write`` under the lock, so several uvicorn workers can share the
+log. Segments rotate at ``max_segment_bytes``; sealed segments are compacted
+to ``.npz`` column files. Readers iterate batches from a position (segment,
+row), so a consumer such as the retrain job only reads what is new.
+
+The pre-log ``data/labels.jsonl`` is read as a sealed segment 0.
+"""
+import fcntl
+import json
+import os
+import re
+import threading
+import typing
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from services.shared.schemas import Transaction
+
+_DTYPES = {str: str, float: np.float64, int: np.int64, bool: bool}
+
+def _dtype(annotation):
+    # Optional[X] -> X; records are complete by the time they reach the log
+    args = [a for a in typing.get_args(annotation) if a is not type(None)]
+    return _DTYPES[args[0] if args else annotation]
+
+# column -> numpy dtype, in schema order
+FIELDS = {name: _dtype(f.annotation) for name, f in Transaction.model_fields.items()}
+FIELDS["label"] = np.int64
+
+_SEGMENT = re.compile(r"^segment-(\d+)\.(jsonl|npz)$")
+
+def _columns(records):
+    cols = {}
+    for name, dtype in FIELDS.items():
+        cols[name] = np.array([r[name] for r in records], dtype=dtype)
+    return cols
+
+class FeedbackLog:
+    def __init__(self, path="data/feedback", legacy="data/labels.jsonl",
+                 max_segment_bytes=8 << 20, flush_interval=0.05, max_buffer=1024, fsync=False,
+                 auto_compact=True):
+        self.path = Path(path)
+        self.legacy = Path(legacy) if legacy else None
+        self.max_segment_bytes = max_segment_bytes
+        self.flush_interval = flush_interval   # group-commit window (seconds)
+        self.max_buffer = max_buffer           # flush early once this many records wait
+        self.fsync = fsync
+        self.auto_compact = auto_compact       # compact sealed segments from the flusher
+        self._buf = []
+        self._buf_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._flusher = None
+        self.appended = 0
+        self.committed = 0
+        self.commits = 0
+
+    # -- writing ---------------------------------------------------------
+
+    @contextmanager
+    def _locked(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / ".lock", "a") as lk:
+            fcntl.flock(lk, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lk, fcntl.LOCK_UN)
+
+    def append(self, rec):
+        """Queue one feedback record (dict with the Transaction fields + int label)"""
+        with self._buf_lock:
+            self._buf.append(rec)
+            self.appended += 1
+            n = len(self._buf)
+        if self._flusher is None or not self._flusher.is_alive():
+            self._start()
+        if n >= self.max_buffer:
+            self._wake.set()
+
+    def _start(self):
+        with self._buf_lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._closed.clear()
+            self._flusher = threading.Thread(target=self._run, name="feedback-flush", daemon=True)
+            self._flusher.start()
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError as e:  # keep the records buffered and retry next tick
+                print(f"Warning: feedback flush failed: {e}")
+
+    def flush(self):
+        """Group-commit everything buffered; returns the number of records written"""
+        with self._buf_lock:
+            batch, self._buf = self._buf, []
+        if not batch:
+            return 0
+        payload = "".join(json.dumps(r) + "\n" for r in batch).encode()
+        try:
+            with self._locked():
+                seg = self._active_segment()
+                rotated = not seg.exists()
+                fd = os.open(seg, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, payload)
+                    if self.fsync:
+                        os.fsync(fd)
+                finally:
+                    os.close(fd)
+        except OSError:
+            with self._buf_lock:
+                self._buf[:0] = batch
+            raise
+        self.committed += len(batch)
+        self.commits += 1
+        if rotated and self.auto_compact:
+            self.compact()  # the previous segment was just sealed
+        return len(batch)
+
+    def close(self):
+        self._closed.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        self.flush()
+
+    def _segments(self):
+        """seq -> {"jsonl": path, "npz": path} for every segment on disk"""
+        segs = {}
+        if self.path.exists():
+            for p in self.path.iterdir():
+                m = _SEGMENT.match(p.name)
+                if m:
+                    segs.setdefault(int(m.group(1)), {})[m.group(2)] = p
+        return dict(sorted(segs.items()))
+
+    def _active_segment(self):
+        # caller holds the lock
+        segs = self._segments()
+        if segs:
+            seq, files = next(reversed(segs.items()))
+            jsonl = files.get("jsonl")
+            if "npz" not in files and jsonl is not None and jsonl.stat().st_size < self.max_segment_bytes:
+                return jsonl
+            seq += 1
+        else:
+            seq = 1
+        return self.path / f"segment-{seq:06d}.jsonl"
+
+    # -- compaction --------------------------------------------------------
+
+    def compact(self):
+        """Convert every sealed jsonl segment into a columnar .npz; returns segments compacted"""
+        with self._locked():
+            segs = self._segments()
+            active = self._active_segment()
+        done = 0
+        for seq, files in segs.items():
+            jsonl = files.get("jsonl")
+            if jsonl is None or jsonl == active or "npz" in files:
+                continue
+            records = [json.loads(l) for l in jsonl.read_text().splitlines() if l.strip()]
+            tmp = jsonl.with_name(f".{jsonl.stem}.{os.getpid()}.npz")
+            np.savez_compressed(tmp, **_columns(records))
+            with self._locked():
+                os.replace(tmp, jsonl.with_suffix(".npz"))
+                jsonl.unlink()
+            done += 1
+        # a segment can only be sealed while it was the newest one; the npz is complete
+        # once it exists, so a leftover jsonl next to it is a crashed compaction
+        for seq, files in self._segments().items():
+            if "npz" in files and "jsonl" in files:
+                with self._locked():
+                    files["jsonl"].unlink(missing_ok=True)
+        return done
+
+    # -- reading -----------------------------------------------------------
+
+    def _read_segment(self, seq, files, skip=0):
+        # rows [skip:] of one segment
+        if "npz" in files:
+            with np.load(files["npz"]) as z:
+                return {name: z[name][skip:] for name in FIELDS}
+        path = files["jsonl"]
+        with open(path, "rb") as f:
+            data = f.read()
+        data = data[:data.rfind(b"\n") + 1]  # ignore a line still being written
+        records = []
+        lines = [l for l in data.decode().splitlines() if l.strip()]
+        for line in lines[skip:]:  # skipped rows are never parsed
+            rec = json.loads(line)
+            if seq == 0:  # legacy rows may lack optional fields
+                rec = {**Transaction(**{k: v for k, v in rec.items() if k != "label"}).model_dump(),
+                       "label": rec["label"]}
+            records.append(rec)
+        return _columns(records)
+
+    def iter_batches(self, start=(0, 0), batch_size=50_000):
+        """Yield ``(columns, position)`` from ``start`` onward, oldest first.
+
+        ``columns`` maps field -> numpy array for up to ``batch_size`` rows;
+        ``position`` is the (segment, row) to resume from after this batch.
+        Only one segment is held in memory at a time.
+        """
+        segs = self._segments()
+        if self.legacy is not None and self.legacy.exists():
+            segs = {0: {"jsonl": self.legacy}, **segs}
+        start_seq, start_row = start
+        for seq, files in segs.items():
+            if seq < start_seq:
+                continue
+            skip = start_row if seq == start_seq else 0
+            cols = self._read_segment(seq, files, skip)
+            n = len(cols["label"])
+            for row in range(0, n, batch_size):
+                end = min(row + batch_size, n)
+                yield {k: v[row:end] for k, v in cols.items()}, (seq, skip + end)
+
+    def read_frame(self, start=(0, 0)):
+        """Everything from ``start`` as one DataFrame (plus the resume position)"""
+        import pandas as pd
+        frames, pos = [], start
+        for cols, pos in self.iter_batches(start):
+            frames.append(pd.DataFrame(cols))
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=list(FIELDS))
+        return df, pos
+
+    def stats(self):
+        return {
+            "buffered": len(self._buf),
+            "appended": self.appended,
+            "committed": self.committed,
+            "commits": self.commits,
+            "segments": {f"{seq}": sorted(files) for seq, files in self._segments().items()},
+        }
@@ -0,0 +1,276 @@
+"""Flattened tree ensembles for low-overhead inference.
+
+sklearn's ``decision_function`` validates input and dispatches per tree in
+Python, which dominates the cost of scoring a single transaction. Here every
+tree of a fitted ensemble is copied into one set of contiguous node arrays and
+all trees are walked together, one level per numpy step, for one row or many.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+
+def _flatten(trees, features_per_tree, leaf_values):
+    """Concatenate sklearn ``Tree`` objects into global node arrays"""
+    feats, thrs, lefts, rights, missing, values, covers, roots = [], [], [], [], [], [], [], []
+    base, max_depth = 0, 0
+    for t, features, value in zip(trees, features_per_tree, leaf_values):
+        n = t.node_count
+        ids = np.arange(n)
+        leaf = t.children_left == -1
+        local = np.where(leaf, 0, t.feature)
+        feats.append(np.where(leaf, 0, local if features is None else np.asarray(features)[local]))
+        thrs.append(t.threshold)
+        lefts.append(np.where(leaf, ids, t.children_left) + base)
+        rights.append(np.where(leaf, ids, t.children_right) + base)
+        missing.append(np.asarray(t.missing_go_to_left, dtype=bool))
+        values.append(value)
+        covers.append(t.weighted_n_node_samples)
+        roots.append(base)
+        max_depth = max(max_depth, t.max_depth)
+        base += n
+    return {
+        "feature": np.ascontiguousarray(np.concatenate(feats), dtype=np.intp),
+        "threshold": np.ascontiguousarray(np.concatenate(thrs), dtype=np.float64),
+        "left": np.ascontiguousarray(np.concatenate(lefts), dtype=np.intp),
+        "right": np.ascontiguousarray(np.concatenate(rights), dtype=np.intp),
+        "missing_left": np.concatenate(missing),
+        "leaf_value": np.ascontiguousarray(np.concatenate(values), dtype=np.float64),
+        "cover": np.ascontiguousarray(np.concatenate(covers), dtype=np.float64),
+        "roots": np.asarray(roots, dtype=np.intp),
+        "max_depth": int(max_depth),
+    }
+
+def _save(obj, path):
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name in obj.ARRAYS:
+        np.save(path / f"{name}.npy", np.ascontiguousarray(getattr(obj, name)))
+    (path / "meta.json").write_text(json.dumps({k: getattr(obj, k) for k in obj.META}))
+
+def footprint(obj):
+    """Bytes of the arrays ``save`` writes (what a worker maps)"""
+    return int(sum(getattr(obj, name).nbytes for name in obj.ARRAYS))
+
+def _load(cls, path, mmap_mode):
+    path = Path(path)
+    arrays = {name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in cls.ARRAYS}
+    return cls(**arrays, **json.loads((path / "meta.json").read_text()))
+
+class CompiledTrees:
+    """Shared node arrays and the level-by-level walk for a tree ensemble"""
+
+    # arrays written by save(); loaded back memory-mapped so forked workers share pages
+    ARRAYS = ("feature", "threshold", "left", "right", "missing_left", "leaf_value", "cover", "roots",
+              "threshold32", "children")
+    META = ("max_depth", "n_features")
+
+    def __init__(self, feature, threshold, left, right, missing_left, leaf_value, cover,
+                 roots, max_depth, n_features, threshold32=None, children=None):
+        self.feature = feature            # global input column per node (0 for leaves)
+        self.threshold = threshold        # float64 split threshold per node
+        self.left = left                  # global child ids; leaves point at themselves
+        self.right = right
+        self.missing_left = missing_left  # NaN routing per node
+        self.leaf_value = leaf_value      # per-leaf contribution to the ensemble output
+        self.cover = cover                # training (sample-weight) mass reaching each node
+        self.roots = roots                # root node id of each tree
+        self.max_depth = max_depth
+        self.n_features = n_features
+        if threshold32 is None:
+            # x32 <= t64 holds exactly when x32 <= (largest float32 not above t64), so the
+            # walk can compare in float32 without changing a single routing decision
+            threshold32 = threshold.astype(np.float32)
+            over = threshold32.astype(np.float64) > threshold
+            threshold32[over] = np.nextafter(threshold32[over], np.float32(-np.inf))
+        self.threshold32 = threshold32
+        if children is None:
+            # children interleaved as [right, left] so a branch is children[2*node + go_left]
+            children = np.ascontiguousarray(np.stack([right, left], axis=1).ravel(), dtype=np.intp)
+        self.children = children
+        self._roots = roots.astype(np.intp)[:, None]
+        self.estimator = None             # kept for equivalence checks when available
+
+    def save(self, path):
+        _save(self, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Load a saved ensemble without sklearn; arrays are memory-mapped by default"""
+        return _load(cls, path, mmap_mode)
+
+    def apply(self, X, chunk_rows=256):
+        """Global leaf id per (tree, row), shape (n_trees, n_rows)"""
+        X = np.ascontiguousarray(X, dtype=np.float32)  # sklearn scores trees on float32
+        has_nan = bool(np.isnan(X).any())
+        if X.shape[0] <= chunk_rows:
+            return self._walk(X, has_nan)
+        out = np.empty((len(self.roots), X.shape[0]), dtype=np.intp)
+        for start in range(0, X.shape[0], chunk_rows):
+            out[:, start:start + chunk_rows] = self._walk(X[start:start + chunk_rows], has_nan)
+        return out
+
+    def _walk(self, X, has_nan):
+        n_rows = X.shape[0]
+        flat = X.ravel()
+        row_base = (np.arange(n_rows, dtype=np.intp) * X.shape[1])[None, :]
+        nodes = np.repeat(self._roots, n_rows, axis=1)
+        for _ in range(self.max_depth):
+            x = flat[row_base + self.feature[nodes]]
+            go_left = x <= self.threshold32[nodes]
+            if has_nan:
+                nan = np.isnan(x)
+                go_left = np.where(nan, self.missing_left[nodes], go_left)
+            nodes = self.children[2*nodes + go_left]
+        return nodes
+
+    def _accumulate(self, leaves, start=None):
+        # accumulate (not sum) so trees are added strictly one after another like
+        # sklearn does; np.sum may switch to pairwise summation and drift by an ulp
+        vals = self.leaf_value[leaves]
+        if start is not None:
+            vals = np.concatenate([np.full((1, vals.shape[1]), start), vals])
+        return np.add.accumulate(vals, axis=0)[-1]
+
+    def check_equivalence(self, X):
+        """Equivalence mode: score X with both engines and raise if they differ at all"""
+        if self.estimator is None:
+            raise ValueError("compiled without keep_estimator; nothing to compare against")
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        ours, theirs = self.decision_function(X), self.estimator.decision_function(X)
+        if not np.array_equal(ours, theirs):
+            diff = float(np.max(np.abs(ours - theirs)))
+            raise AssertionError(f"compiled {type(self).__name__} differs from sklearn (max |diff|={diff:g})")
+        return ours
+
+class CompiledIsolationForest(CompiledTrees):
+    """Array form of a fitted ``sklearn.ensemble.IsolationForest``.
+
+    ``decision_function`` reproduces the estimator's output bit-for-bit: leaf
+    contributions are precomputed exactly as sklearn does and accumulated tree
+    by tree in the same order.
+    """
+
+    META = CompiledTrees.META + ("denominator", "offset")
+
+    def __init__(self, *args, denominator, offset, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.denominator = denominator    # n_trees * c(max_samples)
+        self.offset = offset              # estimator.offset_
+
+    @classmethod
+    def from_estimator(cls, iso, keep_estimator=True):
+        from sklearn.ensemble._iforest import _average_path_length
+
+        # same expression as sklearn's _parallel_compute_tree_depths
+        values = [iso._decision_path_lengths[i] + iso._average_path_length_per_tree[i] - 1.0
+                  for i in range(len(iso.estimators_))]
+        engine = cls(
+            **_flatten([est.tree_ for est in iso.estimators_], iso.estimators_features_, values),
+            n_features=int(iso.n_features_in_),
+            denominator=float(len(iso.estimators_) * _average_path_length([iso._max_samples])[0]),
+            offset=float(iso.offset_),
+        )
+        if keep_estimator:
+            engine.estimator = iso
+        return engine
+
+    def score_samples(self, X):
+        depths = self._accumulate(self.apply(X))
+        if self.denominator == 0:
+            return -np.ones_like(depths)
+        return -(2 ** (-(depths / self.denominator)))
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset
+
+def _sigmoid(raw):
+    return 1.0 / (1.0 + np.exp(-raw))
+
+class CompiledGradientBoosting(CompiledTrees):
+    """Array form of a fitted binary ``GradientBoostingClassifier``.
+
+    ``decision_function`` (the raw log-odds) matches sklearn bit-for-bit: each
+    leaf stores ``learning_rate * value`` and stages are added in order onto the
+    init estimator's prior. ``predict_proba`` applies the logistic link.
+    """
+
+    META = CompiledTrees.META + ("init_raw",)
+
+    def __init__(self, *args, init_raw, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.init_raw = init_raw
+
+    @classmethod
+    def from_estimator(cls, gb, keep_estimator=True):
+        if gb.estimators_.shape[1] != 1:
+            raise ValueError("only binary GradientBoostingClassifier models can be compiled")
+        n_features = int(gb.n_features_in_)
+        trees = [est.tree_ for est in gb.estimators_[:, 0]]
+        values = [gb.learning_rate * t.value[:, 0, 0] for t in trees]
+        init_raw = float(gb._raw_predict_init(np.zeros((1, n_features), dtype=np.float32))[0, 0])
+        engine = cls(**_flatten(trees, [None] * len(trees), values),
+                     n_features=n_features, init_raw=init_raw)
+        if keep_estimator:
+            engine.estimator = gb
+        return engine
+
+    def decision_function(self, X):
+        return self._accumulate(self.apply(X), start=self.init_raw)
+
+    def predict_proba(self, X):
+        p = _sigmoid(self.decision_function(X))
+        return np.stack([1.0 - p, p], axis=1)
+
+class CompiledLinear:
+    """Array form of a binary linear classifier (SGD log-loss / logistic regression)"""
+
+    ARRAYS = ("coef",)
+    META = ("intercept", "n_features")
+
+    def __init__(self, coef, intercept, n_features):
+        self.coef = coef
+        self.intercept = intercept
+        self.n_features = n_features
+        self.estimator = None
+
+    @classmethod
+    def from_estimator(cls, clf, keep_estimator=True):
+        if clf.coef_.shape[0] != 1:
+            raise ValueError("only binary linear classifiers can be compiled")
+        engine = cls(np.ascontiguousarray(clf.coef_[0], dtype=np.float64),
+                     float(clf.intercept_[0]), int(clf.coef_.shape[1]))
+        if keep_estimator:
+            engine.estimator = clf
+        return engine
+
+    def save(self, path):
+        _save(self, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        return _load(cls, path, mmap_mode)
+
+    def decision_function(self, X):
+        # linear models see the float64 matrix (no float32 cast, unlike the trees).
+        # Features are added left to right per row instead of via BLAS, whose blocking
+        # depends on the batch size: a row scores the same alone or inside a batch.
+        terms = np.asarray(X, dtype=np.float64) * self.coef
+        return np.add.accumulate(terms, axis=1)[:, -1] + self.intercept
+
+    def predict_proba(self, X):
+        p = _sigmoid(self.decision_function(X))
+        return np.stack([1.0 - p, p], axis=1)
+
+COMPILED_TYPES = {c.__name__: c for c in (CompiledIsolationForest, CompiledGradientBoosting, CompiledLinear)}
+
+def compile_estimator(est, keep_estimator=True):
+    """Pick the array engine for a fitted sklearn estimator"""
+    kind = type(est).__name__
+    if kind == "IsolationForest":
+        return CompiledIsolationForest.from_estimator(est, keep_estimator)
+    if kind == "GradientBoostingClassifier":
+        return CompiledGradientBoosting.from_estimator(est, keep_estimator)
+    if kind in ("SGDClassifier", "LogisticRegression"):
+        return CompiledLinear.from_estimator(est, keep_estimator)
+    raise TypeError(f"no compiled engine for {kind}")
@@ -0,0 +1,109 @@
+"""Location features: impossible travel and merchant-region density.
+
+* ``travel`` -- great-circle distance and implied speed from the user's last
+  seen location (kept by the risk API's feature store), vectorized haversine.
+* ``DensityGrid`` -- transaction counts on a fixed lat/lon grid built from the
+  training history. A lookup is index arithmetic into one array, so scoring
+  a batch costs a gather, not a search. A grid built from fewer than
+  ``MIN_GRID_TRANSACTIONS`` (e.g. the synthetic bootstrap points) says
+  nothing about where real customers shop, so it rates no location unusual.
+
+``geo_risk`` folds both into the ``geo`` risk head. A row with neither signal
+(no usable grid and no previous location for the user) gets NaN: the head has
+nothing to say about it, and the row leaves geo out of its weighted mean
+rather than averaging in a zero.
+"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+PLAUSIBLE_KMH = 250.0    # ground travel; faster than this starts to look suspicious
+IMPOSSIBLE_KMH = 1000.0  # faster than an airliner
+MIN_KM = 50.0            # moves shorter than this are GPS / IP-geolocation noise
+MIN_GAP_S = 60.0         # floor on the time between two transactions
+RARITY_HALF = 0.25       # a cell at this fraction of the average density scores rarity 0.5
+RARITY_WEIGHT = 0.5      # an unusual region alone never makes the head exceed this
+MIN_GRID_TRANSACTIONS = 10_000  # below this the grid is too sparse for rarity to mean anything
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km, elementwise over arrays of degrees"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def travel(prev_lat, prev_lon, prev_seen, lat, lon, now):
+    """(km, km/h) from the previous location; 0 where there is none (``prev_seen`` NaN)"""
+    prev_seen = np.asarray(prev_seen, dtype=np.float64)
+    known = ~np.isnan(prev_seen)
+    # unknown rows "travel" from where they are: distance 0
+    km = haversine_km(np.where(known, prev_lat, lat), np.where(known, prev_lon, lon), lat, lon)
+    hours = np.maximum(np.where(known, np.asarray(now) - prev_seen, 0.0), MIN_GAP_S) / 3600
+    kmh = np.where(km >= MIN_KM, km / hours, 0.0)
+    return km, kmh
+
+class DensityGrid:
+    """Transaction counts per ``cell_deg`` x ``cell_deg`` cell, with neighbour smoothing"""
+
+    def __init__(self, cell_deg=1.0, counts=None):
+        self.cell_deg = float(cell_deg)
+        self.shape = (int(round(180 / self.cell_deg)), int(round(360 / self.cell_deg)))
+        self.counts = np.zeros(self.shape, dtype=np.float32) if counts is None else np.asarray(counts)
+        self._smooth = None
+
+    @property
+    def total(self):
+        return float(self.counts.sum())
+
+    @property
+    def usable(self):
+        return self.total >= MIN_GRID_TRANSACTIONS
+
+    def _cells(self, lat, lon):
+        r = np.clip(((np.asarray(lat, dtype=np.float64) + 90) // self.cell_deg).astype(np.intp), 0, self.shape[0] - 1)
+        c = ((np.asarray(lon, dtype=np.float64) + 180) // self.cell_deg).astype(np.intp) % self.shape[1]
+        return r * self.shape[1] + c
+
+    def add(self, lat, lon):
+        np.add.at(self.counts.reshape(-1), self._cells(lat, lon), 1.0)
+        self._smooth = None
+        return self
+
+    def _smoothed(self):
+        if self._smooth is None:
+            # 3x3 box sum (longitude wraps around) so a cell next to busy ones isn't "empty"
+            padded = np.pad(self.counts, ((1, 1), (0, 0)))
+            box = sum(np.roll(padded, s, axis=1) for s in (-1, 0, 1))
+            box = box[:-2] + box[1:-1] + box[2:]
+            occupied = box[box > 0]
+            if len(occupied) and self.usable:  # relative to the average occupied cell
+                self._smooth = (box / occupied.mean()).reshape(-1)
+            else:  # nothing (meaningful) to compare against: no location is unusual
+                self._smooth = np.full(box.size, np.inf)
+        return self._smooth
+
+    def rarity(self, lat, lon):
+        """0 (as busy as a typical cell or busier) .. 1 (never seen a transaction near here)"""
+        return 1.0 / (1.0 + self._smoothed()[self._cells(lat, lon)] / RARITY_HALF)
+
+    def save(self, path):
+        np.savez(path, cell_deg=self.cell_deg, counts=self.counts)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls(float(z["cell_deg"]), z["counts"])
+
+def geo_risk(cols, grid=None):
+    """The ``geo`` head for a ``to_columns`` batch (plus optional ``travel_kmh`` / ``travel_known`` from the
+    feature store); NaN on rows with no signal"""
+    n = len(cols["geo_lat"])
+    kmh = cols.get("travel_kmh")
+    speed = np.zeros(n) if kmh is None else np.clip((np.asarray(kmh) - PLAUSIBLE_KMH)
+                                                    / (IMPOSSIBLE_KMH - PLAUSIBLE_KMH), 0, 1)
+    rarity = np.zeros(n) if grid is None else grid.rarity(cols["geo_lat"], cols["geo_lon"])
+    if grid is not None and grid.usable:
+        signal = np.ones(n, dtype=bool)
+    elif kmh is None:
+        signal = np.zeros(n, dtype=bool)
+    else:  # travel speeds without travel_known are taken as measured
+        signal = np.asarray(cols.get("travel_known", np.ones(n, dtype=bool)), dtype=bool)
+    return np.where(signal, 1 - (1 - speed) * (1 - RARITY_WEIGHT * rarity), np.nan)
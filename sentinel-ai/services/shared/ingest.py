@@ -0,0 +1,193 @@
+"""Typed columnar cache for CSV sources (the Kaggle transaction dumps).
+
+``ingest(source)`` streams a CSV in chunks and writes one ``.npy`` per column
+under ``data/cache/<name>-<checksum>-f<FORMAT>/``:
+
+* numbers keep their parsed dtype (floats parsed exactly, not with pandas'
+  faster approximate parser); integer columns are narrowed to the smallest
+  type that holds them
+* currency text such as ``$29278`` or ``$-77.00`` becomes float64, parsed per
+  chunk with vectorized string ops
+* other text is dictionary-encoded: ``int32`` codes (-1 = missing) plus the
+  distinct values
+
+Dictionary codes and narrow integers do the compression, so every file can
+still be memory-mapped. Each chunk is spilled to disk as it is parsed, and the
+final arrays are filled from those spills: memory stays at one chunk however
+large the source.
+
+The directory name carries the source's SHA-256 and the cache format. A
+changed file is ingested again, an unchanged copy elsewhere reuses the cache,
+and a cache written by an older format is never read (nor collided with). ``meta.json`` also
+records the file's size and mtime, so a repeat load of an unchanged source
+skips rehashing. ``load_columns`` memory-maps the arrays; ``load_frame`` wraps
+them in a DataFrame (text as categoricals).
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+CACHE_ROOT = Path("data/cache")
+CHUNK_ROWS = 100_000
+FORMAT = 2   # bump when the cache layout or parsing changes
+_CURRENCY = r"^\s*-?\$\s*-?[\d,]*\.?\d*\s*$"
+
+def checksum(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def parse_currency(values):
+    """``$1,234.50`` / ``$-77.00`` / ``-$5`` -> float64, NaN where empty or unparsable"""
+    import pandas as pd
+    s = pd.Series(values, dtype=object).astype("string")
+    cleaned = s.str.replace("$", "", regex=False).str.replace(",", "", regex=False).str.replace(" ", "", regex=False)
+    return pd.to_numeric(cleaned, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+
+def _kind(col):
+    from pandas.api.types import is_bool_dtype, is_numeric_dtype
+    if is_numeric_dtype(col) or is_bool_dtype(col):
+        return "number"
+    sample = col.dropna().head(1000).astype(str)
+    if len(sample) and sample.str.match(_CURRENCY).all():
+        return "currency"
+    return "text"
+
+def _narrow(lo, hi):
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+class _Column:
+    """One column's chunk spills and running type information"""
+
+    def __init__(self, index, name, kind, scratch):
+        self.name = name
+        self.kind = kind
+        self.file = f"{index:03d}-{re.sub(r'[^A-Za-z0-9_.-]', '_', str(name))}"
+        self.scratch = scratch
+        self.spills = []
+        self.dtypes = set()
+        self.lo, self.hi = 0, 0
+        self.vocab = {}             # text: value -> code
+
+    def add(self, col):
+        import pandas as pd
+        if self.kind == "text":
+            codes, uniques = pd.factorize(col)
+            # chunk codes -> global codes; the trailing -1 keeps missing values (code -1) missing
+            remap = np.array([self.vocab.setdefault(str(u), len(self.vocab)) for u in uniques] + [-1], dtype=np.int32)
+            values = remap[codes]
+        elif self.kind == "currency" and col.dtype == object:
+            values = parse_currency(col)
+        elif col.dtype == object:   # stray text in a numeric column
+            values = pd.to_numeric(col, errors="coerce").to_numpy(dtype=np.float64)
+        else:
+            values = col.to_numpy()
+        if values.dtype.kind in "iu" and len(values):
+            self.lo, self.hi = min(self.lo, int(values.min())), max(self.hi, int(values.max()))
+        self.dtypes.add(values.dtype)
+        path = self.scratch / f"{self.file}.{len(self.spills)}.npy"
+        np.save(path, values)
+        self.spills.append(path)
+
+    def dtype(self):
+        if self.kind == "text":
+            return np.dtype(np.int32)
+        dtype = np.result_type(*self.dtypes) if self.dtypes else np.dtype(np.float64)
+        return _narrow(self.lo, self.hi) if dtype.kind in "iu" else dtype
+
+    def finish(self, out, rows):
+        dtype = self.dtype()
+        arr = np.lib.format.open_memmap(out / f"{self.file}.npy", mode="w+", dtype=dtype, shape=(rows,))
+        pos = 0
+        for path in self.spills:
+            part = np.load(path)
+            arr[pos:pos + len(part)] = part
+            pos += len(part)
+            path.unlink()
+        arr.flush()
+        del arr
+        if self.kind == "text":
+            values = np.array(list(self.vocab), dtype=str) if self.vocab else np.zeros(0, dtype="<U1")
+            np.save(out / f"{self.file}.values.npy", values)
+        return {"name": self.name, "kind": self.kind, "file": self.file, "dtype": dtype.str}
+
+def _stat(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def find(source, cache_root=CACHE_ROOT):
+    """Cache directory of an unchanged ``source`` (size + mtime match), or None"""
+    source = Path(source).resolve()
+    stat = _stat(source)
+    for meta_path in Path(cache_root).glob(f"{source.stem}-*/meta.json"):
+        meta = json.loads(meta_path.read_text())
+        if meta.get("format") == FORMAT and meta.get("source") == str(source) and meta.get("stat") == stat:
+            return meta_path.parent
+    return None
+
+def ingest(source, cache_root=CACHE_ROOT, chunk_rows=CHUNK_ROWS):
+    """Cache directory for ``source``, writing it first unless an identical file was ingested"""
+    import pandas as pd
+    cached = find(source, cache_root)
+    if cached is not None:
+        return cached
+    source = Path(source).resolve()
+    digest = checksum(source)
+    out = Path(cache_root) / f"{source.stem}-{digest[:16]}-f{FORMAT}"
+    meta_path = out / "meta.json"
+    if meta_path.exists() and json.loads(meta_path.read_text()).get("format") == FORMAT:
+        # same bytes under another path or mtime: remember this one for the fast lookup
+        meta = json.loads(meta_path.read_text()) | {"source": str(source), "stat": _stat(source)}
+        meta_path.write_text(json.dumps(meta, indent=2))
+        return out
+
+    tmp = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    (tmp / "spill").mkdir(parents=True)
+    columns, rows = None, 0
+    # round_trip: floats parse to exactly the value their text denotes, as json.loads would give /score
+    for chunk in pd.read_csv(source, chunksize=chunk_rows, low_memory=False, float_precision="round_trip"):
+        if columns is None:  # the first chunk decides which text columns hold currency
+            columns = [_Column(i, name, _kind(chunk[name]), tmp / "spill") for i, name in enumerate(chunk.columns)]
+        for c in columns:
+            c.add(chunk[c.name])
+        rows += len(chunk)
+    meta = {"format": FORMAT, "source": str(source), "sha256": digest, "stat": _stat(source), "rows": rows,
+            "columns": [c.finish(tmp, rows) for c in columns or []]}
+    (tmp / "spill").rmdir()
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+    try:
+        os.rename(tmp, out)
+    except OSError:  # another process cached the same bytes first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return out
+
+def load_columns(cache_dir, mmap_mode="r"):
+    """name -> memory-mapped array; text columns as ``pandas.Categorical`` over their codes"""
+    import pandas as pd
+    cache_dir = Path(cache_dir)
+    meta = json.loads((cache_dir / "meta.json").read_text())
+    cols = {}
+    for c in meta["columns"]:
+        arr = np.load(cache_dir / f"{c['file']}.npy", mmap_mode=mmap_mode)
+        if c["kind"] == "text":
+            values = np.load(cache_dir / f"{c['file']}.values.npy")
+            arr = pd.Categorical.from_codes(arr, categories=pd.Index(values, dtype=object), validate=False)
+        cols[c["name"]] = arr
+    return cols
+
+def load_frame(source, cache_root=CACHE_ROOT, chunk_rows=CHUNK_ROWS):
+    """``source`` as a typed DataFrame, ingesting it on first use"""
+    import pandas as pd
+    return pd.DataFrame(load_columns(ingest(source, cache_root, chunk_rows)), copy=False)
@@ -0,0 +1,146 @@
+"""Constant-memory latency histograms for hot paths.
+
+``LatencyHistogram`` is HDR-style: durations in nanoseconds go into log-linear
+buckets (32 sub-buckets per power of two, so any reported percentile is within
+~3% of the true value) covering every 64-bit duration in a fixed 1920-slot
+table. Recording is an integer bit-length, a shift and a list increment on a
+per-thread table: no locks and no allocation, a few hundred nanoseconds in
+CPython. Reads merge the thread tables.
+
+``LatencyRecorder`` keeps one histogram per named stage and renders percentiles
+as JSON or in the Prometheus text format. ``time_calls`` is the offline
+counterpart: percentiles of a function timed in a tight loop.
+"""
+import threading
+import time
+
+import numpy as np
+
+SUB_BITS = 5
+SUB = 1 << SUB_BITS          # sub-buckets per power of two
+N_BUCKETS = (64 - SUB_BITS + 1) * SUB
+QUANTILES = (0.5, 0.95, 0.99)
+
+def bucket(ns):
+    """Bucket of a non-negative duration: exact below 64 ns, then 32 per power of two"""
+    shift = ns.bit_length() - SUB_BITS - 1
+    return (shift << SUB_BITS) + (ns >> shift) if shift > 0 else ns
+
+def bucket_value(i):
+    """Midpoint (ns) of the values that land in bucket ``i``"""
+    if i < 2 * SUB:
+        return float(i)
+    shift = i // SUB - 1
+    return ((i - shift * SUB) << shift) + ((1 << shift) - 1) / 2
+
+class LatencyHistogram:
+    def __init__(self):
+        self._local = threading.local()
+        self._tables = []          # one [counts, total_ns, max_ns] per recording thread
+        self._lock = threading.Lock()   # only taken when a thread records for the first time
+
+    def _table(self):
+        table = [[0] * N_BUCKETS, [0, 0]]
+        with self._lock:
+            self._tables.append(table)
+        self._local.table = table
+        return table
+
+    def record(self, ns):
+        """Add one duration in nanoseconds"""
+        try:
+            counts, totals = self._local.table
+        except AttributeError:
+            counts, totals = self._table()
+        shift = ns.bit_length() - SUB_BITS - 1   # bucket(), inlined: this is the hot path
+        counts[(shift << SUB_BITS) + (ns >> shift) if shift > 0 else ns] += 1
+        totals[0] += ns
+        if ns > totals[1]:
+            totals[1] = ns
+
+    def merged(self):
+        counts, total, peak = [0] * N_BUCKETS, 0, 0
+        with self._lock:
+            tables = list(self._tables)
+        for c, (t, m) in tables:
+            counts = [a + b for a, b in zip(counts, c)]
+            total += t
+            peak = max(peak, m)
+        return counts, total, peak
+
+    def summary(self, quantiles=QUANTILES):
+        """count, mean/max and the requested quantiles, in milliseconds"""
+        counts, total, peak = self.merged()
+        n = sum(counts)
+        out = {"count": n, "mean_ms": total / n / 1e6 if n else 0.0, "max_ms": peak / 1e6}
+        targets = sorted(quantiles)
+        seen, q = 0, 0
+        for i, c in enumerate(counts):
+            if not c:
+                continue
+            seen += c
+            while q < len(targets) and seen >= targets[q] * n:
+                out[f"p{targets[q] * 100:g}_ms"] = min(bucket_value(i), peak) / 1e6
+                q += 1
+        for t in targets[q:]:
+            out[f"p{t * 100:g}_ms"] = 0.0
+        return out
+
+    def reset(self):
+        with self._lock:
+            for counts, totals in self._tables:
+                counts[:] = [0] * N_BUCKETS
+                totals[:] = [0, 0]
+
+class LatencyRecorder:
+    """Named stage histograms; ``record(stage, start_ns)`` stores now - start"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, stage):
+        h = self.stages.get(stage)
+        if h is None:
+            with self._lock:
+                h = self.stages.setdefault(stage, LatencyHistogram())
+        return h
+
+    def record(self, stage, start_ns, end_ns=None):
+        if self.enabled:
+            self.histogram(stage).record((time.perf_counter_ns() if end_ns is None else end_ns) - start_ns)
+
+    def summary(self):
+        return {stage: h.summary() for stage, h in sorted(self.stages.items())}
+
+    def prometheus(self, name="sentinel_stage_latency_seconds"):
+        """Prometheus text exposition: one summary per stage"""
+        lines = [f"# HELP {name} Time spent per scoring stage.", f"# TYPE {name} summary"]
+        for stage, h in sorted(self.stages.items()):
+            total = h.merged()[1]
+            s = h.summary()
+            for q in QUANTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q:g}"}} {s[f"p{q * 100:g}_ms"] / 1e3:.9f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total / 1e9:.9f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {s["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for h in list(self.stages.values()):
+            h.reset()
+
+def time_calls(fn, args, calls=1000, repeats=3):
+    """p50 / p99 µs of ``fn(arg)`` cycling over ``args``; each the lowest of ``repeats`` runs (noise only
+    adds time)"""
+    for arg in args[:20]:
+        fn(arg)
+    ns = np.empty((repeats, calls), dtype=np.int64)
+    for r in range(repeats):
+        for i in range(calls):
+            arg = args[i % len(args)]
+            start = time.perf_counter_ns()
+            fn(arg)
+            ns[r, i] = time.perf_counter_ns() - start
+    return {"p50_us": float(np.percentile(ns, 50, axis=1).min()) / 1e3,
+            "p99_us": float(np.percentile(ns, 99, axis=1).min()) / 1e3}
@@ -0,0 +1,193 @@
+"""Column-wise mapping of external datasets (the Kaggle dumps) onto ``Transaction``.
+
+A ``TransactionMapper`` resolves, once per set of source columns, which column
+feeds each schema field: the first alias present in ``ALIASES``, else a
+default. Mapping a DataFrame is then a handful of column casts, never a loop
+over rows.
+
+Numeric fields held as text are parsed like the columnar cache parses them
+(``ingest.parse_currency``: ``$-77.00`` is -77.0). Missing values take the
+default, but a value that does not parse raises ``ValueError`` rather than
+being scored as the default.
+
+Fields the source does not have (or rows where an id is missing) are made up
+deterministically. Every row gets
+a 64-bit content hash (``pandas.util.hash_pandas_object``: fixed-key SipHash,
+so unlike ``hash()`` it is the same in every process), from which the
+transaction id and the user / device buckets are derived. Numbers are hashed
+as float64 and everything else as text, so a row hashes the same whether it
+is mapped with its frame or on its own (``demo.convert_kaggle_to_transaction``
+over ``iterrows``). Rows with the same content map to the same transaction.
+
+The derived velocity fields are either filled with fixed stand-ins
+(``fill_derived=True``, what the demo sends) or left as None so the risk API's
+feature store derives them while a replay streams through it.
+"""
+import numpy as np
+
+from services.shared.schemas import Transaction
+
+# schema field -> source columns tried in order
+ALIASES = {
+    "txn_id": ["txn_id", "transaction_id", "id"],
+    "amount": ["amount", "Amount", "transaction_amount"],
+    "merchant_category": ["merchant_category", "merchant", "category"],
+    "device_id": ["device_id", "device", "card_id"],
+    "geo_lat": ["geo_lat", "lat", "latitude"],
+    "geo_lon": ["geo_lon", "lon", "longitude"],
+    "user_id": ["user_id", "user", "client_id"],
+    "is_new_device": ["is_new_device", "new_device"],
+    "hour_of_day": ["hour_of_day", "hour"],
+    "past_24h_txn_count": ["past_24h_txn_count", "txn_count"],
+    "past_7d_chargebacks": ["past_7d_chargebacks", "chargebacks"],
+    "velocity_usd_7d": ["velocity_usd_7d", "velocity"],
+    "ip_asn_risk": ["ip_asn_risk", "ip_risk"],
+}
+TIMESTAMPS = ["date", "timestamp", "datetime"]   # hour_of_day is read from these when there is no hour column
+DEFAULTS = {
+    "amount": 100.0, "merchant_category": "grocery", "geo_lat": 37.7749, "geo_lon": -122.4194,
+    "hour_of_day": 12, "ip_asn_risk": 0.1,
+}
+# stand-ins for the feature-store fields when fill_derived is set (velocity defaults to 2 x amount)
+DERIVED_DEFAULTS = {"is_new_device": False, "past_24h_txn_count": 1, "past_7d_chargebacks": 0}
+USER_BUCKETS = 1000
+DEVICE_BUCKETS = 1000
+
+_FLOATS = {"amount", "geo_lat", "geo_lon", "velocity_usd_7d", "ip_asn_risk"}
+_INTS = {"hour_of_day", "past_24h_txn_count", "past_7d_chargebacks"}
+
+def _numbers(field, src, col):
+    """float64 values of a source column; NaN only where the source is missing"""
+    import pandas as pd
+    from pandas.api.types import is_bool_dtype, is_numeric_dtype
+    from services.shared.ingest import parse_currency
+    if is_numeric_dtype(col) or is_bool_dtype(col):
+        return col.to_numpy(dtype=np.float64, na_value=np.nan)
+    values = parse_currency(col) if field in _FLOATS else \
+        pd.to_numeric(col, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    text = col.astype("string").str.strip()
+    bad = np.isnan(values) & (text.notna() & (text != "")).to_numpy(dtype=bool)
+    if bad.any():
+        raise ValueError(f"{src!r} ({field}): {int(bad.sum())} values are not numbers, "
+                         f"e.g. {col[bad].head(3).tolist()}")
+    return values
+
+def _text(col):
+    """Source column as str objects (whole-number floats without the '.0'); None where missing"""
+    from pandas.api.types import is_float_dtype
+    if is_float_dtype(col) and (col.dropna() % 1 == 0).all():
+        col = col.astype("Int64")
+    return np.where(col.isna().to_numpy(), None, col.astype(str).to_numpy(dtype=object))
+
+def row_hashes(df):
+    """Deterministic uint64 content hash per row (numbers as float64, anything else as text)"""
+    import pandas as pd
+    from pandas.api.types import is_bool_dtype, is_numeric_dtype
+    canon = {}
+    for name in df.columns:
+        col = df[name]
+        if is_numeric_dtype(col) or is_bool_dtype(col):
+            canon[name] = col.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            canon[name] = col.astype(str).to_numpy(dtype=object)
+    frame = pd.DataFrame(canon, columns=list(df.columns))
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+class TransactionMapper:
+    def __init__(self, fill_derived=True, aliases=None, defaults=None):
+        self.fill_derived = fill_derived
+        self.aliases = aliases or ALIASES
+        self.defaults = {**DEFAULTS, **(defaults or {})}
+        self._plans = {}
+
+    def plan(self, columns):
+        """field -> source column (or None), resolved once per column set"""
+        key = tuple(columns)
+        plan = self._plans.get(key)
+        if plan is None:
+            present = set(columns)
+            plan = {field: next((c for c in names if c in present), None) for field, names in self.aliases.items()}
+            if plan["hour_of_day"] is None:
+                plan["hour_of_day@"] = next((c for c in TIMESTAMPS if c in present), None)
+            self._plans[key] = plan
+        return plan
+
+    def columns(self, df):
+        """Schema-typed numpy columns for every ``Transaction`` field (None where left to the feature store)"""
+        import pandas as pd
+        plan = self.plan(df.columns)
+        n = len(df)
+        out = {}
+        h = None
+        for field in Transaction.model_fields:
+            src = plan.get(field)
+            col = df[src] if src is not None else None
+            if field in _FLOATS or field in _INTS:
+                default = self.defaults.get(field)
+                if col is None and field == "hour_of_day" and plan.get("hour_of_day@") is not None:
+                    col = pd.to_datetime(df[plan["hour_of_day@"]], errors="coerce").dt.hour
+                if col is None:
+                    values = None if default is None else np.full(n, default, dtype=np.float64)
+                else:
+                    values = _numbers(field, src, col) if src is not None else \
+                        pd.to_numeric(col, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+                    if default is not None:
+                        values = np.where(np.isnan(values), default, values)
+                if values is not None and field in _INTS:
+                    values = values.astype(np.int64)
+                out[field] = values
+            elif field == "is_new_device":
+                out[field] = None if col is None else np.where(col.isna(), False, col.to_numpy(dtype=object)).astype(bool)
+            else:
+                if col is not None and field != "merchant_category":
+                    values = _text(col)
+                    missing = np.equal(values, None)
+                    if missing.any():   # rows without an id get a made-up one
+                        if h is None:
+                            h = row_hashes(df)
+                        values[missing] = self._made_up(field, h[missing])
+                    out[field] = values
+                elif col is not None:
+                    out[field] = np.char.lower(col.astype(str).to_numpy(dtype=object).astype(str)).astype(object)
+                elif field == "merchant_category":
+                    out[field] = np.full(n, self.defaults["merchant_category"], dtype=object)
+                else:
+                    if h is None:
+                        h = row_hashes(df)
+                    out[field] = self._made_up(field, h)
+        if self.fill_derived:
+            for field, value in DERIVED_DEFAULTS.items():
+                if out[field] is None:
+                    out[field] = np.full(n, value, dtype=bool if field == "is_new_device" else np.int64)
+            if out["velocity_usd_7d"] is None:
+                out["velocity_usd_7d"] = out["amount"] * 2
+        return out
+
+    @staticmethod
+    def _made_up(field, h):
+        if field == "txn_id":
+            return np.char.add("kaggle_", h.astype(str)).astype(object)
+        if field == "user_id":
+            return np.char.add("U", (h % USER_BUCKETS).astype(str)).astype(object)
+        return np.char.add("D", ((h >> np.uint64(32)) % DEVICE_BUCKETS).astype(str)).astype(object)
+
+    def records(self, df):
+        """One ``Transaction`` field dict per row"""
+        cols = self.columns(df)
+        names = list(cols)
+        lists = [cols[f].tolist() if cols[f] is not None else [None] * len(df) for f in names]
+        return [dict(zip(names, row)) for row in zip(*lists)]
+
+    def transactions(self, df, batch_size=None):
+        """``Transaction`` models (already typed, so built without re-validation); lists of ``batch_size``
+        when given"""
+        txns = [Transaction.model_construct(**r) for r in self.records(df)]
+        if batch_size is None:
+            return txns
+        return [txns[i:i + batch_size] for i in range(0, len(txns), batch_size)]
+
+def iter_transactions(frame, batch_size=10_000, mapper=None):
+    """Stream ``Transaction`` batches from a large frame, mapping ``batch_size`` rows at a time"""
+    mapper = mapper or TransactionMapper()
+    for start in range(0, len(frame), batch_size):
+        yield mapper.transactions(frame.iloc[start:start + batch_size])
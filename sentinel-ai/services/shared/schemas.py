@@ -9,11 +9,12 @@ class Transaction(BaseModel):
     geo_lat: float
     geo_lon: float
     user_id: str
-    is_new_device: bool = False
+    # left out (None), these four are derived by the risk API's feature store
+    is_new_device: Optional[bool] = None
     hour_of_day: int
-    past_24h_txn_count: int
-    past_7d_chargebacks: int
-    velocity_usd_7d: float
+    past_24h_txn_count: Optional[int] = None
+    past_7d_chargebacks: Optional[int] = None
+    velocity_usd_7d: Optional[float] = None
     ip_asn_risk: float = 0.0
 
 class RiskResponse(BaseModel):
@@ -21,3 +22,4 @@ class RiskResponse(BaseModel):
     risk_score: float              # optional scalar summary (0..1)
     decision: str                  # "APPROVE" | "STEP_UP" | "REVIEW"
     reasons: Dict[str, float]      # top features (for trust/explain)
+    model_version: Optional[str] = None  # registry version that produced this score
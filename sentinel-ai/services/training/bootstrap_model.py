@@ -1,9 +1,26 @@
+import argparse
 import joblib, numpy as np, pandas as pd
+from pathlib import Path
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
-import sys; import os; sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))); from shared.features import CATEGORICALS, NUMERICS, BINARIES
+from services.shared.features import CATEGORICALS, NUMERICS, BINARIES
+from services.shared.geo import DensityGrid
+from services.training.sampling import Reservoir
+
+# fixed input dtypes for streamed histories: nothing is inferred per chunk, so a chunk
+# costs the same bytes wherever it comes from in the file
+DTYPES = {**{c: object for c in CATEGORICALS}, **{f: np.float64 for f in NUMERICS}, **{b: bool for b in BINARIES}}
+CHUNK_ROWS = 100_000
+GEO_FILE = "geo_density.joblib"   # location density grid for the geo head, next to the anomaly model
+
+def _pipeline(iso, categories="auto"):
+    pre = ColumnTransformer([
+        ("cat", OneHotEncoder(categories=categories, handle_unknown="ignore"), CATEGORICALS),
+        ("num", "passthrough", NUMERICS+BINARIES)
+    ])
+    return Pipeline([("pre", pre), ("iso", iso)])
 
 def bootstrap():
     # synth data to start (replace with real/simulated)
@@ -24,15 +41,61 @@ def bootstrap():
     })
 
     # pipeline
-    pre = ColumnTransformer([
-        ("cat", OneHotEncoder(handle_unknown="ignore"), CATEGORICALS),
-        ("num", "passthrough", NUMERICS+BINARIES)
-    ])
     iso = IsolationForest(n_estimators=100, random_state=0, contamination=0.04)
-    pipe = Pipeline([("pre", pre), ("iso", iso)])
+    pipe = _pipeline(iso)
     pipe.fit(df.drop(columns=["label"]))
 
     joblib.dump(pipe, "models/anomaly_iforest.joblib")
+    joblib.dump(DensityGrid().add(df["geo_lat"], df["geo_lon"]), f"models/{GEO_FILE}")
+
+def iter_chunks(paths, chunk_rows=CHUNK_ROWS):
+    """Stream the model's input columns from CSV / Parquet files as fixed-dtype DataFrames"""
+    columns = list(DTYPES)
+    for path in map(Path, paths):
+        if path.suffix == ".parquet":
+            import pyarrow.parquet as pq  # optional; only needed for Parquet inputs
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+                yield batch.to_pandas().astype(DTYPES)
+        else:
+            yield from pd.read_csv(path, usecols=columns, dtype=DTYPES, chunksize=chunk_rows)
+
+def bootstrap_stream(paths, out="models/anomaly_iforest.joblib", n_estimators=100, max_samples=256,
+                     contamination=0.04, chunk_rows=CHUNK_ROWS, random_state=0):
+    """Fit the anomaly pipeline over histories too large for memory, in one streaming pass.
+
+    The pass collects the one-hot vocabulary and a uniform reservoir of
+    ``n_estimators * max_samples`` rows; the forest is then fit on the
+    reservoir with the usual ``max_samples`` draw per tree. Memory depends on
+    ``chunk_rows`` and the reservoir size, not on the number of input rows.
+    Every row also lands in the geo head's ``DensityGrid``, saved next to ``out``.
+    """
+    res = Reservoir(n_estimators * max_samples, seed=random_state)
+    categories = {c: set() for c in CATEGORICALS}
+    grid = DensityGrid()
+    for chunk in iter_chunks(paths, chunk_rows):
+        for c in CATEGORICALS:
+            categories[c].update(chunk[c].dropna().unique())
+        grid.add(chunk["geo_lat"].to_numpy(), chunk["geo_lon"].to_numpy())
+        res.add(chunk)
+    if res.seen == 0:
+        raise ValueError(f"no rows in {list(map(str, paths))}")
+    sample = res.frame(DTYPES).astype(DTYPES)
+    iso = IsolationForest(n_estimators=n_estimators, max_samples=min(max_samples, len(sample)),
+                          random_state=random_state, contamination=contamination)
+    pipe = _pipeline(iso, [sorted(categories[c]) for c in CATEGORICALS])
+    pipe.fit(sample)
+    if out is not None:
+        joblib.dump(pipe, out)
+        joblib.dump(grid, Path(out).with_name(GEO_FILE))
+    print(f"Fit IsolationForest on a {len(sample)}-row sample of {res.seen} rows")
+    return pipe
 
 if __name__ == "__main__":
-    bootstrap()
+    ap = argparse.ArgumentParser(description="Fit the anomaly model")
+    ap.add_argument("data", nargs="*", help="CSV/Parquet transaction histories (default: synthetic data)")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = ap.parse_args()
+    if args.data:
+        bootstrap_stream(args.data, chunk_rows=args.chunk_rows)
+    else:
+        bootstrap()
@@ -0,0 +1,218 @@
+"""Fit trained models to a serving latency and memory budget.
+
+``python -m services.training.budget --p99-us 250`` runs after bootstrap and
+retrain. It loads the models from ``models/``, compiles them into the engine
+the API serves (``services.risk_api.engine``) and times single-row calls over
+reference transactions. It also sums the compiled arrays' bytes, the memory a
+worker maps.
+
+When the p99 or the footprint is over budget, the costliest tree head is
+pruned: boosting keeps its first stages and the isolation forest keeps a
+subset of its trees. Either way the result is a smaller model of the same kind,
+not an approximation of one. Pruning repeats until the budget holds.
+Stopping at ``MIN_TREES`` or moving a head's risk by more than ``--max-drift``
+on the reference rows fails the compile and writes nothing, unless
+``--force``. Depth caps and distillation would need the training data, so
+they belong in the training jobs; ``services.training.search`` already trades
+depth for latency.
+
+The output is a separate models directory (``<models>-budgeted`` by default,
+so the deployed artifacts stay as they are until the result is checked) with
+the pruned pipelines, the other model configs and ``budget.json``. Rewriting
+``models/`` itself takes ``--in-place``. That file holds the budget, the measured
+latency and footprint per head and for the whole call, and the SHA-256 of
+every model file it describes. The registry reads it as part of the model
+version and checks it at load (see ``ModelBundle.check_budget``). A model
+retrained after the compile no longer matches its recorded hash.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+from services.shared.features import to_columns
+from services.shared.forest import footprint
+from services.shared.latency import time_calls
+from services.risk_api.engine import HEAD_MODELS, RiskEngine
+from services.risk_api.registry import CONFIG_FILES, MODEL_FILES, file_sha256
+
+BUDGET_FILE = CONFIG_FILES["budget"]
+P99_US = 250.0              # single-transaction model time, all heads
+MAX_BYTES = 4 << 20         # compiled arrays, all heads
+MAX_DRIFT = 0.02            # mean |risk change| a pruned head may show on the reference rows
+MIN_TREES = 10
+SHRINK = 0.75               # trees kept per pruning step
+CALLS = 1000                # single-row calls timed per measurement
+REPEATS = 3                 # measurements per figure; the lowest is kept (noise only adds time)
+REFERENCE_ROWS = 512
+
+def n_trees(est):
+    return len(est.estimators_) if hasattr(est, "estimators_") else None
+
+def truncate(est, k):
+    """A copy of a fitted GradientBoosting / IsolationForest keeping its first ``k`` trees"""
+    out = copy.copy(est)
+    kind = type(est).__name__
+    if kind == "GradientBoostingClassifier":
+        out.estimators_ = est.estimators_[:k]
+        out.train_score_ = est.train_score_[:k]
+        for attr in ("oob_improvement_", "oob_scores_"):
+            if hasattr(est, attr):
+                setattr(out, attr, getattr(est, attr)[:k])
+        out.n_estimators_ = k
+    elif kind == "IsolationForest":
+        # trees are i.i.d., so the first k are a random subset; offset_ keeps the training cut
+        for attr in ("estimators_", "estimators_features_", "_seeds", "_decision_path_lengths",
+                     "_average_path_length_per_tree"):
+            setattr(out, attr, getattr(est, attr)[:k])
+    else:
+        raise ValueError(f"cannot prune {kind}")
+    out.n_estimators = k
+    return out
+
+def reference_rows(n=REFERENCE_ROWS, seed=2024):
+    """Synthetic transactions in the model input layout (the federation simulator's bank data)"""
+    from services.federation.fed_sim import synth_client
+    return to_columns(synth_client(seed, n=n)[0].to_dict("records"))
+
+def measure(engine, X, calls=CALLS):
+    """Whole-call and per-head single-row latency plus footprint of a ``RiskEngine``"""
+    rows = [X[i:i + 1] for i in range(len(X))]
+    heads = {}
+    for name, head in engine.heads.items():
+        heads[name] = time_calls(lambda r, h=head: h.risk(r, r.astype(np.float32)), rows, calls, REPEATS)
+        heads[name]["bytes"] = footprint(head.model)
+    call = time_calls(lambda r: engine.evaluate(None, r), rows, calls, REPEATS)
+    return {**call, "bytes": sum(h["bytes"] for h in heads.values()), "heads": heads}
+
+def _pipeline_with(pipe, est):
+    out = copy.copy(pipe)
+    out.steps = pipe.steps[:-1] + [(pipe.steps[-1][0], est)]
+    return out
+
+def fit_budget(models, p99_us=P99_US, max_bytes=MAX_BYTES, reference=None, calls=CALLS, verbose=True):
+    """Prune ``models`` (role -> fitted pipeline) until the engine fits the budget.
+
+    Returns (models, measurement, per-head notes, problems); ``problems`` is empty when the budget
+    holds within ``MIN_TREES``.
+    """
+    cols = reference if reference is not None else reference_rows()
+    models = dict(models)
+    engine = RiskEngine.from_models(models)
+    X = engine.encoder.encode_columns(cols)   # pruning never changes the vocabulary
+    before = {role: n_trees(pipe.steps[-1][1]) for role, pipe in models.items() if hasattr(pipe, "steps")}
+    while True:
+        stats = measure(engine, X, calls)
+        if verbose:
+            print(f"p99 {stats['p99_us']:.0f}µs, {stats['bytes'] / 2**10:.0f} KiB, trees "
+                  f"{ {r: n_trees(p.steps[-1][1]) for r, p in models.items() if hasattr(p, 'steps')} }")
+        over_time, over_size = stats["p99_us"] > p99_us, stats["bytes"] > max_bytes
+        if not (over_time or over_size):
+            return models, stats, before, []
+        key = "p99_us" if over_time else "bytes"
+        prunable = [(stats["heads"][head][key], head) for head, role in HEAD_MODELS.items()
+                    if head in stats["heads"] and (n_trees(models[role].steps[-1][1]) or 0) > MIN_TREES]
+        if not prunable:
+            what = f"p99 {stats['p99_us']:.0f}µs > {p99_us:.0f}µs" if over_time else \
+                f"{stats['bytes']} bytes > {max_bytes}"
+            return models, stats, before, [f"{what} with every tree head at {MIN_TREES} trees"]
+        head = max(prunable)[1]
+        role = HEAD_MODELS[head]
+        est = models[role].steps[-1][1]
+        models[role] = _pipeline_with(models[role], truncate(est, max(MIN_TREES, int(n_trees(est) * SHRINK))))
+        engine = RiskEngine.from_models(models)
+
+def drift(original, pruned, reference):
+    """Per head: mean and max |risk change| on the reference rows"""
+    a, b = RiskEngine.from_models(original), RiskEngine.from_models(pruned)
+    X = a.encoder.encode_columns(reference)
+    ra, rb = a.evaluate(reference, X), b.evaluate(reference, X)
+    return {h: {"mean": float(np.mean(np.abs(ra[h] - rb[h]))), "max": float(np.max(np.abs(ra[h] - rb[h])))}
+            for h in ra}
+
+def default_out(models_dir):
+    """Where the compile writes when not told otherwise: ``<models_dir>-budgeted`` next to it"""
+    models_dir = Path(models_dir).resolve()
+    return models_dir.with_name(models_dir.name + "-budgeted")
+
+def compile_budget(models_dir="models", out=None, p99_us=P99_US, max_bytes=MAX_BYTES, max_drift=MAX_DRIFT,
+                   reference=None, calls=CALLS, force=False, in_place=False, verbose=True):
+    """Prune the models in ``models_dir`` to the budget and write them with ``budget.json`` to ``out``
+    (default: ``default_out(models_dir)``; ``models_dir`` itself only with ``in_place``). Returns the
+    budget record; raises ValueError when the budget cannot be met within ``max_drift`` (unless
+    ``force``) or when ``out`` would overwrite ``models_dir`` without ``in_place``."""
+    import joblib
+    models_dir = Path(models_dir)
+    if in_place:
+        if out is not None and Path(out).resolve() != models_dir.resolve():
+            raise ValueError(f"in_place writes to {models_dir}, not {out}")
+        out = models_dir
+    out = Path(out) if out is not None else default_out(models_dir)
+    if out.resolve() == models_dir.resolve() and not in_place:
+        raise ValueError(f"{out} is the source models directory; pass in_place=True (--in-place) to overwrite it")
+    paths = {role: models_dir / name for role, name in MODEL_FILES.items() if (models_dir / name).exists()}
+    original = {role: joblib.load(p) for role, p in paths.items()}
+    reference = reference if reference is not None else reference_rows()
+    pruned, stats, before, problems = fit_budget(original, p99_us, max_bytes, reference, calls, verbose)
+    moved = drift(original, pruned, reference)
+    problems += [f"{h} risk moved by {d['mean']:.4f} on average (max drift {max_drift})"
+                 for h, d in moved.items() if d["mean"] > max_drift]
+    if problems and not force:
+        raise ValueError("budget not met: " + "; ".join(problems))
+
+    out.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for role, src in paths.items():
+        dst = out / src.name
+        if pruned[role] is not original[role]:
+            joblib.dump(pruned[role], dst)
+        elif dst.resolve() != src.resolve():
+            shutil.copy2(src, dst)
+        files[role] = dst
+    if out.resolve() != models_dir.resolve():
+        for name in CONFIG_FILES.values():
+            if name != BUDGET_FILE and (models_dir / name).exists():
+                shutil.copy2(models_dir / name, out / name)
+    heads = {}
+    for head, role in HEAD_MODELS.items():
+        if head in stats["heads"]:
+            heads[head] = {"role": role, "file": files[role].name, "sha256": file_sha256(files[role]),
+                           "trees": n_trees(pruned[role].steps[-1][1]), "trees_before": before.get(role),
+                           **stats["heads"][head], "drift": moved[head]}
+    record = {
+        "budget": {"p99_us": p99_us, "max_bytes": max_bytes, "max_drift": max_drift},
+        "measured": {k: stats[k] for k in ("p50_us", "p99_us", "bytes")},
+        "heads": heads,
+        "files": {role: {"file": p.name, "sha256": file_sha256(p)} for role, p in files.items()},
+        "within_budget": not problems, "problems": problems,
+        "host": {"cpus": os.cpu_count(), "machine": platform.machine(), "python": platform.python_version()},
+        "compiled_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    (out / BUDGET_FILE).write_text(json.dumps(record, indent=2))
+    if verbose:
+        print(f"Wrote {out / BUDGET_FILE}: p99 {stats['p99_us']:.0f}µs (budget {p99_us:.0f}), "
+              f"{stats['bytes'] / 2**10:.0f} KiB (budget {max_bytes / 2**10:.0f})")
+    return record
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Prune the trained models to a serving latency / memory budget")
+    ap.add_argument("--models", default="models")
+    ap.add_argument("--out", default=None, help="output models directory (default: <models>-budgeted)")
+    ap.add_argument("--in-place", action="store_true", help="overwrite the models in --models instead")
+    ap.add_argument("--p99-us", type=float, default=P99_US, help="single-transaction model time budget")
+    ap.add_argument("--max-kib", type=float, default=MAX_BYTES / 2**10, help="compiled footprint budget")
+    ap.add_argument("--max-drift", type=float, default=MAX_DRIFT, help="mean risk change allowed per head")
+    ap.add_argument("--calls", type=int, default=CALLS, help="single-row calls per measurement")
+    ap.add_argument("--force", action="store_true", help="write the artifact even if the budget is not met")
+    args = ap.parse_args()
+    try:
+        compile_budget(args.models, args.out, args.p99_us, int(args.max_kib * 2**10), args.max_drift,
+                       calls=args.calls, force=args.force, in_place=args.in_place)
+    except ValueError as e:
+        raise SystemExit(str(e))
@@ -0,0 +1,124 @@
+"""Fit the score combiner from analyst labels.
+
+Every labelled transaction in the feedback log (``data/labels.jsonl`` included)
+is scored by the current models into its risk heads. A logistic regression
+over the heads gives the logit; its output is calibrated with isotonic
+regression (or kept as the logistic sigmoid) and tabulated on a fixed grid.
+The decision thresholds are the logits that flag the target share of traffic
+for review and for step-up: by default on the labelled rows, or on a sample of
+real traffic given with ``--traffic``.
+
+The result is ``models/combiner.json`` (see ``services.risk_api.combiner``),
+which the registry picks up as part of the next model version. Rerun after
+the heads' models change. Offline there is no feature-store history, so the
+geo head sees no travel speed, only region rarity (and nothing at all until the
+density grid is built from enough real transactions).
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from services.shared.features import to_columns
+from services.shared.feedback_log import FeedbackLog
+from services.risk_api.combiner import Combiner
+from services.risk_api.scoring import compute_heads
+
+OUT = Path("models/combiner.json")
+LUT_SIZE = 256          # calibration table entries between the lowest and highest training logit
+STEP_UP_RATE = 0.05     # share of traffic sent to step-up verification
+REVIEW_RATE = 0.01      # share of traffic paused for analyst review
+MIN_LABELS = 10
+
+def load_labels(log):
+    log.compact()
+    df, _ = log.read_frame()
+    return df
+
+def head_matrix(df, bundle, heads=None):
+    """(n, len(heads)) head scores of the records in ``df`` under ``bundle``, plus the head names"""
+    recs = df.drop(columns=["label"], errors="ignore").to_dict("records")
+    cols = to_columns(recs)
+    X = bundle.encoder.encode_columns(cols) if bundle.encoder is not None else None
+    scores = compute_heads(cols, X, bundle)
+    heads = heads or sorted(scores)
+    # a head with no signal on a row (NaN) counts as 0, as Combiner.logits scores it
+    return np.column_stack([np.nan_to_num(np.asarray(scores[h], dtype=np.float64), nan=0.0) for h in heads]), heads
+
+def threshold(scores, rate):
+    """Lowest cut that flags at most ``rate`` of ``scores`` (ties go together)"""
+    s = np.sort(scores)
+    values = np.unique(s)
+    flagged = 1 - np.searchsorted(s, values, side="left") / len(s)
+    ok = values[flagged <= rate]
+    return float(ok[0]) if len(ok) else float(np.nextafter(s[-1], np.inf))
+
+def fit(H, y, heads, method="isotonic", step_up_rate=STEP_UP_RATE, review_rate=REVIEW_RATE,
+        traffic=None, lut_size=LUT_SIZE):
+    """Combiner over head matrix ``H`` for labels ``y``; thresholds from ``traffic`` (default ``H``)"""
+    from sklearn.linear_model import LogisticRegression
+    lr = LogisticRegression(C=1.0).fit(H, y)
+    w, b = lr.coef_[0], float(lr.intercept_[0])
+    z = b + H @ w
+    grid = np.linspace(z.min(), z.max(), lut_size)
+    if method == "isotonic":
+        from sklearn.isotonic import IsotonicRegression
+        lut = IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds="clip").fit(z, y).predict(grid)
+    else:
+        lut = 1 / (1 + np.exp(-grid))
+    combiner = Combiner(heads, w, b, lut, grid[0], grid[-1], 0.0, 0.0)
+
+    ref = combiner.logits(dict(zip(heads, (H if traffic is None else traffic).T)))
+    combiner.review = threshold(ref, review_rate)
+    combiner.step_up = min(threshold(ref, review_rate + step_up_rate), combiner.review)
+    p = combiner.score(dict(zip(heads, H.T)))
+    decisions = np.asarray(combiner.decide(ref))
+    combiner.meta = {
+        "method": method, "labels": int(len(y)), "positives": int(np.sum(y)),
+        "brier": float(np.mean((p - y) ** 2)),
+        "target_rates": {"step_up": step_up_rate, "review": review_rate},
+        "score_thresholds": {"step_up": float(combiner.calibrate(combiner.step_up)),
+                             "review": float(combiner.calibrate(combiner.review))},
+        "rates": {d: float(np.mean(decisions == d)) for d in ("APPROVE", "STEP_UP", "REVIEW")},
+        "thresholds_from": "labels" if traffic is None else "traffic",
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    return combiner
+
+def train(log=None, models_dir="models", out=OUT, method="isotonic", step_up_rate=STEP_UP_RATE,
+          review_rate=REVIEW_RATE, traffic_paths=None):
+    from services.risk_api.registry import ModelRegistry
+    df = load_labels(log or FeedbackLog("data/feedback", legacy="data/labels.jsonl"))
+    y = df["label"].to_numpy(dtype=np.int64) if len(df) else np.zeros(0, dtype=np.int64)
+    if len(y) < MIN_LABELS or len(np.unique(y)) < 2:
+        print(f"{len(y)} labels ({int(y.sum())} fraud); need {MIN_LABELS}+ with both classes. Skipping.")
+        return None
+    bundle = ModelRegistry(models_dir).load_bundle()
+    H, heads = head_matrix(df, bundle)
+    traffic = None
+    if traffic_paths:
+        import pandas as pd
+        from services.training.bootstrap_model import iter_chunks
+        sample = pd.concat(list(iter_chunks(traffic_paths)), ignore_index=True)
+        sample["txn_id"], sample["user_id"], sample["device_id"] = "", "", ""
+        traffic, _ = head_matrix(sample, bundle, heads)
+    combiner = fit(H, y, heads, method, step_up_rate, review_rate, traffic)
+    combiner.meta["model_version"] = bundle.version
+    Path(out).write_text(json.dumps(combiner.to_config()))
+    print(f"Wrote {out}: {len(y)} labels, thresholds step_up={combiner.step_up:.3f} "
+          f"review={combiner.review:.3f}, rates {combiner.meta['rates']}")
+    return combiner
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Fit the calibrated score combiner from analyst feedback")
+    ap.add_argument("--method", choices=["isotonic", "sigmoid"], default="isotonic")
+    ap.add_argument("--step-up-rate", type=float, default=STEP_UP_RATE)
+    ap.add_argument("--review-rate", type=float, default=REVIEW_RATE)
+    ap.add_argument("--traffic", nargs="*", help="CSV/Parquet traffic sample the rates refer to (default: the labels)")
+    ap.add_argument("--models", default="models")
+    ap.add_argument("--out", default=str(OUT))
+    args = ap.parse_args()
+    train(models_dir=args.models, out=args.out, method=args.method, step_up_rate=args.step_up_rate,
+          review_rate=args.review_rate, traffic_paths=args.traffic)
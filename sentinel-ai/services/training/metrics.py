@@ -2,12 +2,13 @@ from fastapi import FastAPI
 from typing import Dict, Any
 import time
 import os
+from services.shared.latency import LatencyHistogram
 
 app = FastAPI(title="Sentinel AI – Metrics API")
 
 # Simple metrics storage (in production, use proper metrics DB)
 metrics_store = {
-    "latency_ms": [],
+    "latency_ms": LatencyHistogram(),   # constant memory, all samples since start
     "decisions": {"APPROVE": 0, "STEP_UP": 0, "REVIEW": 0},
     "feedback_count": 0,
     "model_accuracy": 0.0
@@ -16,10 +17,11 @@ metrics_store = {
 @app.get("/metrics")
 def get_metrics() -> Dict[str, Any]:
     """Get current model performance metrics"""
-    avg_latency = sum(metrics_store["latency_ms"]) / len(metrics_store["latency_ms"]) if metrics_store["latency_ms"] else 0
-    
+    latency = metrics_store["latency_ms"].summary()
+
     return {
-        "average_latency_ms": avg_latency,
+        "average_latency_ms": latency["mean_ms"],
+        "latency_ms": {k: latency[k] for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms", "count")},
         "decision_counts": metrics_store["decisions"],
         "total_feedback_samples": metrics_store["feedback_count"],
         "model_accuracy": metrics_store["model_accuracy"],
@@ -33,10 +35,7 @@ def get_metrics() -> Dict[str, Any]:
 @app.post("/metrics/latency")
 def record_latency(latency_ms: float):
     """Record API latency for monitoring"""
-    metrics_store["latency_ms"].append(latency_ms)
-    # Keep only last 1000 measurements
-    if len(metrics_store["latency_ms"]) > 1000:
-        metrics_store["latency_ms"] = metrics_store["latency_ms"][-1000:]
+    metrics_store["latency_ms"].record(max(0, int(latency_ms * 1e6)))
     return {"status": "recorded"}
 
 @app.post("/metrics/decision")
@@ -1,33 +1,134 @@
-import json, joblib, pandas as pd
+import argparse, hashlib, json, time, tracemalloc
+import joblib, pandas as pd
 from pathlib import Path
 from sklearn.ensemble import GradientBoostingClassifier
 from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import OneHotEncoder
 from sklearn.pipeline import Pipeline
 from services.shared.features import CATEGORICALS, NUMERICS, BINARIES
+from services.shared.feedback_log import FeedbackLog, FIELDS
+from services.training.sampling import Reservoir
 
-LABELS = Path("data/labels.jsonl")
+FEEDBACK = FeedbackLog("data/feedback", legacy="data/labels.jsonl")
+MODEL = Path("models/behavioral_gb.joblib")
+# watermark + replay reservoir of the incremental mode; tied to the model file it was written with
+STATE = Path("data/retrain_state.joblib")
 
-def load_feedback():
-    if not LABELS.exists(): return pd.DataFrame()
-    rows = [json.loads(l) for l in LABELS.read_text().splitlines() if l.strip()]
-    return pd.DataFrame(rows)
+STAGES_PER_RUN = 20      # boosting stages added by one incremental run
+MAX_STAGES = 500         # past this, the next run is a full refit (bounds model size and latency)
+RESERVOIR_SIZE = 2000    # old rows replayed alongside the new ones (0 = new rows only)
 
-def train():
-    df = load_feedback()
-    if df.empty: 
-        print("No feedback yet; skipping."); return
-    y = df["label"].astype(int)
-    X = df.drop(columns=["label"])
+def load_feedback(log=FEEDBACK, start=(0, 0)):
+    # seal-and-compact what the API has written, then read it back column-wise
+    log.compact()
+    df, _ = log.read_frame(start)
+    return df
+
+def _file_hash(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+
+def _new_pipeline(params=None):
+    # params: GradientBoostingClassifier hyperparameters (the search job's promoted ones)
     pre = ColumnTransformer([
         ("cat", OneHotEncoder(handle_unknown="ignore"), CATEGORICALS),
         ("num", "passthrough", NUMERICS+BINARIES)
     ])
-    clf = GradientBoostingClassifier()
-    pipe = Pipeline([("pre", pre), ("clf", clf)])
+    return Pipeline([("pre", pre), ("clf", GradientBoostingClassifier(**(params or {})))])
+
+def _fit(pipe, df):
+    y = df["label"].astype(int)
+    X = df.drop(columns=["label"])
     pipe.fit(X, y)
-    joblib.dump(pipe, "models/behavioral_gb.joblib")
+    return pipe
+
+def params_path(model=MODEL):
+    # hyperparameters promoted by services.training.search, next to the model they apply to
+    return Path(model).with_suffix(".params.json")
+
+def load_params(model=MODEL):
+    """GradientBoosting hyperparameters full refits use: the promoted ones, else sklearn's defaults"""
+    path = params_path(model)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+def train_full(log=FEEDBACK, reservoir_size=RESERVOIR_SIZE, model=MODEL, state=STATE, params=None):
+    """Refit from scratch on the whole log; resets the incremental state.
+
+    ``params`` are GradientBoosting hyperparameters; by default the ones promoted by
+    ``services.training.search`` (``load_params``), so a promotion survives later refits.
+    """
+    model = Path(model)
+    res, frames, pos = Reservoir(reservoir_size), [], (0, 0)
+    log.compact()
+    for cols, pos in log.iter_batches():
+        res.add(cols)
+        frames.append(pd.DataFrame(cols))
+    if not frames:
+        print("No feedback yet; skipping."); return None
+    df = pd.concat(frames, ignore_index=True)
+    if params is None:
+        params = load_params(model)
+    pipe = _fit(_new_pipeline(params), df)
+    joblib.dump(pipe, model)
+    joblib.dump({"watermark": pos, "reservoir": res, "model": _file_hash(model)}, state)
     print(f"Trained model on {len(df)} feedback samples")
+    return len(df)
+
+def train_incremental(log=FEEDBACK, stages=STAGES_PER_RUN, replay=True, model=MODEL, state=STATE):
+    """Add boosting stages fitted on feedback newer than the watermark (+ a replay sample).
+
+    The one-hot vocabulary of the existing pipeline is kept, so the model's
+    feature layout never changes between runs. Falls back to a full refit when
+    there is no state for the current model file or the model is at MAX_STAGES.
+    """
+    model, state_path = Path(model), Path(state)
+    state = joblib.load(state_path) if state_path.exists() else None
+    if state is None or not model.exists() or state["model"] != _file_hash(model):
+        print("No incremental state for the current model; doing a full refit.")
+        return train_full(log, model=model, state=state_path)
+    pipe = joblib.load(model)
+    clf = pipe.named_steps["clf"]
+    if clf.n_estimators + stages > MAX_STAGES:
+        print(f"Model has {clf.n_estimators} stages; compacting with a full refit.")
+        return train_full(log, state["reservoir"].size, model=model, state=state_path)
+
+    log.compact()
+    res, frames, pos = state["reservoir"], [], state["watermark"]
+    replayed = res.frame(FIELDS) if replay else None
+    for cols, pos in log.iter_batches(state["watermark"]):
+        frames.append(pd.DataFrame(cols))
+        res.add(cols)
+    if not frames:
+        print("No new feedback; skipping."); return 0
+    new = pd.concat(frames, ignore_index=True)
+    df = pd.concat([new, replayed], ignore_index=True) if replayed is not None and len(replayed) else new
+    if df["label"].nunique() < 2:
+        # boosting needs both classes; leave the watermark where it is and retry with more data
+        print(f"{len(new)} new samples hold a single class; waiting for more feedback.")
+        return 0
+    y = df["label"].astype(int)
+    X = pipe.named_steps["pre"].transform(df.drop(columns=["label"]))
+    clf.set_params(warm_start=True, n_estimators=clf.n_estimators + stages)
+    clf.fit(X, y)
+    joblib.dump(pipe, model)
+    joblib.dump({"watermark": pos, "reservoir": res, "model": _file_hash(model)}, state_path)
+    print(f"Added {stages} stages on {len(new)} new + {len(df) - len(new)} replayed samples "
+          f"({clf.n_estimators} total)")
+    return len(new)
+
+def train(incremental=False, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    n = train_incremental(**kwargs) if incremental else train_full(**kwargs)
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{'incremental' if incremental else 'full'} retrain: {wall:.2f}s, peak {peak / 2**20:.1f} MiB")
+    return n
 
 if __name__ == "__main__":
-    train()
+    ap = argparse.ArgumentParser(description="Retrain the behavioral model from analyst feedback")
+    ap.add_argument("--incremental", action="store_true",
+                    help="only train on feedback since the last run (warm-started boosting stages)")
+    ap.add_argument("--no-replay", action="store_true", help="incremental: skip the reservoir replay")
+    args = ap.parse_args()
+    train(args.incremental, **({"replay": False} if args.incremental and args.no_replay else {}))
@@ -0,0 +1,39 @@
+"""Bounded-memory sampling over streams of column batches"""
+import numpy as np
+import pandas as pd
+
+class Reservoir:
+    """Uniform sample (Algorithm R) of fixed size over every row added so far"""
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.seen = 0
+        self.cols = None
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, cols):
+        """Offer a batch (column -> 1-d array, or a DataFrame) to the sample"""
+        n = len(next(iter(cols.values()))) if isinstance(cols, dict) else len(cols)
+        if self.size == 0 or n == 0:
+            self.seen += n
+            return
+        if self.cols is None:
+            dtypes = {k: np.asarray(v).dtype for k, v in cols.items()}
+            self.cols = {k: np.empty(self.size, dtype=object if dt.kind == "U" else dt)
+                         for k, dt in dtypes.items()}
+        idx = self.seen + np.arange(n)
+        fill = idx < self.size
+        # row i (0-based) replaces a random slot with probability size/(i+1); a later row
+        # hitting the same slot wins, exactly as in the sequential algorithm
+        slot = self.rng.integers(0, idx[~fill] + 1) if (~fill).any() else np.empty(0, dtype=np.int64)
+        keep = slot < self.size
+        for k, v in cols.items():
+            v = np.asarray(v)
+            self.cols[k][idx[fill]] = v[fill]
+            self.cols[k][slot[keep]] = v[~fill][keep]
+        self.seen += n
+
+    def frame(self, columns=()):
+        if self.cols is None:
+            return pd.DataFrame(columns=list(columns))
+        return pd.DataFrame({k: v[:min(self.seen, self.size)] for k, v in self.cols.items()})
@@ -0,0 +1,175 @@
+"""Hyperparameter search for the behavioral model, with guarded promotion.
+
+``python -m services.training.search`` fits GradientBoosting candidates in
+parallel (joblib processes) from a grid over ``SPACE``, or a random sample of
+it with ``--random N``:
+
+* Validation is by time. The log is in arrival order, and each of ``--folds``
+  expanding windows trains on everything before a cut and validates on the
+  block after it. Quality is the mean ROC AUC over the folds.
+* Each fold is encoded once, with the retrain job's pipeline fit on that
+  fold's training rows only, so a validation block never contributes to its
+  own category vocabulary. The fold's float32 matrix is written to a scratch
+  ``.npy``, and every worker memory-maps it. Training rows are a slice of that
+  map, so fits read the shared pages without copying them: GradientBoosting
+  trains on float32 anyway.
+* Serve latency is measured afterwards, one candidate at a time in this
+  process, so parallel fits do not skew it. Each candidate's last-fold model is
+  compiled the way the API serves it (``services.shared.forest``) and timed
+  scoring single rows.
+
+The incumbent is the configuration full refits currently use
+(``retrain.load_params``). It goes through exactly the same folds. The best
+candidate is promoted only if it beats the incumbent's AUC by ``--min-gain``
+and its p99 is no worse than the incumbent's (within ``--latency-tolerance``
+of timer noise). Promotion writes the hyperparameters next to the model,
+where later full refits pick them up, and refits the model on all feedback.
+The full comparison goes to ``data/search_report.json``.
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from services.training import retrain
+
+# GradientBoostingClassifier hyperparameters searched (the grid is their product)
+SPACE = {
+    "n_estimators": [50, 100, 200],
+    "max_depth": [2, 3, 4],
+    "learning_rate": [0.05, 0.1, 0.2],
+    "subsample": [1.0, 0.8],
+    "min_samples_leaf": [1, 20],
+}
+FOLDS = 3
+MIN_GAIN = 0.002            # mean AUC a candidate must add over the incumbent
+LATENCY_TOLERANCE = 0.10    # p99 may exceed the incumbent's by this much (timer noise)
+LATENCY_CALLS = 500         # single-row calls timed per candidate
+MIN_ROWS = 100
+REPORT = Path("data/search_report.json")
+
+def candidates(space=SPACE, n_random=None, seed=0):
+    """Every combination of ``space``, or ``n_random`` of them drawn without replacement"""
+    grid = [dict(zip(space, values)) for values in itertools.product(*space.values())]
+    if n_random is None or n_random >= len(grid):
+        return grid
+    picks = np.random.default_rng(seed).choice(len(grid), n_random, replace=False)
+    return [grid[i] for i in sorted(picks)]
+
+def time_folds(n, folds=FOLDS):
+    """(train_end, valid_end) per expanding window: train on rows [0, train_end), validate up to valid_end"""
+    cuts = [n * k // (folds + 1) for k in range(1, folds + 2)]
+    return list(zip(cuts[:-1], cuts[1:]))
+
+def encode(df, train_end, valid_end):
+    """The retrain pipeline's float32 design matrix for rows [0, valid_end) of ``df``, its vocabulary fit
+    on rows [0, train_end) only (categories first seen later encode as all zeros, as in serving)"""
+    features = df.drop(columns=["label"])
+    pre = retrain._new_pipeline().named_steps["pre"].fit(features.iloc[:train_end])
+    X = pre.transform(features.iloc[:valid_end])
+    X = X.toarray() if hasattr(X, "toarray") else X
+    return np.ascontiguousarray(X, dtype=np.float32)
+
+def evaluate(params, x_paths, y, folds, seed=0):
+    """Fit ``params`` on each time fold's memory-mapped matrix; fold AUCs and the last fold's model"""
+    from sklearn.ensemble import GradientBoostingClassifier
+    from sklearn.metrics import roc_auc_score
+    aucs, fit_s, clf = [], 0.0, None
+    for x_path, (train_end, valid_end) in zip(x_paths, folds):
+        if len(np.unique(y[:train_end])) < 2:
+            continue
+        X = np.load(x_path, mmap_mode="r")
+        start = time.perf_counter()
+        # promoted params carry their own random_state (the incumbent's); candidates use ``seed``
+        clf = GradientBoostingClassifier(**{"random_state": seed, **params}).fit(X[:train_end], y[:train_end])
+        fit_s += time.perf_counter() - start
+        y_valid = y[train_end:valid_end]
+        if len(np.unique(y_valid)) == 2:
+            aucs.append(float(roc_auc_score(y_valid, clf.predict_proba(X[train_end:valid_end])[:, 1])))
+    return {"params": params, "auc": float(np.mean(aucs)) if aucs else float("nan"), "fold_auc": aucs,
+            "fit_s": fit_s}, clf
+
+def serve_latency(clf, X, calls=LATENCY_CALLS):
+    """Single-row latency of ``clf`` compiled as the API serves it (µs), and its node count"""
+    from services.shared.forest import compile_estimator
+    from services.shared.latency import time_calls
+    engine = compile_estimator(clf, keep_estimator=False)
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    rows = [X[i][None, :] for i in range(min(len(X), calls))]
+    return {**time_calls(engine.predict_proba, rows, calls, repeats=1), "nodes": int(len(engine.feature))}
+
+def should_promote(best, incumbent, min_gain=MIN_GAIN, latency_tolerance=LATENCY_TOLERANCE):
+    """(promote?, reason): better quality by ``min_gain`` and no slower at p99"""
+    if incumbent is None or not np.isfinite(incumbent["auc"]):
+        return True, "no incumbent to beat"
+    if not best["auc"] >= incumbent["auc"] + min_gain:
+        return False, f"AUC {best['auc']:.4f} does not beat the incumbent's {incumbent['auc']:.4f} by {min_gain}"
+    if best["p99_us"] > incumbent["p99_us"] * (1 + latency_tolerance):
+        return False, f"p99 {best['p99_us']:.0f}µs is slower than the incumbent's {incumbent['p99_us']:.0f}µs"
+    return True, (f"AUC {best['auc']:.4f} vs {incumbent['auc']:.4f}, "
+                  f"p99 {best['p99_us']:.0f}µs vs {incumbent['p99_us']:.0f}µs")
+
+def search(log=None, model=retrain.MODEL, state=retrain.STATE, space=SPACE, n_random=None, folds=FOLDS,
+           workers=None, min_gain=MIN_GAIN, latency_tolerance=LATENCY_TOLERANCE, report=REPORT, seed=0,
+           promote=True):
+    """Run the search; returns the report (also written to ``report``)"""
+    from joblib import Parallel, delayed
+    start = time.perf_counter()
+    df = retrain.load_feedback(log or retrain.FEEDBACK)
+    if len(df) < MIN_ROWS or df["label"].nunique() < 2:
+        print(f"{len(df)} labels; need {MIN_ROWS}+ with both classes. Skipping.")
+        return None
+    y = df["label"].to_numpy(dtype=np.int64)
+    splits = time_folds(len(y), folds)
+    incumbent_params = retrain.load_params(model)
+    jobs = [incumbent_params] + candidates(space, n_random, seed)
+    workers = workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory(prefix="sentinel-search-") as scratch:
+        x_paths = [Path(scratch) / f"X-fold{k}.npy" for k in range(len(splits))]
+        for x_path, (train_end, valid_end) in zip(x_paths, splits):
+            np.save(x_path, encode(df, train_end, valid_end))  # workers and the latency pass read the maps
+        results = Parallel(n_jobs=workers)(delayed(evaluate)(p, x_paths, y, splits, seed) for p in jobs)
+        X = np.load(x_paths[-1], mmap_mode="r")
+        last_valid = X[splits[-1][0]:splits[-1][1]]
+        for res, clf in results:
+            res.update(serve_latency(clf, last_valid) if clf is not None else {"p50_us": np.inf, "p99_us": np.inf})
+        del X, last_valid
+    incumbent, *rest = [res for res, _ in results]
+    ranked = sorted(rest, key=lambda r: (-np.nan_to_num(r["auc"], nan=-1.0), r["p99_us"]))
+    best = ranked[0]
+    ok, reason = should_promote(best, incumbent if Path(model).exists() else None, min_gain, latency_tolerance)
+    out = {
+        "rows": len(y), "positives": int(y.sum()), "folds": splits, "workers": workers,
+        "incumbent": incumbent, "best": best, "promoted": bool(ok and promote), "reason": reason,
+        "candidates": ranked, "wall_s": time.perf_counter() - start,
+        "searched_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    if ok and promote:
+        params = {**best["params"], "random_state": seed}
+        retrain.params_path(model).write_text(json.dumps(params, indent=2))
+        retrain.train_full(log or retrain.FEEDBACK, model=model, state=state, params=params)
+    if report is not None:
+        Path(report).parent.mkdir(parents=True, exist_ok=True)
+        Path(report).write_text(json.dumps(out, indent=2, default=float))
+    print(f"{len(ranked)} candidates on {len(y)} labels in {out['wall_s']:.1f}s ({workers} workers); "
+          f"best {best['params']}: {'promoted' if out['promoted'] else 'kept the incumbent'} ({reason})")
+    return out
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Search behavioral-model hyperparameters and promote a better one")
+    ap.add_argument("--random", type=int, default=None, metavar="N", help="sample N grid points instead of all")
+    ap.add_argument("--folds", type=int, default=FOLDS, help="expanding time-split validation windows")
+    ap.add_argument("--workers", type=int, default=None, help="fitting processes (default: one per core)")
+    ap.add_argument("--min-gain", type=float, default=MIN_GAIN, help="AUC the best candidate must add")
+    ap.add_argument("--latency-tolerance", type=float, default=LATENCY_TOLERANCE,
+                    help="allowed p99 excess over the incumbent (fraction)")
+    ap.add_argument("--dry-run", action="store_true", help="report only; never promote")
+    ap.add_argument("--report", default=str(REPORT))
+    args = ap.parse_args()
+    search(n_random=args.random, folds=args.folds, workers=args.workers, min_gain=args.min_gain,
+           latency_tolerance=args.latency_tolerance, report=args.report, promote=not args.dry_run)
@@ -0,0 +1,978 @@
+#!/usr/bin/env python3
+"""
+In-process scoring tests for Sentinel AI (no running server needed)
+Run from the sentinel-ai directory: python -m pytest test_scoring.py
+"""
+import asyncio
+import json
+import os
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from services.shared.schemas import Transaction
+from services.shared.features import to_frame_many, to_columns, FeatureEncoder
+from services.risk_api import main
+
+LABELS = Path("data/labels.jsonl")
+
+def sample_transactions(n=200, seed=7):
+    """Feedback rows plus random synthetic transactions"""
+    txns = []
+    for line in LABELS.read_text().splitlines():
+        if line.strip():
+            rec = json.loads(line)
+            rec.pop("label")
+            txns.append(rec)
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        txns.append({
+            "txn_id": f"synth_{i}",
+            "amount": float(rng.gamma(2, 60)),
+            "merchant_category": str(rng.choice(["grocery","electronics","luxury","gaming","travel"])),
+            "device_id": f"D{rng.integers(1000)}",
+            "geo_lat": float(rng.normal(37, 2)),
+            "geo_lon": float(rng.normal(-97, 3)),
+            "user_id": f"U{rng.integers(1000)}",
+            "is_new_device": bool(rng.random() < 0.15),
+            "hour_of_day": int(rng.integers(0, 24)),
+            "past_24h_txn_count": int(rng.integers(0, 10)),
+            "past_7d_chargebacks": int(rng.integers(0, 3)),
+            "velocity_usd_7d": float(rng.gamma(3, 100)),
+            "ip_asn_risk": float(rng.random()),
+        })
+    return [Transaction(**t) for t in txns]
+
+def one_per_user(txns):
+    """Give every transaction its own user, so order-dependent state (travel from the last location) can't differ"""
+    return [t.model_copy(update={"user_id": f"{t.user_id}-{t.txn_id}"}) for t in txns]
+
+@contextmanager
+def unlimited_explain_budget():
+    """Explain every batch inline: over budget, reasons fall back to raw values and would depend on batching"""
+    budget, main.EXPLAIN_BUDGET_MS = main.EXPLAIN_BUDGET_MS, float("inf")
+    try:
+        yield
+    finally:
+        main.EXPLAIN_BUDGET_MS = budget
+
+@contextmanager
+def uncached():
+    """Score every call afresh: a repeated txn_id would otherwise get its stored decision back"""
+    size, main.decision_cache.max_entries = main.decision_cache.max_entries, 0
+    try:
+        yield
+    finally:
+        main.decision_cache.max_entries = size
+
+@contextmanager
+def fresh_features():
+    """An empty feature store: every user is seen for the first time (no travel history)"""
+    from services.risk_api.feature_store import FeatureStore
+    store, main.feature_store = main.feature_store, FeatureStore()
+    try:
+        yield
+    finally:
+        main.feature_store = store
+
+def kaggle_sample_transactions():
+    """data/fraud_sample.csv rows mapped onto the schema"""
+    from services.shared.mapping import TransactionMapper
+    return [Transaction(**r) for r in TransactionMapper().records(pd.read_csv("data/fraud_sample.csv"))]
+
+def test_encoder_matches_pipeline():
+    """FeatureEncoder output is bit-for-bit the float32 matrix the IsolationForest sees"""
+    txns = sample_transactions() + kaggle_sample_transactions()
+    recs = [t.model_dump() for t in txns]
+    pipe = main.registry.active.pipe
+    enc = FeatureEncoder.from_pipeline(pipe)
+    expected = pipe.named_steps["pre"].transform(to_frame_many(recs)).astype(np.float32)
+
+    batch = enc.encode_columns(to_columns(recs))
+    assert batch.dtype == np.float32
+    assert np.array_equal(batch, expected)
+    for i, rec in enumerate(recs):
+        assert np.array_equal(enc.encode(rec)[0], expected[i])
+
+    # and the bare estimator agrees with the full joblib pipeline
+    assert np.array_equal(pipe.named_steps["iso"].decision_function(batch),
+                          pipe.decision_function(to_frame_many(recs)))
+
+def test_compiled_forest_matches_sklearn():
+    """Equivalence mode: the flattened forest reproduces decision_function exactly"""
+    bundle = main.registry.active
+    recs = [t.model_dump() for t in sample_transactions(2000)]
+    X = bundle.engine.head_input("anomaly", bundle.encoder.encode_columns(to_columns(recs)))
+    bundle.forest.check_equivalence(X)
+    for i in range(50):
+        bundle.forest.check_equivalence(X[i:i+1])
+    X[::5, -3] = np.nan  # NaN routing follows the trees' missing_go_to_left
+    bundle.forest.check_equivalence(X)
+
+def test_learned_heads_match_pipelines():
+    """Every head over the shared encoding agrees with its own joblib pipeline"""
+    bundle = main.registry.active
+    recs = [t.model_dump() for t in sample_transactions(1000)]
+    df = to_frame_many(recs)
+    X = bundle.encoder.encode_columns(to_columns(recs))
+    risk = bundle.engine.evaluate(to_columns(recs))
+    assert np.array_equal(risk["anomaly"], np.clip(0.5 - bundle.pipe.decision_function(df), 0, 1.0))
+    for head, role in (("behavioral", "behavioral"), ("consortium", "federated")):
+        pipe = bundle.models[role]
+        assert np.allclose(risk[head], pipe.predict_proba(df)[:, 1], rtol=1e-12, atol=1e-15)
+    # boosted trees reproduce the raw log-odds exactly
+    gb = bundle.engine.model("behavioral")
+    gb.check_equivalence(bundle.engine.head_input("behavioral", X))
+
+def test_batch_matches_single():
+    """/score/batch returns exactly what /score returns per transaction"""
+    with unlimited_explain_budget(), uncached():
+        txns = one_per_user(sample_transactions())
+        with fresh_features():
+            batch = main.score_batch(txns)
+        assert len(batch) == len(txns)
+        with fresh_features():   # the batch left every user a previous location
+            for txn, got in zip(txns, batch):
+                assert got.model_dump() == asyncio.run(main.score(txn)).model_dump()
+
+def test_micro_batcher_coalesces_concurrent_requests():
+    """Concurrent /score calls share batched evaluations and get their own results"""
+    with unlimited_explain_budget(), uncached():
+        txns = one_per_user(sample_transactions())
+
+        async def burst():
+            return await asyncio.gather(*(main.score(t) for t in txns))
+
+        before = main.batcher.stats()
+        with fresh_features():
+            got = asyncio.run(burst())
+        after = main.batcher.stats()
+        with fresh_features():
+            assert [g.model_dump() for g in got] == [r.model_dump() for r in main.score_records(txns)]
+        assert after["requests"] - before["requests"] == len(txns)
+        assert after["batches"] - before["batches"] < len(txns)
+        assert after["max_batch_size"] <= main.BATCH_MAX_SIZE
+
+def test_micro_batcher_backpressure():
+    """Several batches are evaluated at once, and a full queue rejects new requests instead of growing"""
+    import threading
+    from services.risk_api.batcher import MicroBatcher, Overloaded
+    release, lock = threading.Event(), threading.Lock()
+    running = {"now": 0, "peak": 0}
+
+    def slow(items):
+        with lock:
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+        release.wait(10)
+        with lock:
+            running["now"] -= 1
+        return [i * 2 for i in items]
+
+    batcher = MicroBatcher(slow, max_batch=2, max_wait=0.0, max_queue=4, max_in_flight=2)
+
+    async def overload():
+        first = [asyncio.ensure_future(batcher.submit(i)) for i in range(4)]
+        for _ in range(1000):   # until both slots hold a batch
+            if batcher.stats()["in_flight"] == 2 and batcher.stats()["queue_depth"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        queued = [asyncio.ensure_future(batcher.submit(i)) for i in range(4, 8)]
+        await asyncio.sleep(0)
+        try:
+            await batcher.submit(8)
+            assert False, "a full queue accepted a request"
+        except Overloaded:
+            pass
+        release.set()
+        return await asyncio.gather(*first, *queued)
+
+    assert asyncio.run(overload()) == [i * 2 for i in range(8)]
+    assert running["peak"] == 2 and batcher.stats()["rejected"] == 1
+
+def test_batch_empty():
+    """An empty batch is a valid request"""
+    assert main.score_batch([]) == []
+
+def test_registry_hot_swap(tmp_path):
+    """A changed model file becomes a new version; bundles already handed out keep working"""
+    import joblib, shutil
+    from services.risk_api.registry import ModelRegistry
+    for f in Path("models").glob("*.joblib"):
+        shutil.copy(f, tmp_path / f.name)
+    reg = ModelRegistry(tmp_path)
+    swaps = []
+    reg.on_swap(lambda old, new: swaps.append((old, new)))
+    v1 = reg.reload()
+    old = reg.active
+    assert reg.reload() == v1 and len(swaps) == 1  # unchanged bytes: no swap
+
+    pipe = joblib.load(tmp_path / "anomaly_iforest.joblib")
+    pipe.named_steps["iso"].offset_ += 0.05
+    joblib.dump(pipe, tmp_path / "anomaly_iforest.joblib")
+    v2 = reg.reload()
+    assert v2 != v1 and reg.active.version == v2
+    assert swaps[-1] == (old, reg.active)
+
+    txns = sample_transactions(20)
+    cols = to_columns([t.model_dump() for t in txns])
+    a_old = old.engine.evaluate(cols)["anomaly"]
+    a_new = reg.active.engine.evaluate(cols)["anomaly"]
+    assert np.allclose(a_new, np.clip(a_old + 0.05, 0, 1.0))
+
+def test_mmap_export_roundtrip(tmp_path):
+    """Workers started in mmap mode score exactly like the joblib-loaded models"""
+    import shutil
+    from services.risk_api.registry import ModelRegistry
+    for f in Path("models").glob("*.joblib"):
+        shutil.copy(f, tmp_path / f.name)
+    first = ModelRegistry(tmp_path, fmt="mmap")
+    first.reload()
+    assert first.active.source == "joblib"
+    assert first.compiled_dir(first.version).exists()
+
+    worker = ModelRegistry(tmp_path, fmt="mmap")
+    worker.reload()
+    assert worker.active.source == "compiled" and worker.version == first.version
+    assert isinstance(worker.active.forest.threshold, np.memmap)
+
+    cols = to_columns([t.model_dump() for t in sample_transactions()])
+    got, want = worker.active.engine.evaluate(cols), first.active.engine.evaluate(cols)
+    assert got.keys() == want.keys()
+    for head in want:
+        assert np.array_equal(got[head], want[head])
+
+def _append_feedback(path, worker, n):
+    from services.shared.feedback_log import FeedbackLog
+    log = FeedbackLog(path, legacy=None, max_segment_bytes=4096, max_buffer=16)
+    for i, t in enumerate(sample_transactions(n, seed=worker)[-n:]):
+        log.append({**t.model_dump(), "txn_id": f"w{worker}_{i}", "label": i % 2})
+    log.close()
+
+def test_feedback_log_segments_and_incremental_reads(tmp_path):
+    """Concurrent writers lose nothing; sealed segments compact; reads resume from a position"""
+    import multiprocessing as mp
+    from services.shared.feedback_log import FeedbackLog
+    procs = [mp.get_context("fork").Process(target=_append_feedback, args=(tmp_path, w, 150)) for w in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+
+    log = FeedbackLog(tmp_path, legacy=LABELS)
+    log.compact()
+    kinds = log.stats()["segments"]
+    assert len(kinds) > 2 and all(k == ["npz"] for k in list(kinds.values())[:-1])
+    df, pos = log.read_frame()
+    n_legacy = sum(1 for l in LABELS.read_text().splitlines() if l.strip())
+    assert len(df) == n_legacy + 450
+    assert sorted(df["txn_id"][n_legacy:]) == sorted(f"w{w}_{i}" for w in range(3) for i in range(150))
+    assert df["label"].dtype == np.int64 and df["is_new_device"].dtype == bool
+
+    log.append({**sample_transactions(0)[0].model_dump(), "label": 1})
+    log.close()
+    new, pos2 = log.read_frame(pos)
+    assert len(new) == 1 and pos2 != pos
+    assert len(log.read_frame(pos2)[0]) == 0
+
+def test_incremental_retrain(tmp_path):
+    """Incremental retrain adds stages from new feedback only, and the result still compiles exactly"""
+    import joblib
+    from benchmarks.bench_retrain import synth_feedback
+    from services.shared.feedback_log import FeedbackLog
+    from services.shared.forest import compile_estimator
+    from services.training import retrain
+    log = FeedbackLog(tmp_path / "feedback", legacy=None)
+    paths = {"model": tmp_path / "gb.joblib", "state": tmp_path / "state.joblib"}
+    for rec in synth_feedback(400, seed=1):
+        log.append(rec)
+    log.close()
+    assert retrain.train_incremental(log, **paths) == 400  # no state yet: full refit
+    assert retrain.train_incremental(log, **paths) == 0    # nothing new
+
+    for rec in synth_feedback(100, seed=2):
+        log.append(rec)
+    log.close()
+    assert retrain.train_incremental(log, stages=5, **paths) == 100
+    state = joblib.load(paths["state"])
+    assert state["reservoir"].seen == 500 and state["watermark"] == log.read_frame()[1]
+    pipe = joblib.load(paths["model"])
+    assert pipe.named_steps["clf"].n_estimators_ == 105
+    X = pipe.named_steps["pre"].transform(log.read_frame()[0].drop(columns=["label"]))
+    compile_estimator(pipe.named_steps["clf"]).check_equivalence(X)
+
+def test_streamed_bootstrap(tmp_path):
+    """Chunked bootstrap sees every category, samples max_samples rows per tree and compiles exactly"""
+    from benchmarks.bench_bootstrap import write_history
+    from services.shared.features import pipeline_categories
+    from services.shared.forest import compile_estimator
+    from services.training.bootstrap_model import bootstrap_stream
+    path = tmp_path / "history.csv"
+    write_history(path, 5000, chunk=1500)
+    pipe = bootstrap_stream([path], out=None, n_estimators=20, max_samples=64, chunk_rows=700)
+    assert pipeline_categories(pipe) == [["electronics", "gaming", "grocery", "luxury", "travel"]]
+    iso = pipe.named_steps["iso"]
+    assert iso.max_samples_ == 64 and len(iso.estimators_) == 20
+    X = pipe.named_steps["pre"].transform(pd.read_csv(path).head(500))
+    compile_estimator(iso).check_equivalence(X)
+
+def test_fedavg_rounds(tmp_path):
+    """Process-pool FedAvg improves the global model and exports it on the API's raw layout"""
+    from services.federation import fed_sim
+    from services.shared.forest import compile_estimator
+    fl = fed_sim.run_federation(n_clients=4, rounds=3, workers=2, n_samples=800, verbose=False)
+    losses = [h["val_log_loss"] for h in fl["history"]]
+    assert losses[-1] < losses[0]
+
+    # one client, one round is exactly that client's local update
+    enc = fl["encoding"]
+    one = fed_sim.run_federation(n_clients=1, rounds=1, workers=1, n_samples=800, encoding=enc, verbose=False)
+    df, y = fed_sim.synth_client(0, n=800)
+    coef, intercept, n = fed_sim.client_update(df, y, encoding=enc)
+    assert np.allclose(one["coef"], coef) and np.isclose(one["intercept"], intercept)
+
+    pipe = fed_sim.export_global(enc, fl["coef"], fl["intercept"], tmp_path / "fl.joblib")
+    val_df, _ = fed_sim.synth_client(fed_sim.VALIDATION_SEED, n=500)
+    want = 1 / (1 + np.exp(-(enc.transform(val_df) @ fl["coef"] + fl["intercept"])))
+    assert np.allclose(pipe.predict_proba(val_df)[:, 1], want)
+    X = pipe.named_steps["pre"].transform(val_df)
+    assert np.allclose(compile_estimator(pipe.named_steps["clf"]).predict_proba(X)[:, 1], want)
+
+def test_federated_wire_format():
+    """Update frames round-trip; lossy encodings keep what they drop as residual; TCP == in-process"""
+    from services.federation import fed_sim, wire
+    rng = np.random.default_rng(0)
+    delta = rng.normal(size=40)
+    frame, residual = wire.UpdateCodec().encode(delta, 0.25, 800, client=3, round_=2)
+    got = wire.decode(frame)
+    assert np.array_equal(got["delta"], delta) and not residual.any()
+    assert (got["client"], got["round"], got["n_samples"], got["intercept_delta"]) == (3, 2, 800, 0.25)
+
+    for codec in (wire.UpdateCodec("int8"), wire.UpdateCodec("float16", topk=10)):
+        frame, residual = codec.encode(delta, 0.0, 1)
+        sent = wire.decode(frame)["delta"]
+        assert np.allclose(sent + residual, delta)
+        assert len(frame) < len(wire.UpdateCodec().encode(delta, 0.0, 1)[0]) / 3
+    assert np.count_nonzero(wire.decode(wire.UpdateCodec(topk=10).encode(delta, 0.0, 1)[0])["delta"]) == 10
+
+    enc = fed_sim.SharedEncoding.fit(fed_sim.synth_client(1000, n=2000)[0])
+    local = fed_sim.run_federation(3, 2, 1, n_samples=500, encoding=enc, verbose=False)
+    tcp = fed_sim.run_federation(3, 2, 1, n_samples=500, encoding=enc, transport="tcp", verbose=False)
+    assert np.allclose(local["coef"], tcp["coef"]) and np.isclose(local["intercept"], tcp["intercept"])
+    assert tcp["history"][0]["bytes_up"] > 0
+
+def test_async_coordinator_quorum_and_deadline():
+    """Rounds close at the quorum, not at the straggler; late updates merge discounted; deadlines hold"""
+    from services.federation import fed_sim
+    from services.federation.coordinator import AsyncCoordinator, SimulatedClient
+    enc = fed_sim.SharedEncoding.fit(fed_sim.synth_client(1000, n=2000)[0])
+    slow = 0.15
+    clients = [SimulatedClient(s, enc, ("uniform", 0.005, 0.02), n_samples=400) for s in range(3)]
+    clients.append(SimulatedClient(3, enc, ("constant", slow), n_samples=400))
+
+    # no wall-clock bounds (they flake on loaded runners): each round merges exactly the quorum, never
+    # waiting for the fourth bank, whose updates arrive versions later and are discounted
+    coord = AsyncCoordinator(clients, enc, quorum=3, deadline=5.0, max_staleness=100)
+    hist = asyncio.run(coord.run(15))
+    assert all(h["quorum_met"] and h["updates"] == 3 for h in hist)
+    stale = [s for h in hist for s in h["staleness"] if s > 0]
+    assert stale and coord.staleness_weight(max(stale)) < 1.0
+
+    strict = AsyncCoordinator(clients, enc, quorum=4, deadline=0.1)
+    hist = asyncio.run(strict.run(2))
+    missed = [h for h in hist if not h["quorum_met"]]
+    assert missed and all(h["updates"] < 4 and h["seconds"] >= 0.09 for h in missed)   # closed by the deadline
+    assert all(h["seconds"] < strict.deadline + 2.0 for h in missed)                   # ... not much later
+
+def test_feature_store_windows(tmp_path):
+    """Ring-buffer windows match a brute-force replay; batches behave like one-by-one; LRU + snapshots work"""
+    from services.risk_api.feature_store import FeatureStore
+    rng = np.random.default_rng(3)
+    n = 3000
+    users = [f"U{u}" for u in rng.integers(0, 40, n)]
+    devices = [f"D{d}" for d in rng.integers(0, 3, n)]
+    amounts = rng.gamma(2, 50, n)
+    now = 1.7e9 + np.sort(rng.uniform(0, 20 * 86400, n))
+    now = now[np.arange(n) // 97 * 97]  # every API batch is scored at one instant
+
+    batched, one_by_one = FeatureStore(initial=8), FeatureStore(initial=8)
+    got = {k: [] for k in ("past_24h_txn_count", "velocity_usd_7d", "is_new_device")}
+    for s in range(0, n, 97):
+        out = batched.observe(users[s:s+97], devices[s:s+97], amounts[s:s+97], now[s:s+97])
+        for k in got:
+            got[k].extend(out[k])
+    single = [one_by_one.observe([users[i]], [devices[i]], [amounts[i]], now[i]) for i in range(n)]
+    for k in got:
+        assert np.allclose(got[k], [o[k][0] for o in single], rtol=1e-5)
+
+    # brute force over the same bucket-aligned windows
+    hour, day = now // 3600, now // 86400
+    for i in range(0, n, 37):
+        prev = [j for j in range(i) if users[j] == users[i]]
+        assert got["past_24h_txn_count"][i] == sum(1 for j in prev if hour[i] - hour[j] < 24)
+        assert np.isclose(got["velocity_usd_7d"][i], sum(amounts[j] for j in prev if day[i] - day[j] < 7), rtol=1e-5)
+        assert got["is_new_device"][i] == (not any(devices[j] == devices[i] for j in prev))
+
+    batched.record_chargeback("U1", now[-1])
+    assert batched.peek(["U1"], ["D0"], now[-1])["past_7d_chargebacks"][0] == 1
+    assert batched.peek(["U1"], ["D0"], now[-1] + 8 * 86400)["past_7d_chargebacks"][0] == 0
+
+    path = batched.snapshot(tmp_path / "features.npz")
+    restored = FeatureStore.restore(path)
+    probe = (["U1", "U2", "nobody"], ["D0", "D1", "D0"], now[-1] + 60)
+    for k, v in batched.peek(*probe).items():
+        assert np.array_equal(v, restored.peek(*probe)[k])
+
+    small = FeatureStore(capacity=100, initial=16)
+    for i in range(250):
+        small.observe([f"V{i}"], ["D"], [1.0], 1.7e9 + 3600 * i)
+    assert len(small) <= 100 and small.evictions >= 150 and "V249" in small.slots and "V0" not in small.slots
+
+def test_score_derives_missing_velocity_fields():
+    """/score fills the velocity fields it is not given from what it has already seen"""
+    base = dict(amount=120.0, merchant_category="grocery", device_id="DX1", geo_lat=37.7, geo_lon=-122.4,
+                user_id="feature-store-user", hour_of_day=12)
+    first, second = main.score_records([Transaction(txn_id="fs1", **base), Transaction(txn_id="fs2", **base)])
+    explicit = main.score_records([Transaction(txn_id="fs3", **base, is_new_device=False, past_24h_txn_count=1,
+                                               past_7d_chargebacks=0, velocity_usd_7d=120.0)])[0]
+    assert second.model_dump() == explicit.model_dump()
+    recs = [Transaction(txn_id=f"fs{i}", **(base | {"user_id": "feature-store-user-2"})).model_dump() for i in (4, 5)]
+    main.fill_derived(recs)
+    assert recs[0]["is_new_device"] is True and recs[1]["is_new_device"] is False
+
+def test_geo_velocity_head(tmp_path):
+    """Impossible travel and region rarity drive the geo head; the density grid survives export"""
+    from services.shared import geo
+    from services.risk_api.feature_store import FeatureStore
+    from services.risk_api.registry import ModelBundle
+    assert abs(geo.haversine_km(37.7749, -122.4194, 40.7128, -74.0060) - 4129) < 10
+
+    store = FeatureStore()
+    t = 1.7e9
+    out = store.observe(["G1", "G1", "G2"], ["D", "D", "D"], [1.0] * 3, t, [37.77, 40.71, 37.0], [-122.42, -74.0, -97.0])
+    assert np.isnan(out["prev_seen"][[0, 2]]).all() and np.isclose(out["prev_lat"][1], 37.77)
+    later = store.observe(["G1"], ["D"], [1.0], t + 6 * 3600, [37.77], [-122.42])
+    assert np.isclose(later["prev_lat"][0], 40.71)
+    km, kmh = geo.travel(later["prev_lat"], later["prev_lon"], later["prev_seen"], [37.77], [-122.42], t + 6 * 3600)
+    assert 4000 < km[0] < 4200 and 650 < kmh[0] < 700  # a direct flight: suspicious, not impossible
+
+    grid = main.registry.active.geo
+    assert grid is not None and grid.total < geo.MIN_GRID_TRANSACTIONS   # synthetic bootstrap points only
+    assert grid.rarity([40.71, 25.76], [-74.0, -80.19]).max() == 0.0      # ... so no region is unusual
+    first = {"geo_lat": np.array([40.71]), "geo_lon": np.array([-74.0]), "travel_kmh": np.zeros(1),
+             "travel_known": np.zeros(1, dtype=bool)}
+    assert np.isnan(geo.geo_risk(first, grid)[0]) and geo.geo_risk(first | {"travel_known": [True]}, grid)[0] == 0.0
+    rng = np.random.default_rng(8)
+    grid = geo.DensityGrid().add(rng.normal(37, 2, 20_000), rng.normal(-97, 3, 20_000))
+    assert grid.rarity([37.0], [-97.0])[0] < 0.1 and grid.rarity([60.0], [20.0])[0] > 0.9
+    cols = {"geo_lat": np.array([37.0, 37.0]), "geo_lon": np.array([-97.0, -97.0]), "travel_kmh": np.array([0.0, 5000.0])}
+    assert geo.geo_risk(cols, grid)[0] < 0.1 and geo.geo_risk(cols, grid)[1] == 1.0
+
+    base = dict(amount=50.0, merchant_category="grocery", device_id="DG", user_id="geo-user", hour_of_day=9,
+                is_new_device=False, past_24h_txn_count=1, past_7d_chargebacks=0, velocity_usd_7d=50.0)
+    with fresh_features():
+        home, away, again = (main.score_records([Transaction(txn_id=f"g{i}", geo_lat=lat, geo_lon=lon, **base)])[0]
+                             for i, (lat, lon) in enumerate([(37.0, -97.0), (52.5, 13.4), (52.5, 13.4)]))
+    assert "geo" not in home.risk_vector   # first sight, sparse grid: no signal, no weight
+    assert away.risk_vector["geo"] == 1.0 and again.risk_vector["geo"] == 0.0
+
+    exported = ModelBundle.from_export(main.registry.active.export(tmp_path / "bundle"), {})
+    assert np.array_equal(exported.geo.counts, main.registry.active.geo.counts)
+
+def test_geo_head_keeps_decisions():
+    """With the committed artifacts (a grid too sparse to rate regions) the geo head has no signal for a
+    user's first transaction, so it neither scores nor dilutes: decisions on the Kaggle and synthetic
+    samples are those of the same weights without geo"""
+    without = {k: w for k, w in main.DEFAULT_WEIGHTS.items() if k != "geo"}
+    for txns in (kaggle_sample_transactions(), sample_transactions(2000)):
+        txns = [t.model_copy(update={"user_id": f"first-{i}"}) for i, t in enumerate(txns)]
+        with uncached(), fresh_features():
+            got = main.score_batch(txns)
+        assert not any("geo" in r.risk_vector for r in got)
+        assert [r.decision for r in got] == [main.decide(main.summarize(r.risk_vector, without)) for r in got]
+        assert [r.risk_score for r in got] == [main.summarize(r.risk_vector, without) for r in got]
+
+def test_explanations():
+    """TreeSHAP matches the shap library exactly; forest credits add up; reasons are attributions; async mode"""
+    import shap
+    from services.risk_api.explain import Explainer
+    bundle = main.registry.active
+    recs = [t.model_dump() for t in sample_transactions(300)]
+    X = bundle.encoder.encode_columns(to_columns(recs))
+    explainer = bundle.explainer
+    gb_pipe = bundle.models["behavioral"]
+    Xgb = bundle.engine.head_input("behavioral", X)
+    ours = explainer.heads["behavioral"].shap_values(Xgb)
+    theirs = shap.TreeExplainer(gb_pipe.named_steps["clf"]).shap_values(Xgb)
+    assert np.allclose(ours, theirs, rtol=0, atol=1e-12)
+    gb = bundle.engine.model("behavioral")
+    assert np.allclose(explainer.heads["behavioral"].expected_value + ours.sum(axis=1),
+                       gb.decision_function(Xgb), rtol=0, atol=1e-12)
+    iso = explainer.heads["anomaly"]
+    Xa = bundle.engine.head_input("anomaly", X)
+    credit = iso.risk_attributions(Xa)
+    assert np.allclose(credit.sum(axis=1), 0.5 - iso.model.decision_function(Xa) - iso.reference, atol=1e-12)
+
+    # a row explains the same alone as inside a batch
+    per_head = explainer.head_attributions(to_columns(recs))
+    assert set(per_head) == {"anomaly", "behavioral"} and per_head["anomaly"].shape == (len(recs), len(explainer.features))
+    again = Explainer(bundle.engine).head_attributions(to_columns(recs[:1]))
+    assert all(np.array_equal(again[h][0], per_head[h][0]) for h in per_head)
+
+    txn = one_per_user(sample_transactions(1))[0]
+    with unlimited_explain_budget(), fresh_features():
+        inline = main.score_records([txn])[0]
+    assert len(inline.reasons) == 4 and set(inline.reasons) <= set(explainer.features)
+    mode, main.EXPLAIN_MODE = main.EXPLAIN_MODE, "async"
+    try:
+        with uncached(), fresh_features():
+            deferred = main.score_records([txn])[0]
+        main.explanations.join()
+        full = main.explain(txn.txn_id)
+    finally:
+        main.EXPLAIN_MODE = mode
+    assert deferred.reasons == main.top_reasons(to_columns([txn.model_dump()]))
+    assert full["status"] == "done" and set(full["heads"]) == {"anomaly", "behavioral"}
+    assert {k: full["reasons"][k] for k in inline.reasons} == inline.reasons
+
+    # a batch that fails to explain is reported, and the worker lives on for the next one
+    from services.risk_api.explain import ExplanationWorker
+
+    class Broken:
+        def head_attributions(self, cols):
+            raise RuntimeError("boom")
+
+    worker = ExplanationWorker()
+    cols = to_columns([txn.model_dump()])
+    worker.submit(Broken(), ["bad"], cols, set(per_head), main.DEFAULT_WEIGHTS)
+    worker.join()
+    worker.submit(explainer, ["good"], cols, set(per_head), main.DEFAULT_WEIGHTS)
+    worker.join()
+    assert worker.get("bad") == {"error": "RuntimeError: boom"} and "reasons" in worker.get("good")
+    assert worker.stats()["failed"] == 1 and worker.stats()["done"] == 1
+
+def test_decision_cache():
+    """Retries get the stored decision without touching the models or the feature store; swaps invalidate"""
+    from services.risk_api.decision_cache import DecisionCache
+    from services.risk_api import registry as reg
+    txn = sample_transactions(1, seed=11)[-1].model_copy(update={"txn_id": "retry-1", "user_id": "retry-user",
+                                                                    "past_24h_txn_count": None})
+    main.decision_cache.clear()
+    before = main.decision_cache.stats()
+    evaluate, calls = main.score_fresh, []
+    main.score_fresh = lambda bundle, recs: calls.append(len(recs)) or evaluate(bundle, recs)
+    try:
+        first = main.score_records([txn])[0]
+        # the retry alone, and twice more inside a batch next to a new transaction
+        retry = main.score_records([txn])[0]
+        other = txn.model_copy(update={"txn_id": "retry-2"})
+        batch = main.score_records([txn, other, other])
+        # any changed field is a different request
+        changed = main.score_records([txn.model_copy(update={"amount": txn.amount + 1})])[0]
+    finally:
+        main.score_fresh = evaluate
+    assert retry is first and batch[0] is first and batch[1] is batch[2]
+    assert calls == [1, 1, 1]
+    assert changed is not first
+    # the retries did not count towards the user's velocity
+    assert main.feature_store.peek(["retry-user"], [txn.device_id])["past_24h_txn_count"][0] == 3
+    stats = main.decision_cache.stats()
+    assert stats["hits"] - before["hits"] == 3 and stats["entries"] == 3
+
+    main.registry.reload(force=True)
+    assert main.decision_cache.stats()["entries"] == 0
+    assert main.decision_cache.get(DecisionCache.key(txn.model_dump()), main.registry.version) is None
+
+    cache = DecisionCache(max_entries=2, ttl=60)
+    cache.put_many([("a", 1), ("b", 2), ("c", 3)], "v1")
+    assert cache.get("a", "v1") is None and cache.get("c", "v1") == 3 and cache.stats()["evicted"] == 1
+    assert cache.get("b", "v2") is None  # scored by another model version
+    expired = DecisionCache(max_entries=10, ttl=-1)
+    expired.put_many([("d", 4), ("e", 5)], "v1")
+    assert expired.get("d", "v1") is None and expired.stats()["entries"] == 0
+
+def test_calibrated_combiner(tmp_path):
+    """The trained combiner hits its target rates and serves as a weighted sum + table, batch or single"""
+    import shutil
+    from benchmarks.bench_retrain import synth_feedback
+    from services.risk_api.registry import ModelRegistry
+    from services.shared.feedback_log import FeedbackLog
+    from services.training import calibrate
+    log = FeedbackLog(tmp_path / "feedback", legacy=None, max_buffer=4096)
+    for rec in synth_feedback(3000, seed=4):
+        log.append(rec)
+    log.close()
+    models = tmp_path / "models"
+    models.mkdir()
+    for f in Path("models").glob("*.joblib"):
+        shutil.copy(f, models / f.name)
+    combiner = calibrate.train(log, models, models / "combiner.json", step_up_rate=0.1, review_rate=0.05)
+    assert combiner.meta["labels"] == 3000 and combiner.step_up <= combiner.review
+    rates = combiner.meta["rates"]
+    assert 0.049 <= rates["REVIEW"] <= 0.05 and 0.149 <= rates["STEP_UP"] + rates["REVIEW"] <= 0.15
+
+    reg = ModelRegistry(models, fmt="mmap")
+    reg.reload()
+    bundle = reg.active
+    assert bundle.combiner is not None and bundle.combiner.heads == combiner.heads
+    txns = one_per_user(sample_transactions(50, seed=9))
+    recs = [t.model_dump() for t in txns]
+    cols = to_columns(recs)
+    heads = main.compute_heads(cols, bundle.encoder.encode_columns(cols), bundle)
+    p = bundle.combiner.score(heads)
+    z = bundle.combiner.logits(heads)
+    assert np.all(np.diff(p[np.argsort(z)]) >= 0)  # calibration is monotone in the logit
+    with unlimited_explain_budget():
+        with fresh_features():
+            batch = main.score_fresh(bundle, [dict(r) for r in recs])
+        with fresh_features():
+            single = [main.score_fresh(bundle, [dict(r)])[0] for r in recs]
+    assert [b.model_dump() for b in batch] == [s.model_dump() for s in single]
+    assert [b.decision for b in batch] == bundle.combiner.decide(z)
+    assert [b.risk_score for b in batch] == p.tolist()
+
+    worker = ModelRegistry(models, fmt="mmap")
+    worker.reload()
+    assert worker.active.source == "compiled" and worker.active.combiner.to_config() == bundle.combiner.to_config()
+    cfg = bundle.combiner.to_config() | {"heads": ["behavioral", "consortium", "made_up"], "weights": [1, 1, 1]}
+    (models / "combiner.json").write_text(json.dumps(cfg))
+    assert reg.reload() != worker.version and reg.active.combiner is None  # falls back to the weights
+
+    # the training job scores through services.risk_api.scoring, without starting the API's services
+    import subprocess
+    import sys
+    script = ("import sys, services.training.calibrate, services.risk_api.backtest; "
+              "print('services.risk_api.main' in sys.modules)")
+    assert subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                          check=True).stdout.strip() == "False"
+
+def test_columnar_ingest(tmp_path):
+    """CSV chunks become typed, memory-mapped columns, cached by checksum and found again without rehashing"""
+    import os
+    from services.shared import ingest
+    src = tmp_path / "transactions.csv"
+    src.write_text("id,amount,merchant_city,zip,use_chip\n"
+                   "1,$-77.00,Beulah,58523,Swipe\n2,\"$1,234.50\",,58523,Chip\n3,$14.57,Harwood,,Chip\n"
+                   "4,$80.00,Beulah,,Online\n5,$0.99,ONLINE,10001,Swipe\n")
+    cache = tmp_path / "cache"
+    out = ingest.ingest(src, cache, chunk_rows=2)
+    cols = ingest.load_columns(out)
+    assert isinstance(cols["amount"], np.memmap) and cols["amount"].tolist() == [-77.0, 1234.5, 14.57, 80.0, 0.99]
+    assert cols["id"].dtype == np.int8 and cols["id"].tolist() == [1, 2, 3, 4, 5]
+    assert cols["zip"].dtype == np.float64 and np.isnan(cols["zip"][2]) and cols["zip"][4] == 10001
+    assert pd.isna(cols["merchant_city"][1]) and list(cols["merchant_city"].categories) == ["Beulah", "Harwood", "ONLINE"]
+    assert list(cols["use_chip"]) == ["Swipe", "Chip", "Chip", "Online", "Swipe"]
+
+    rehash, ingest.checksum = ingest.checksum, None  # an unchanged source must not be hashed again
+    try:
+        assert ingest.ingest(src, cache) == out
+    finally:
+        ingest.checksum = rehash
+    copy = tmp_path / "copy" / "transactions.csv"
+    copy.parent.mkdir()
+    copy.write_bytes(src.read_bytes())
+    assert ingest.ingest(copy, cache) == out  # same bytes: same cache
+    with open(src, "a") as f:
+        f.write("6,$5.00,Beulah,58523,Chip\n")
+    changed = ingest.ingest(src, cache)
+    assert changed != out and ingest.load_frame(src, cache)["amount"].iloc[-1] == 5.0
+
+    # a cache written by an older format is neither reused nor in the way of the fresh one
+    fmt, ingest.FORMAT = ingest.FORMAT, ingest.FORMAT - 1
+    try:
+        old = ingest.ingest(src, tmp_path / "versions")
+    finally:
+        ingest.FORMAT = fmt
+    fresh = ingest.ingest(src, tmp_path / "versions")
+    assert fresh != old and old.exists()
+    assert json.loads((fresh / "meta.json").read_text())["format"] == ingest.FORMAT
+
+    kaggle = ingest.load_frame("data/fraud_dataset.csv", tmp_path / "kaggle")
+    raw = pd.read_csv("data/fraud_dataset.csv")
+    for col in ("per_capita_income", "yearly_income", "total_debt"):
+        assert np.array_equal(kaggle[col].to_numpy(), raw[col].str.lstrip("$").astype(float).to_numpy())
+    assert (kaggle["gender"].astype(str) == raw["gender"]).all() and kaggle["credit_score"].dtype == np.int16
+    assert len(os.listdir(tmp_path / "kaggle")) == 1
+
+def test_kaggle_mapper():
+    """Frames map column-wise to the demo converter's transactions, with ids stable across processes"""
+    import subprocess
+    import sys
+    from demo import convert_kaggle_to_transaction
+    from services.shared.mapping import TransactionMapper, iter_transactions
+    df = pd.read_csv("data/fraud_sample.csv").head(200)
+    mapper = TransactionMapper()
+    recs = mapper.records(df)
+    assert recs == [convert_kaggle_to_transaction(row) for _, row in df.iterrows()]
+    assert [Transaction(**r).model_dump() for r in recs] == recs
+    assert len({r["txn_id"] for r in recs}) == len(df)
+    assert [t.model_dump() for batch in iter_transactions(df, batch_size=64) for t in batch] == recs
+
+    script = ("import pandas as pd; from services.shared.mapping import TransactionMapper; "
+              "print(TransactionMapper().records(pd.read_csv('data/fraud_sample.csv').head(200))[-1]['txn_id'])")
+    other = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                           env={**os.environ, "PYTHONHASHSEED": "123"})
+    assert other.stdout.strip() == recs[-1]["txn_id"]
+
+    raw = pd.DataFrame({"Amount": ["12.5", None], "category": ["Travel", "GAS"], "lat": [1.0, np.nan],
+                        "date": ["2010-01-01 07:30:00", "2010-01-01 23:00:00"], "new_device": [True, None]})
+    a, b = mapper.records(raw)
+    assert (a["amount"], b["amount"]) == (12.5, 100.0) and (a["merchant_category"], b["merchant_category"]) == ("travel", "gas")
+    assert (a["geo_lat"], b["geo_lat"]) == (1.0, 37.7749) and (a["hour_of_day"], b["hour_of_day"]) == (7, 23)
+    assert (a["is_new_device"], b["is_new_device"]) == (True, False) and a["velocity_usd_7d"] == 25.0
+    bare = TransactionMapper(fill_derived=False).records(raw)[0]
+    assert bare["past_24h_txn_count"] is None and bare["velocity_usd_7d"] is None and bare["is_new_device"] is True
+
+    # the Kaggle transaction table: currency text parses as the cache parses it, ids are kept
+    txns = pd.DataFrame({"id": [7475327, 7475328, None], "client_id": [1556, 561, 1556], "card_id": [2972, 4575, 2972],
+                         "amount": ["$-77.00", "$14.57", None], "date": ["2010-01-01 00:01:00"] * 3})
+    a, b, c = TransactionMapper(fill_derived=False).records(txns)
+    assert (a["amount"], b["amount"], c["amount"]) == (-77.0, 14.57, 100.0)
+    assert (a["txn_id"], a["user_id"], a["device_id"]) == ("7475327", "1556", "2972")
+    assert c["txn_id"].startswith("kaggle_") and c["user_id"] == a["user_id"]
+    try:
+        mapper.records(txns.assign(amount=["$12", "n/a", None]))
+        assert False, "an unparsable amount was replaced by the default"
+    except ValueError as e:
+        assert "'amount'" in str(e) and "n/a" in str(e)
+
+def test_offline_backtest(tmp_path):
+    """The backtest gives each row the decision /score gives it, in-process or across a pool"""
+    from services.risk_api import backtest
+    recs = [t.model_dump() | {"txn_id": f"bt-{i}", "user_id": f"bt-user-{i}"} for i, t in enumerate(sample_transactions(60))]
+    src = tmp_path / "history.csv"
+    pd.DataFrame(recs).assign(label=[i % 3 == 0 for i in range(len(recs))]).to_csv(src, index=False)
+    kw = dict(chunk_rows=16, cache_root=tmp_path / "cache", verbose=False)
+    summary = backtest.run([src], tmp_path / "inline", workers=0, **kw)
+    got = backtest.load_results(tmp_path / "inline")
+    with uncached():  # first sight of every user: no travel speed, as offline
+        served = main.score_records([Transaction(**r) for r in recs])
+    assert got["txn_id"].tolist() == [r["txn_id"] for r in recs]
+    assert got["risk_score"].tolist() == [r.risk_score for r in served]
+    assert got["decision"].tolist() == [r.decision for r in served]
+    assert got["risk_anomaly"].tolist() == [r.risk_vector["anomaly"] for r in served]
+    assert summary["rows"] == len(recs) and summary["parts"] == 5
+    assert sum(d["count"] for d in summary["decisions"].values()) == len(recs)
+    assert set(summary["by_label"]) == {"True", "False"} and "head.anomaly" in summary["stages"]
+    with np.load(tmp_path / "inline" / "timings.npz") as timings:
+        assert timings["rows"].tolist() == [16, 16, 16, 16, len(recs) - 64] and (timings["map"] > 0).all()
+
+    env = dict(os.environ)
+    backtest.run([src], tmp_path / "pool", workers=2, **kw)
+    assert backtest.load_results(tmp_path / "pool").equals(got) and dict(os.environ) == env
+    strict = backtest.run([src], tmp_path / "strict", workers=0, low=0.0, high=0.0, **kw)
+    assert strict["decisions"]["REVIEW"]["count"] == len(recs)
+    assert backtest.load_results(tmp_path / "strict")["risk_score"].equals(got["risk_score"])
+    assert backtest.run([src], tmp_path / "again", workers=0, **kw)["decisions"] == summary["decisions"]
+
+def test_hyperparameter_search(tmp_path):
+    """Candidates share one memory-mapped matrix, are validated on time splits and only promoted when
+    they beat the incumbent on AUC and p99 latency"""
+    import joblib
+    from benchmarks.bench_retrain import synth_feedback
+    from services.shared.feedback_log import FeedbackLog
+    from services.training import retrain, search
+    assert search.time_folds(10, 3) == [(2, 5), (5, 7), (7, 10)]
+    space = {"n_estimators": [10, 20], "max_depth": [1, 2]}
+    assert len(search.candidates(space)) == 4 and len(search.candidates(space, n_random=3)) == 3
+    fast, slow = {"auc": 0.8, "p99_us": 50.0}, {"auc": 0.9, "p99_us": 500.0}
+    assert search.should_promote(slow, fast)[0] is False and search.should_promote(fast, slow)[0] is False
+    assert search.should_promote({"auc": 0.9, "p99_us": 40.0}, fast)[0] is True
+
+    log = FeedbackLog(tmp_path / "feedback", legacy=None, max_buffer=4096)
+    for rec in synth_feedback(600, seed=6):
+        log.append(rec)
+    log.close()
+    paths = {"model": tmp_path / "gb.joblib", "state": tmp_path / "state.joblib"}
+    retrain.train_full(log, **paths)
+    before = paths["model"].read_bytes()
+    kw = dict(space=space, folds=2, workers=2, report=tmp_path / "report.json", **paths)
+    kept = search.search(log, min_gain=1.0, **kw)
+    assert not kept["promoted"] and paths["model"].read_bytes() == before
+    assert not retrain.params_path(paths["model"]).exists()
+    assert kept["incumbent"]["params"] == {} and len(kept["candidates"]) == 4 and kept["folds"] == [(200, 400), (400, 600)]
+    assert all(len(c["fold_auc"]) == 2 and c["p99_us"] > 0 for c in kept["candidates"])
+    assert json.loads((tmp_path / "report.json").read_text())["reason"] == kept["reason"]
+
+    # each fold's vocabulary comes from its training rows: a category first seen in validation adds no column
+    df = retrain.load_feedback(log)
+    X = search.encode(df, 200, 400)
+    leaked = df.assign(merchant_category=df["merchant_category"].where(df.index < 200, "only-in-validation"))
+    X2 = search.encode(leaked, 200, 400)
+    assert X.shape == X2.shape == (400, X.shape[1]) and np.array_equal(X[:200], X2[:200])
+
+    promoted = search.search(log, min_gain=-1.0, latency_tolerance=float("inf"), **kw)
+    assert promoted["promoted"]
+    best = promoted["best"]["params"]
+    assert retrain.load_params(paths["model"]) == {**best, "random_state": 0}
+    clf = joblib.load(paths["model"]).named_steps["clf"]
+    assert (clf.n_estimators, clf.max_depth) == (best["n_estimators"], best["max_depth"])
+
+    # the promoted params (with their random_state) are the next search's incumbent
+    again = search.search(log, min_gain=1.0, **kw)
+    assert again["incumbent"]["params"] == {**best, "random_state": 0} and not again["promoted"]
+
+def test_budget_compile(tmp_path):
+    """Models are pruned to a footprint budget without changing how the survivors score, and the registry
+    checks budget.json (hashes, footprint) at load"""
+    import shutil
+    import joblib
+    from services.risk_api.registry import MODEL_FILES, ModelRegistry
+    from services.training import budget
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in MODEL_FILES.values():
+        if Path("models", name).exists():
+            shutil.copy2(Path("models", name), src / name)
+    reference = budget.reference_rows(64)
+    kw = dict(p99_us=1e6, reference=reference, calls=50, verbose=False)
+
+    loose = budget.compile_budget(src, tmp_path / "loose", max_bytes=64 << 20, **kw)
+    assert loose["within_budget"] and not loose["problems"] and loose["measured"]["p99_us"] > 0
+    assert all(h["trees"] == h["trees_before"] for h in loose["heads"].values() if h["trees"] is not None)
+    assert (tmp_path / "loose" / MODEL_FILES["anomaly"]).read_bytes() == (src / MODEL_FILES["anomaly"]).read_bytes()
+    # the deployed models are never rewritten unless asked to
+    budget.compile_budget(src, max_bytes=64 << 20, **kw)
+    assert (tmp_path / "src-budgeted" / budget.BUDGET_FILE).exists() and not (src / budget.BUDGET_FILE).exists()
+    try:
+        budget.compile_budget(src, src, max_bytes=64 << 20, **kw)
+        assert False, "compiled over the source models without in_place"
+    except ValueError as e:
+        assert "in_place" in str(e) and not (src / budget.BUDGET_FILE).exists()
+    reg = ModelRegistry(tmp_path / "loose", budget="enforce")
+    reg.reload()
+    assert reg.info()["budget"]["problems"] == [] and reg.info()["budget"]["load_p99_us"] > 0
+
+    size = loose["measured"]["bytes"]
+    tight = budget.compile_budget(src, tmp_path / "tight", max_bytes=size // 2, max_drift=1.0, **kw)
+    assert tight["within_budget"] and tight["measured"]["bytes"] <= size // 2
+    anomaly = tight["heads"]["anomaly"]
+    assert budget.MIN_TREES <= anomaly["trees"] < anomaly["trees_before"]
+    iso = joblib.load(tmp_path / "tight" / MODEL_FILES["anomaly"]).named_steps["iso"]
+    assert len(iso.estimators_) == anomaly["trees"]
+    pruned = ModelRegistry(tmp_path / "tight", budget="enforce").load_bundle()
+    pruned.forest.check_equivalence(pruned.encoder.encode_columns(reference))   # bit-equal to sklearn
+
+    # a model swapped in after the compile no longer matches its recorded hash
+    shutil.copy2(tmp_path / "tight" / MODEL_FILES["anomaly"], tmp_path / "loose" / MODEL_FILES["anomaly"])
+    bundle = ModelRegistry(tmp_path / "loose", budget="off").load_bundle()
+    assert any("anomaly model is not the one budgeted" in p for p in bundle.check_budget(measure=False))
+    version = reg.version
+    assert reg.reload() == version and "breaks its budget" in reg.last_error
+    assert ModelRegistry(src, budget="warn").load_bundle().budget_problems is None   # no budget.json: nothing to warn
+    try:
+        ModelRegistry(src, budget="enforce").load_bundle()
+        assert False, "enforce loaded models without a budget"
+    except ValueError as e:
+        assert "no budget.json" in str(e)
+    assert budget.compile_budget(src, max_bytes=64 << 20, in_place=True, **kw)["within_budget"]
+    assert ModelRegistry(src, budget="enforce").load_bundle().budget_problems == []
+
+def test_latency_histograms():
+    """HDR buckets stay within 3% of exact percentiles, merge across threads, and /score feeds every stage"""
+    import threading
+    from fastapi.testclient import TestClient
+    from services.shared.latency import LatencyHistogram
+    rng = np.random.default_rng(5)
+    values = rng.lognormal(12, 1.2, 40_000).astype(np.int64)
+    h = LatencyHistogram()
+    threads = [threading.Thread(target=lambda part: [h.record(v) for v in part.tolist()], args=(part,))
+               for part in np.array_split(values, 4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    s = h.summary()
+    assert s["count"] == len(values) and s["max_ms"] == values.max() / 1e6
+    for q in (50, 95, 99):
+        exact = np.percentile(values, q, method="inverted_cdf") / 1e6
+        assert abs(s[f"p{q}_ms"] - exact) <= 0.03 * exact
+
+    main.metrics.reset()
+    client = TestClient(main.app)  # not as a context manager: no startup/shutdown handlers
+    txn = one_per_user(sample_transactions(1))[0]
+    assert client.post("/score", json=txn.model_dump()).status_code == 200
+    assert client.post("/score/batch", json=[t.model_dump() for t in sample_transactions(20)]).status_code == 200
+    summary = client.get("/metrics/latency").json()
+    text = client.get("/metrics").text
+    stages = {"feature_store", "frame", "head.anomaly", "head.behavioral", "head.network", "head.geo", "vector",
+              "explain", "summarize", "decide", "serialize", "score_records", "http POST /score",
+              "http POST /score/batch"}
+    assert stages <= set(summary) and summary["score_records"]["count"] == 2
+    assert 'sentinel_stage_latency_seconds{stage="head.anomaly",quantile="0.99"}' in text
+
+def test_load_suite_in_process(tmp_path):
+    """The load generator drives every scenario in process and flags regressions against a baseline"""
+    import asyncio
+    from benchmarks import bench_api
+    from services.risk_api import main
+    from services.shared.feedback_log import FeedbackLog
+    saved, main.feedback_log = main.feedback_log, FeedbackLog(tmp_path / "feedback", legacy=None)
+    try:
+        scenarios = asyncio.run(bench_api.run_in_process(list(bench_api.SCENARIOS), requests=48, batch=8,
+                                                         concurrency=4, warmup=4))
+    finally:
+        main.feedback_log.close()
+        main.feedback_log = saved
+    assert set(scenarios) == {"score", "score_batch", "feedback"}
+    for name, s in scenarios.items():
+        assert s["errors"] == 0 and s["p50_ms"] <= s["p99_ms"] <= s["max_ms"] and s["rps"] > 0
+    assert scenarios["score"]["requests"] == 48 and scenarios["score_batch"]["txn_per_s"] > scenarios["score_batch"]["rps"]
+    assert scenarios["score"]["stages"]["score_records"]["count"] >= 1
+    assert scenarios["feedback"]["stages"]["http POST /feedback"]["count"] == 48
+
+    results = {"meta": {"target": "inprocess"}, "scenarios": scenarios}
+    slower = {"meta": {"target": "inprocess"},
+              "scenarios": {"score": dict(scenarios["score"], p99_ms=scenarios["score"]["p99_ms"] * 2)}}
+    cmp = bench_api.compare(slower, results, max_regression=0.5)
+    assert cmp["regressions"] == [f"score.p99_ms {1.0:+.1%}"] and "differs" not in cmp
+    assert bench_api.compare(results, results, max_regression=0.0)["regressions"] == []
+
+if __name__ == "__main__":
+    test_encoder_matches_pipeline()
+    test_compiled_forest_matches_sklearn()
+    test_learned_heads_match_pipelines()
+    test_batch_matches_single()
+    test_batch_empty()
+    test_micro_batcher_coalesces_concurrent_requests()
+    test_micro_batcher_backpressure()
+    import tempfile
+    with tempfile.TemporaryDirectory() as d:
+        test_registry_hot_swap(Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_mmap_export_roundtrip(Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_feedback_log_segments_and_incremental_reads(Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_incremental_retrain(Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_streamed_bootstrap(Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_fedavg_rounds(Path(d))
+    test_federated_wire_format()
+    test_async_coordinator_quorum_and_deadline()
+    with tempfile.TemporaryDirectory() as d:
+        test_feature_store_windows(Path(d))
+    test_score_derives_missing_velocity_fields()
+    with tempfile.TemporaryDirectory() as d:
+        test_geo_velocity_head(Path(d))
+    test_geo_head_keeps_decisions()
+    test_explanations()
+    test_decision_cache()
+    with tempfile.TemporaryDirectory() as d:
+        test_columnar_ingest(Path(d))
+    test_kaggle_mapper()
+    with tempfile.TemporaryDirectory() as d:
+        test_offline_backtest(Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_hyperparameter_search(Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_budget_compile(Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_calibrated_combiner(Path(d))
+    test_latency_histograms()
+    with tempfile.TemporaryDirectory() as d:
+        test_load_suite_in_process(Path(d))
+    print("✅ Scoring tests passed")